@@ -10,6 +10,16 @@ TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# ===== ПУЛ СОЕДИНЕНИЙ POSTGRES =====
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "10"))  # Сек. ожидания свободного соединения
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "60"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))  # Только при прямом подключении
+DB_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_MAX_INACTIVE_LIFETIME", "300"))
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "auto").lower()  # auto | true | false
+DB_SSL = os.getenv("DB_SSL", "true").lower() == "true"
+
 # ===== АДМИНИСТРАТОРЫ (БЕЗОПАСНАЯ ЗАГРУЗКА) =====
 # Бот попытается найти их в настройках сервера. Если нет - список будет пуст.
 ADMIN_IDS: List[int] = [] 
@@ -26,16 +36,142 @@ SECRET_PROMO_CODE = os.getenv("SECRET_PROMO_CODE", "FOOD2025")
 # ===== НАСТРОЙКИ LLM =====
 GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
 GROQ_MAX_TOKENS = int(os.getenv("GROQ_MAX_TOKENS", "1000"))
+GROQ_MODEL_FAST = os.getenv("GROQ_MODEL_FAST", "llama-3.1-8b-instant")
+GROQ_MAX_TOKENS_PREMIUM = int(os.getenv("GROQ_MAX_TOKENS_PREMIUM", "1600"))  # Рецепт + блок КБЖУ
+GROQ_MAX_TOKENS_CAP = int(os.getenv("GROQ_MAX_TOKENS_CAP", "3000"))  # Потолок для рецептов
+
+# Маршрутизация по типу задачи: классификация и списки - быстрая модель, рецепты - большая
+GROQ_ROUTES = {
+    "analysis":       {"model": GROQ_MODEL_FAST, "max_tokens": 300,  "max_tokens_cap": 600,  "timeout": 15.0, "fallback": GROQ_MODEL},
+    "fused_analysis": {"model": GROQ_MODEL_FAST, "max_tokens": 1200, "max_tokens_cap": 2000, "timeout": 20.0, "fallback": GROQ_MODEL},
+    "dish_list":      {"model": GROQ_MODEL_FAST, "max_tokens": 600,  "max_tokens_cap": 1200, "timeout": 15.0, "fallback": GROQ_MODEL},
+    "recipe":         {"model": GROQ_MODEL,      "max_tokens": GROQ_MAX_TOKENS, "max_tokens_cap": GROQ_MAX_TOKENS_CAP,
+                       "timeout": 60.0, "fallback": GROQ_MODEL_FAST},
+    "recipe_premium": {"model": GROQ_MODEL,      "max_tokens": GROQ_MAX_TOKENS_PREMIUM, "max_tokens_cap": GROQ_MAX_TOKENS_CAP,
+                       "timeout": 60.0, "fallback": GROQ_MODEL_FAST},
+    "default":        {"model": GROQ_MODEL,      "max_tokens": GROQ_MAX_TOKENS, "timeout": 60.0, "fallback": None},
+}
+# Бюджет токенов: max_tokens маршрута подстраивается под наблюдаемую длину ответов
+TOKEN_BUDGET_ENABLED = os.getenv("TOKEN_BUDGET_ENABLED", "true").lower() == "true"
+TOKEN_BUDGET_PERCENTILE = float(os.getenv("TOKEN_BUDGET_PERCENTILE", "0.95"))
+TOKEN_BUDGET_HEADROOM = float(os.getenv("TOKEN_BUDGET_HEADROOM", "1.3"))  # Запас сверх перцентиля
+TOKEN_BUDGET_MIN_SAMPLES = int(os.getenv("TOKEN_BUDGET_MIN_SAMPLES", "30"))
+TOKEN_BUDGET_MIN_TOKENS = int(os.getenv("TOKEN_BUDGET_MIN_TOKENS", "128"))
+TOKEN_BUDGET_HISTORY_DAYS = int(os.getenv("TOKEN_BUDGET_HISTORY_DAYS", "7"))
+# Лимиты тарифа Groq и очередь запросов
+GROQ_RPM = int(os.getenv("GROQ_RPM", "30"))            # запросов в минуту
+GROQ_TPM = int(os.getenv("GROQ_TPM", "6000"))          # токенов в минуту
+# Groq считает лимиты отдельно для каждой модели: у каждой модели маршрутов свои ведра RPM/TPM
+GROQ_MODEL_LIMITS = {
+    GROQ_MODEL: {"rpm": GROQ_RPM, "tpm": GROQ_TPM},
+    GROQ_MODEL_FAST: {"rpm": int(os.getenv("GROQ_RPM_FAST", str(GROQ_RPM))),
+                      "tpm": int(os.getenv("GROQ_TPM_FAST", str(GROQ_TPM)))},
+}
+GROQ_MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", "8"))
+GROQ_MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", "3"))  # повторы при 429
 TEMP_DIR = os.getenv("TEMP_DIR", "/tmp/chef_bot")
 
+# Предохранитель (circuit breaker) для моделей Groq
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))  # доля ошибок/медленных ответов
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_SLOW_CALL_SEC = float(os.getenv("BREAKER_SLOW_CALL_SEC", "20"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+
+# Хеджирование коротких JSON-запросов: вторая попытка после p95 задержки
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_ROUTES = [x.strip() for x in os.getenv("HEDGE_ROUTES", "analysis,dish_list").split(",") if x.strip()]
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+
+# Потоковая генерация рецептов (правка сообщения по мере прихода токенов)
+GROQ_STREAMING = os.getenv("GROQ_STREAMING", "true").lower() == "true"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))  # Telegram: ~1 edit/сек на чат
+
 # ===== КЭШ =====
 CACHE_TTL_RECIPE = 3600
 CACHE_TTL_ANALYSIS = 86400
 CACHE_TTL_VALIDATION = 86400
 CACHE_TTL_INTENT = 86400
 CACHE_TTL_DISH_LIST = 3600
+# "Это не продукты" для канонического ввода: только явный отказ модели и ненадолго - промпты и модели меняются
+CACHE_TTL_NEGATIVE = int(os.getenv("CACHE_TTL_NEGATIVE", "900"))
+
+# Локальный пре-фильтр ввода: явный мусор (нет слов, вставленный длинный текст) не уходит в Groq и не тратит лимит
+PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "true").lower() == "true"
+PREFILTER_MAX_CHARS = int(os.getenv("PREFILTER_MAX_CHARS", "1000"))  # Длиннее - вставленный текст, не список
+
+# Размер таблицы groq_cache: при превышении вытесняем по LRU (last_hit_at) или LFU (hits)
+GROQ_CACHE_MAX_BYTES = int(os.getenv("GROQ_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+GROQ_CACHE_EVICTION = os.getenv("GROQ_CACHE_EVICTION", "lru")  # lru | lfu
+GROQ_CACHE_EVICT_TO = float(os.getenv("GROQ_CACHE_EVICT_TO", "0.9"))  # Чистим до 90% бюджета
+# Попадания L2 (hits/last_hit_at) копятся в памяти и пишутся одним UPDATE через write-behind
+CACHE_HIT_FLUSH_INTERVAL = float(os.getenv("CACHE_HIT_FLUSH_INTERVAL", "30"))  # сек.
+CACHE_HIT_FLUSH_BATCH = int(os.getenv("CACHE_HIT_FLUSH_BATCH", "500"))  # Ключей - сбросить раньше
+
+# Фильтр Блума живых ключей groq_cache: точные промахи не ходят в БД
+BLOOM_ENABLED = os.getenv("BLOOM_ENABLED", "true").lower() == "true"
+BLOOM_CAPACITY = int(os.getenv("BLOOM_CAPACITY", "200000"))
+BLOOM_ERROR_RATE = float(os.getenv("BLOOM_ERROR_RATE", "0.01"))
+
+# In-process L1 кэш перед groq_cache (Postgres)
+L1_CACHE_MAX_ENTRIES = int(os.getenv("L1_CACHE_MAX_ENTRIES", "2000"))
+L1_CACHE_MAX_BYTES = int(os.getenv("L1_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Объединённый анализ (категории + блюда одним запросом). Выключен по умолчанию: он заменяет
+# двухшаговый режим с предзагрузкой. Включать по языкам после сравнения latency в /admin
+FUSED_PIPELINE_ENABLED = os.getenv("FUSED_PIPELINE_ENABLED", "false").lower() == "true"
+FUSED_PIPELINE_LANGS = [x.strip() for x in os.getenv("FUSED_PIPELINE_LANGS", "").split(",") if x.strip()]
+
+# Спекулятивная предзагрузка списков блюд после анализа категорий
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+PREFETCH_TOP_N = int(os.getenv("PREFETCH_TOP_N", "2"))
+PREFETCH_MAX_INFLIGHT = int(os.getenv("PREFETCH_MAX_INFLIGHT", "10"))  # Общий бюджет фоновых запросов
+PREFETCH_FREE_MAX_LOAD = int(os.getenv("PREFETCH_FREE_MAX_LOAD", "5"))  # Выше этой нагрузки free-юзеров не прогреваем
+
+# Прогрев кэша популярных прямых рецептов ("рецепт лазаньи")
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_TOP_N = int(os.getenv("WARMUP_TOP_N", "10"))  # Блюд на язык
+WARMUP_HISTORY_DAYS = int(os.getenv("WARMUP_HISTORY_DAYS", "14"))
+WARMUP_START_HOUR = int(os.getenv("WARMUP_START_HOUR", "2"))  # Непиковые часы (МСК): полный прогрев
+WARMUP_END_HOUR = int(os.getenv("WARMUP_END_HOUR", "7"))
+WARMUP_INTERVAL = int(os.getenv("WARMUP_INTERVAL", "600"))  # Сек. между проходами
+WARMUP_REFRESH_MARGIN = int(os.getenv("WARMUP_REFRESH_MARGIN", "900"))  # Обновляем, если до истечения меньше
+WARMUP_MAX_PER_RUN = int(os.getenv("WARMUP_MAX_PER_RUN", "20"))
+WARMUP_MAX_LOAD = int(os.getenv("WARMUP_MAX_LOAD", "2"))  # Выше этой нагрузки Groq проход пропускаем
+
+# Приблизительный кэш (MinHash/LSH) для почти одинаковых наборов продуктов - по умолчанию выключен
+SIMILARITY_CACHE_ENABLED = os.getenv("SIMILARITY_CACHE_ENABLED", "false").lower() == "true"
+SIMILARITY_CACHE_TYPES = [x.strip() for x in os.getenv("SIMILARITY_CACHE_TYPES", "analysis,dish_list").split(",") if x.strip()]
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.8"))  # Порог сходства Жаккара
+SIMILARITY_CACHE_MAX_ENTRIES = int(os.getenv("SIMILARITY_CACHE_MAX_ENTRIES", "5000"))
+
+# Фоновая запись кэша и метрик (write-behind)
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "2000"))
+WRITE_BEHIND_WORKERS = int(os.getenv("WRITE_BEHIND_WORKERS", "2"))
+WRITE_BEHIND_OVERFLOW = os.getenv("WRITE_BEHIND_OVERFLOW", "drop_oldest")  # или drop_new
+
+# Пакетная запись метрик (COPY): сброс по числу событий или по времени
+METRICS_BATCH_SIZE = int(os.getenv("METRICS_BATCH_SIZE", "200"))
+METRICS_FLUSH_MS = int(os.getenv("METRICS_FLUSH_MS", "2000"))
+METRICS_BUFFER_MAX = int(os.getenv("METRICS_BUFFER_MAX", "10000"))
+METRICS_OVERFLOW = os.getenv("METRICS_OVERFLOW", "drop_oldest")  # или drop_new
+# Таблица metrics разбита на секции по времени: старые секции удаляются целиком, без DELETE
+METRICS_PARTITION_DAYS = int(os.getenv("METRICS_PARTITION_DAYS", "7"))  # 1 - по дням, 7 - по неделям (с понедельника)
+METRICS_PARTITIONS_AHEAD = int(os.getenv("METRICS_PARTITIONS_AHEAD", "2"))  # Секции, созданные заранее
+METRICS_RETENTION_DAYS = int(os.getenv("METRICS_RETENTION_DAYS", "30"))
+# Сколько миграция секций ждёт эксклюзивную блокировку metrics, прежде чем отложить перевод до рестарта
+METRICS_MIGRATION_LOCK_TIMEOUT_MS = int(os.getenv("METRICS_MIGRATION_LOCK_TIMEOUT_MS", "5000"))
+# Клиентский таймаут долгих шагов (VALIDATE, CREATE INDEX CONCURRENTLY) вместо DB_COMMAND_TIMEOUT пула, сек.
+METRICS_MIGRATION_TIMEOUT = float(os.getenv("METRICS_MIGRATION_TIMEOUT", "21600"))
+METRICS_DETACH_RETRIES = int(os.getenv("METRICS_DETACH_RETRIES", "3"))  # Попыток отцепить секцию за одну очистку
 
 FAVORITES_PER_PAGE = int(os.getenv("FAVORITES_PER_PAGE", "5"))
+FAVORITES_COUNT_CACHE_SIZE = int(os.getenv("FAVORITES_COUNT_CACHE_SIZE", "50000"))
+FAVORITES_COUNT_TTL = int(os.getenv("FAVORITES_COUNT_TTL", "3600"))  # Счётчик сбрасывается и при изменениях избранного
+
+# Процессный кэш профилей (язык, премиум): хендлерам не нужен SELECT * FROM users на каждый апдейт
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "50000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "600"))  # Верхняя граница устаревания при правках в обход бота
 
 # Поддерживаемые языки
 SUPPORTED_LANGUAGES = ["en", "de", "fr", "it", "es"]
@@ -56,6 +192,19 @@ PREMIUM_USER_LIMITS = {
 
 TRIAL_DELAY_HOURS = 48
 TRIAL_DURATION_DAYS = 7
+TRIAL_NOTIFY_CHUNK = int(os.getenv("TRIAL_NOTIFY_CHUNK", "200"))  # Столько уведомлений помечаем отправленными за раз
+
+# Массовая отправка сообщений: общий лимит Telegram ~30/сек на бота, в один чат ~1/сек
+TELEGRAM_SEND_RATE = float(os.getenv("TELEGRAM_SEND_RATE", "25"))
+TELEGRAM_SEND_CONCURRENCY = int(os.getenv("TELEGRAM_SEND_CONCURRENCY", "10"))
+TELEGRAM_PER_CHAT_INTERVAL = float(os.getenv("TELEGRAM_PER_CHAT_INTERVAL", "1.0"))
+TELEGRAM_SEND_RETRIES = int(os.getenv("TELEGRAM_SEND_RETRIES", "3"))
+
+# Рассылка /broadcast: получатели читаются серверным курсором, прогресс сохраняется в таблице broadcasts
+BROADCAST_CURSOR_ROWS = int(os.getenv("BROADCAST_CURSOR_ROWS", "2000"))  # Строк на один открытый курсор
+BROADCAST_PREFETCH = int(os.getenv("BROADCAST_PREFETCH", "200"))
+BROADCAST_CHECKPOINT_INTERVAL = float(os.getenv("BROADCAST_CHECKPOINT_INTERVAL", "5"))  # сек.
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "15"))  # Обновление статуса у админа
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 LOG_FILE = "bot.log"
@@ -1,39 +1,97 @@
+import asyncio
 import asyncpg
+import json
 import logging
 import ssl
-from typing import Optional
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
 from contextlib import asynccontextmanager
+from urllib.parse import urlparse
 
-from config import DATABASE_URL
+from config import (
+    DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_ACQUIRE_TIMEOUT, DB_COMMAND_TIMEOUT,
+    DB_STATEMENT_TIMEOUT_MS, DB_MAX_INACTIVE_LIFETIME, DB_PGBOUNCER, DB_SSL
+)
 
 logger = logging.getLogger(__name__)
 
+SUPABASE_POOLER_PORT = 6543
+
+def is_pgbouncer(dsn: str) -> bool:
+    """Идёт ли подключение через pgbouncer (пулер Supabase: порт 6543 / хост *.pooler.*)."""
+    if DB_PGBOUNCER in ("true", "false"):
+        return DB_PGBOUNCER == "true"
+    try:
+        url = urlparse(dsn or "")
+        return url.port == SUPABASE_POOLER_PORT or "pooler." in (url.hostname or "")
+    except ValueError:
+        return True  # Не смогли разобрать DSN - безопасный вариант без prepared statements
+
+# Бинарный формат jsonb: байт версии (1) + JSON-текст в UTF-8
+_JSONB_VERSION = b"\x01"
+
+def _encode_jsonb(value: Any) -> bytes:
+    # Репозитории передают и готовые JSON-строки (metrics), и dict/list
+    text = value if isinstance(value, str) else json.dumps(value, default=str)
+    return _JSONB_VERSION + text.encode("utf-8")
+
+def _decode_jsonb(data: bytes) -> Any:
+    return json.loads(data[1:].decode("utf-8"))
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    """Настройка каждого нового соединения пула."""
+    # Кодек в бинарном формате: его использует и COPY (copy_records_to_table), текстовый там не работает
+    await conn.set_type_codec('jsonb', encoder=_encode_jsonb, decoder=_decode_jsonb,
+                              schema='pg_catalog', format='binary')
+
 class Database:
-    """Класс для управления подключением к Supabase"""
+    """Единый пул соединений с Postgres (Supabase) для всех репозиториев"""
 
     _pool: Optional[asyncpg.Pool] = None
+    _lock: Optional[asyncio.Lock] = None
+    pgbouncer: bool = True
+
+    # Метрики пула: ожидание свободного соединения и занятые соединения
+    _waits: Deque[float] = deque(maxlen=1000)
+    _in_use: int = 0
+    _counters: Dict[str, int] = {"acquired": 0, "acquire_timeouts": 0, "max_in_use": 0}
 
     @classmethod
     async def connect(cls):
         """Создаёт пул подключений к базе данных"""
-        if cls._pool is None:
-            try:
+        if cls._lock is None:
+            cls._lock = asyncio.Lock()
+        async with cls._lock:
+            if cls._pool is not None:
+                return
+            cls.pgbouncer = is_pgbouncer(DATABASE_URL)
+            kwargs: Dict[str, Any] = {}
+            if DB_SSL:
                 # Настройка SSL для Supabase (критично для удаленных БД)
                 ctx = ssl.create_default_context()
                 ctx.check_hostname = False
                 ctx.verify_mode = ssl.CERT_NONE
+                kwargs["ssl"] = ctx
+            if cls.pgbouncer:
+                # pgbouncer (transaction mode) не переносит prepared statements между соединениями
+                # и отвергает лишние стартовые параметры - statement_timeout не передаём
+                kwargs["statement_cache_size"] = 0
+            else:
+                kwargs["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
 
+            try:
                 cls._pool = await asyncpg.create_pool(
                     dsn=DATABASE_URL,
-                    min_size=1,
-                    max_size=10,
-                    command_timeout=60,
-                    ssl=ctx,
-                    # ИСПРАВЛЕНИЕ КРИТИЧЕСКОЙ ОШИБКИ
-                    # Отключаем кэширование Prepared Statements для совместимости с PGBouncer
-                    statement_cache_size=0 
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    command_timeout=DB_COMMAND_TIMEOUT,
+                    max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+                    init=_init_connection,
+                    **kwargs
                 )
-                logger.info("✅ Подключение к Supabase установлено")
+                mode = "pgbouncer" if cls.pgbouncer else "direct, statement cache on"
+                logger.info(f"✅ Подключение к Supabase установлено ({mode}, pool {DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE})")
             except Exception as e:
                 logger.error(f"❌ Ошибка подключения к Supabase: {e}")
                 raise
@@ -42,16 +100,13 @@ class Database:
     async def test_connection(cls) -> bool:
         """Проверяет работоспособность подключения, выполняя простой запрос."""
         try:
-            # Пытаемся получить соединение и выполнить простейший запрос
             async with cls.connection() as conn:
                 result = await conn.fetchval("SELECT 1")
                 return result == 1
         except Exception as e:
-            # ЭТА ОШИБКА БОЛЬШЕ НЕ ДОЛЖНА ПОЯВЛЯТЬСЯ
             logger.error(f"Не удалось протестировать подключение к БД: {e}")
             return False
 
-
     @classmethod
     async def close(cls):
         """Закрывает пул подключений"""
@@ -63,13 +118,43 @@ class Database:
     @classmethod
     @asynccontextmanager
     async def connection(cls):
-        """Контекстный менеджер для получения соединения"""
+        """Контекстный менеджер для получения соединения (с таймаутом ожидания и учётом метрик)"""
         # Убеждаемся, что пул создан
         if cls._pool is None:
             await cls.connect()
 
-        async with cls._pool.acquire() as conn:
+        started = time.monotonic()
+        try:
+            conn = await cls._pool.acquire(timeout=DB_ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            cls._counters["acquire_timeouts"] += 1
+            logger.error(f"⏳ Пул БД исчерпан: нет свободного соединения за {DB_ACQUIRE_TIMEOUT} сек. ({cls._in_use} занято)")
+            raise
+        cls._waits.append(time.monotonic() - started)
+        cls._counters["acquired"] += 1
+        cls._in_use += 1
+        cls._counters["max_in_use"] = max(cls._counters["max_in_use"], cls._in_use)
+        try:
             yield conn
+        finally:
+            cls._in_use -= 1
+            await cls._pool.release(conn)
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        """Размер пула, занятые соединения и время ожидания соединения (мс)."""
+        waits = sorted(cls._waits)
+        p95 = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        return {
+            "size": cls._pool.get_size() if cls._pool else 0,
+            "idle": cls._pool.get_idle_size() if cls._pool else 0,
+            "max_size": DB_POOL_MAX_SIZE,
+            "in_use": cls._in_use,
+            "wait_avg_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "wait_p95_ms": round(p95 * 1000, 1),
+            "pgbouncer": cls.pgbouncer,
+            **cls._counters,
+        }
 
     @classmethod
     async def execute(cls, query: str, *args):
@@ -96,4 +181,4 @@ class Database:
             return await conn.fetchval(query, *args)
 
 # Глобальный экземпляр для импорта
-db = Database()
\ No newline at end of file
+db = Database()
@@ -0,0 +1,42 @@
+import hashlib
+import math
+from typing import Dict
+
+class BloomFilter:
+    """Фильтр Блума: "точно нет" или "возможно есть". Удаление не поддерживается - только пересборка."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        # Оптимальные размер битового массива и число хэш-функций
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        # Двойное хэширование (Kirsch-Mitzenmacher) вместо k независимых функций
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def expected_fp_rate(self) -> float:
+        """Теоретическая вероятность ложного срабатывания при текущем заполнении."""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "keys": self.count,
+            "capacity": self.capacity,
+            "size_kb": round(len(self._bits) / 1024, 1),
+            "expected_fp_rate": round(self.expected_fp_rate(), 4),
+        }
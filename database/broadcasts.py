@@ -0,0 +1,113 @@
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from . import db
+from config import BROADCAST_CURSOR_ROWS, BROADCAST_PREFETCH
+
+logger = logging.getLogger(__name__)
+
+# Фильтр получателей: языки (NULL - все) и премиум-статус (NULL - все)
+_RECIPIENTS_FILTER = """
+    ($1::text[] IS NULL OR language_code = ANY($1::text[]))
+    AND ($2::boolean IS NULL OR is_premium = $2::boolean)
+"""
+
+class BroadcastRepository:
+    """Рассылки: параметры, статус и контрольная точка (последний обработанный user_id)"""
+
+    @staticmethod
+    async def ensure_schema() -> None:
+        """Таблица рассылок (идемпотентно, при старте)."""
+        try:
+            async with db.connection() as conn:
+                await conn.execute("""
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id BIGSERIAL PRIMARY KEY,
+                    created_by BIGINT NOT NULL,
+                    texts JSONB NOT NULL,
+                    languages TEXT[],
+                    premium BOOLEAN,
+                    status TEXT NOT NULL DEFAULT 'running',
+                    last_user_id BIGINT NOT NULL DEFAULT 0,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    sent INTEGER NOT NULL DEFAULT 0,
+                    blocked INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    finished_at TIMESTAMPTZ
+                );
+                CREATE INDEX IF NOT EXISTS idx_broadcasts_running ON broadcasts (id) WHERE status = 'running';
+                """)
+        except Exception as e:
+            logger.error(f"Ошибка миграции broadcasts: {e}", exc_info=True)
+
+    @staticmethod
+    async def count_recipients(languages: Optional[List[str]], premium: Optional[bool]) -> int:
+        async with db.connection() as conn:
+            return await conn.fetchval(f"SELECT COUNT(*) FROM users WHERE {_RECIPIENTS_FILTER}", languages, premium)
+
+    @staticmethod
+    async def create(created_by: int, texts: Dict[str, str], languages: Optional[List[str]],
+                     premium: Optional[bool], total: int) -> Dict[str, Any]:
+        async with db.connection() as conn:
+            row = await conn.fetchrow(
+                """
+                INSERT INTO broadcasts (created_by, texts, languages, premium, total)
+                VALUES ($1, $2, $3, $4, $5)
+                RETURNING *
+                """,
+                created_by, texts, languages, premium, total
+            )
+            return dict(row)
+
+    @staticmethod
+    async def get_running() -> List[Dict[str, Any]]:
+        """Незавершённые рассылки (для продолжения после рестарта)."""
+        async with db.connection() as conn:
+            rows = await conn.fetch("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id")
+            return [dict(row) for row in rows]
+
+    @staticmethod
+    async def checkpoint(broadcast_id: int, last_user_id: int, counts: Dict[str, int],
+                         status: str = "running") -> None:
+        """Сохраняет прогресс: все получатели с user_id <= last_user_id уже обработаны."""
+        async with db.connection() as conn:
+            await conn.execute(
+                """
+                UPDATE broadcasts
+                SET last_user_id = $2, sent = $3, blocked = $4, failed = $5, status = $6, updated_at = NOW(),
+                    finished_at = CASE WHEN $6 = 'running' THEN NULL ELSE NOW() END
+                WHERE id = $1
+                """,
+                broadcast_id, last_user_id, counts.get("sent", 0), counts.get("blocked", 0),
+                counts.get("failed", 0), status
+            )
+
+    @staticmethod
+    async def iter_recipients(languages: Optional[List[str]], premium: Optional[bool],
+                              after_user_id: int = 0) -> AsyncIterator[Tuple[int, Optional[str]]]:
+        """Получатели по возрастанию user_id через серверный курсор.
+
+        Курсор переоткрывается каждые BROADCAST_CURSOR_ROWS строк с последнего user_id,
+        чтобы не держать соединение пула и транзакцию всю рассылку."""
+        last = after_user_id
+        while True:
+            fetched = 0
+            async with db.connection() as conn:
+                async with conn.transaction():
+                    query = f"""
+                        SELECT user_id, language_code FROM users
+                        WHERE user_id > $3 AND {_RECIPIENTS_FILTER}
+                        ORDER BY user_id
+                        LIMIT $4
+                    """
+                    async for row in conn.cursor(query, languages, premium, last, BROADCAST_CURSOR_ROWS,
+                                                 prefetch=BROADCAST_PREFETCH):
+                        fetched += 1
+                        last = row['user_id']
+                        yield last, row['language_code']
+            if fetched < BROADCAST_CURSOR_ROWS:
+                return
+
+broadcasts_repo = BroadcastRepository()
@@ -1,23 +1,98 @@
 import logging
 import json
 import hashlib
-from typing import Optional, Dict, Any
+import time
+from typing import Optional, Dict, Any, List, Tuple
 from datetime import datetime, timedelta, timezone
 
 from . import db
+from .bloom import BloomFilter
+from .compression import compress, decompress
+from .memory_cache import MemoryCache
+from .write_behind import write_behind
 from config import CACHE_TTL_RECIPE, CACHE_TTL_ANALYSIS, CACHE_TTL_VALIDATION, CACHE_TTL_INTENT, CACHE_TTL_DISH_LIST
+from config import CACHE_TTL_NEGATIVE
+from config import L1_CACHE_MAX_ENTRIES, L1_CACHE_MAX_BYTES
+from config import GROQ_CACHE_MAX_BYTES, GROQ_CACHE_EVICTION, GROQ_CACHE_EVICT_TO
+from config import CACHE_HIT_FLUSH_INTERVAL, CACHE_HIT_FLUSH_BATCH
+from config import BLOOM_ENABLED, BLOOM_CAPACITY, BLOOM_ERROR_RATE
 
 logger = logging.getLogger(__name__)
 
 class CacheRepository:
     """Репозиторий для кэширования ответов Groq в БД."""
 
+    def __init__(self):
+        # L1: память процесса, L2: таблица groq_cache
+        self.memory = MemoryCache(L1_CACHE_MAX_ENTRIES, L1_CACHE_MAX_BYTES)
+        # Фильтр Блума ключей, живых в БД. None - ещё не построен (тогда всегда идём в БД).
+        # Записи других инстансов бота фильтр не видит до пересборки - для них это лишь промах кэша.
+        self.bloom: Optional[BloomFilter] = None
+        self._bloom_pending: Optional[List[str]] = None  # Ключи, добавленные во время пересборки
+        self.bloom_counters = {"skipped": 0, "passed": 0, "false_positives": 0}
+        # Несохранённые попадания L2: (prompt_hash, cache_type) -> (число, время последнего)
+        self._hits: Dict[Tuple[str, str], Tuple[int, datetime]] = {}
+        self._hits_flushed_at = time.monotonic()
+        self._hits_flush_queued = False
+
+    async def ensure_schema(self) -> None:
+        """Колонки для сжатых ответов и учёта попаданий (идемпотентно, при старте)."""
+        try:
+            async with db.connection() as conn:
+                await conn.execute("""
+                ALTER TABLE groq_cache ADD COLUMN IF NOT EXISTS response_z BYTEA;
+                ALTER TABLE groq_cache ADD COLUMN IF NOT EXISTS size_bytes INTEGER;
+                ALTER TABLE groq_cache ADD COLUMN IF NOT EXISTS hits INTEGER NOT NULL DEFAULT 0;
+                ALTER TABLE groq_cache ADD COLUMN IF NOT EXISTS last_hit_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+                ALTER TABLE groq_cache ALTER COLUMN response DROP NOT NULL;
+                CREATE INDEX IF NOT EXISTS idx_groq_cache_last_hit ON groq_cache (last_hit_at);
+                """)
+        except Exception as e:
+            logger.error(f"Ошибка миграции groq_cache: {e}", exc_info=True)
+
+    def _bloom_add(self, key: str) -> None:
+        if self.bloom is not None:
+            self.bloom.add(key)
+        if self._bloom_pending is not None:
+            self._bloom_pending.append(key)
+
+    async def rebuild_filter(self) -> None:
+        """Пересобирает фильтр Блума по живым записям groq_cache (удаления фильтр не поддерживает)."""
+        if not BLOOM_ENABLED or self._bloom_pending is not None:
+            return
+        self._bloom_pending = []
+        try:
+            async with db.connection() as conn:
+                rows = await conn.fetch("SELECT cache_type, prompt_hash FROM groq_cache WHERE expires_at > NOW()")
+            # Запас по ёмкости, чтобы фильтр не переполнился до следующей пересборки
+            bloom = BloomFilter(max(BLOOM_CAPACITY, len(rows) * 2), BLOOM_ERROR_RATE)
+            for row in rows:
+                bloom.add(f"{row['cache_type']}:{row['prompt_hash']}")
+            for key in self._bloom_pending:
+                bloom.add(key)
+            self.bloom = bloom
+            logger.info(f"🌸 Фильтр кэша: {len(rows)} ключей, {bloom.stats()['size_kb']} KB")
+        except Exception as e:
+            logger.error(f"Ошибка построения фильтра кэша: {e}", exc_info=True)
+        finally:
+            self._bloom_pending = None
+
+    @staticmethod
+    def _unpack(row) -> Optional[str]:
+        """Ответ из строки БД: сжатый (response_z) или старый текстовый (response)."""
+        if row['response_z'] is not None:
+            return decompress(row['response_z'])
+        response = row['response']
+        # Если колонка response - JSONB, кодек пула вернёт уже разобранный объект
+        return response if response is None or isinstance(response, str) else json.dumps(response, ensure_ascii=False)
+
     def _get_ttl(self, cache_type: str) -> int:
         """Возвращает TTL в секундах в зависимости от типа кэша."""
         if cache_type == "analysis": return CACHE_TTL_ANALYSIS
         if cache_type == "validation": return CACHE_TTL_VALIDATION
         if cache_type == "intent": return CACHE_TTL_INTENT
         if cache_type == "dish_list": return CACHE_TTL_DISH_LIST
+        if cache_type == "negative": return CACHE_TTL_NEGATIVE
         return CACHE_TTL_RECIPE # По умолчанию
         
     def _generate_hash(self, prompt: str, lang: str, model: str) -> str:
@@ -25,41 +100,132 @@ class CacheRepository:
         key_string = f"{prompt}-{lang}-{model}"
         return hashlib.sha256(key_string.encode('utf-8')).hexdigest()
 
-    async def get(self, prompt: str, lang: str, model: str, cache_type: str) -> Optional[str]:
-        """Получает ответ из кэша, если он не просрочен."""
+    async def get(self, prompt: str, lang: str, model: str, cache_type: str, local_only: bool = False) -> Optional[str]:
+        """Получает ответ из кэша, если он не просрочен. local_only - только L1, без запроса в БД."""
         # ИСПРАВЛЕНИЕ: Вызываем _generate_hash
         cache_key = self._generate_hash(prompt, lang, model)
+        memory_key = f"{cache_type}:{cache_key}"
+
+        cached = self.memory.get(memory_key, cache_type)
+        if cached is not None or local_only:
+            return cached
+
+        if self.bloom is not None:
+            if memory_key not in self.bloom:
+                self.bloom_counters["skipped"] += 1  # Точно нет в БД - запрос не нужен
+                return None
+            self.bloom_counters["passed"] += 1
         
         async with db.connection() as conn:
-            # Срок действия проверяется на уровне SQL
+            # Срок действия проверяется на уровне SQL; попадание пишем позже пачкой (чтение остаётся чтением)
             query = """
-            SELECT response FROM groq_cache 
+            SELECT response, response_z, EXTRACT(EPOCH FROM (expires_at - NOW()))::int AS ttl_left
+            FROM groq_cache
             WHERE prompt_hash = $1 AND cache_type = $2 AND expires_at > NOW()
             """
             row = await conn.fetchrow(query, cache_key, cache_type)
-            return row['response'] if row else None
+        if not row:
+            # Фильтр сказал "возможно", а записи нет (или она просрочена)
+            if self.bloom is not None: self.bloom_counters["false_positives"] += 1
+            return None
+        response = self._unpack(row)
+        self._record_hit(cache_key, cache_type)
+
+        # Прогреваем L1 на оставшийся срок жизни записи
+        ttl_left = min(row['ttl_left'] or 0, self._get_ttl(cache_type))
+        if ttl_left > 0:
+            self.memory.set(memory_key, response, ttl_left, cache_type)
+        return response
+
+    def _record_hit(self, cache_key: str, cache_type: str) -> None:
+        """Учитывает попадание в памяти; сброс в БД - через write-behind по размеру или по времени."""
+        count, _ = self._hits.get((cache_key, cache_type), (0, None))
+        self._hits[(cache_key, cache_type)] = (count + 1, datetime.now(timezone.utc))
+        due = (len(self._hits) >= CACHE_HIT_FLUSH_BATCH
+               or time.monotonic() - self._hits_flushed_at >= CACHE_HIT_FLUSH_INTERVAL)
+        if due and not self._hits_flush_queued:
+            self._hits_flush_queued = True
+            write_behind.submit("cache:hits", self.flush_hits)
+
+    async def flush_hits(self) -> int:
+        """Пишет накопленные попадания (hits, last_hit_at) одним UPDATE. Возвращает число ключей."""
+        self._hits_flush_queued = False
+        self._hits_flushed_at = time.monotonic()
+        if not self._hits:
+            return 0
+        # Одинаковый порядок строк у всех инстансов - без взаимных блокировок
+        pending = sorted(self._hits.items())
+        self._hits = {}
+        try:
+            async with db.connection() as conn:
+                await conn.execute(
+                    """
+                    UPDATE groq_cache g
+                    SET hits = g.hits + v.n, last_hit_at = GREATEST(g.last_hit_at, v.at)
+                    FROM unnest($1::text[], $2::text[], $3::int[], $4::timestamptz[]) AS v(hash, type, n, at)
+                    WHERE g.prompt_hash = v.hash AND g.cache_type = v.type
+                    """,
+                    [k[0] for k, _ in pending], [k[1] for k, _ in pending],
+                    [n for _, (n, _) in pending], [at for _, (_, at) in pending]
+                )
+        except Exception:
+            # Возвращаем несохранённое (сложив с новыми попаданиями) - запишем в следующий раз
+            for key, (n, at) in pending:
+                count, last = self._hits.get(key, (0, at))
+                self._hits[key] = (count + n, max(last, at))
+            raise
+        return len(pending)
+
+    async def ttl_left(self, prompt: str, lang: str, model: str, cache_type: str) -> Optional[int]:
+        """Сколько секунд осталось жить записи в БД (None - записи нет или она просрочена)."""
+        cache_key = self._generate_hash(prompt, lang, model)
+        async with db.connection() as conn:
+            return await conn.fetchval(
+                """
+                SELECT EXTRACT(EPOCH FROM (expires_at - NOW()))::int FROM groq_cache
+                WHERE prompt_hash = $1 AND cache_type = $2 AND expires_at > NOW()
+                """,
+                cache_key, cache_type
+            )
+
+    async def get_stale(self, prompt: str, lang: str, model: str, cache_type: str) -> Optional[str]:
+        """Возвращает ответ даже если он просрочен (ещё не удалён) - для деградации при сбое Groq."""
+        cache_key = self._generate_hash(prompt, lang, model)
+        async with db.connection() as conn:
+            row = await conn.fetchrow(
+                "SELECT response, response_z FROM groq_cache WHERE prompt_hash = $1 AND cache_type = $2",
+                cache_key, cache_type
+            )
+            return self._unpack(row) if row else None
 
     async def set(self, prompt: str, response: str, lang: str, model: str, tokens_used: int, cache_type: str) -> None:
         """Устанавливает ответ в кэш."""
         cache_key = self._generate_hash(prompt, lang, model)
         ttl = self._get_ttl(cache_type)
         expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+        self.memory.set(f"{cache_type}:{cache_key}", response, ttl, cache_type)
+        self._bloom_add(f"{cache_type}:{cache_key}")
+        packed = compress(response)
         
         async with db.connection() as conn:
+            # Текст хранится только сжатым (response_z); response = NULL
             query = """
-            INSERT INTO groq_cache (prompt_hash, response, language, model, tokens_used, cache_type, expires_at, created_at)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, NOW())
+            INSERT INTO groq_cache (prompt_hash, response, response_z, size_bytes, language, model, tokens_used, cache_type, expires_at, created_at, last_hit_at)
+            VALUES ($1, NULL, $2, $3, $4, $5, $6, $7, $8, NOW(), NOW())
             ON CONFLICT (prompt_hash, cache_type) DO UPDATE
-            SET response = EXCLUDED.response,
+            SET response = NULL,
+                response_z = EXCLUDED.response_z,
+                size_bytes = EXCLUDED.size_bytes,
                 tokens_used = EXCLUDED.tokens_used,
                 expires_at = EXCLUDED.expires_at,
-                created_at = NOW()
+                created_at = NOW(),
+                last_hit_at = NOW()
             """
-            # NOTE: response должен быть JSONB в БД для этого
             await conn.execute(
                 query, 
                 cache_key, 
-                response, 
+                packed, 
+                len(packed), 
                 lang, 
                 model, 
                 tokens_used, 
@@ -67,17 +233,78 @@ class CacheRepository:
                 expires_at
             )
 
+    def set_later(self, prompt: str, response: str, lang: str, model: str, tokens_used: int, cache_type: str) -> None:
+        """Сразу кладёт ответ в L1, а запись в Postgres отправляет в фоновую очередь."""
+        cache_key = self._generate_hash(prompt, lang, model)
+        self.memory.set(f"{cache_type}:{cache_key}", response, self._get_ttl(cache_type), cache_type)
+        write_behind.submit(
+            f"cache:{cache_type}",
+            lambda: self.set(prompt=prompt, response=response, lang=lang, model=model, tokens_used=tokens_used, cache_type=cache_type)
+        )
+
     async def clear_expired(self) -> int:
         """Удаляет просроченные записи из кэша."""
+        self.memory.clear_expired()
         try:
             async with db.connection() as conn:
                 result = await conn.execute("DELETE FROM groq_cache WHERE expires_at < NOW()")
-                if result and "DELETE" in result:
-                    count_str = result.split(" ")[1]
-                    return int(count_str)
-                return 0
+            # Удалённые ключи из фильтра не убрать - строим заново
+            await self.rebuild_filter()
+            if result and "DELETE" in result:
+                count_str = result.split(" ")[1]
+                return int(count_str)
+            return 0
         except Exception as e:
             logger.error(f"Ошибка при очистке кэша: {e}", exc_info=True)
             return 0
 
+    async def enforce_size_budget(self) -> int:
+        """Если таблица больше GROQ_CACHE_MAX_BYTES - удаляет наименее ценные записи (LRU/LFU)
+        до GROQ_CACHE_EVICT_TO от бюджета. Возвращает число удалённых записей."""
+        # Старые записи без size_bytes считаем по длине текста
+        size = "COALESCE(size_bytes, octet_length(response::text), 0)"
+        order = "hits DESC, last_hit_at DESC" if GROQ_CACHE_EVICTION == "lfu" else "last_hit_at DESC"
+        try:
+            async with db.connection() as conn:
+                total = await conn.fetchval(f"SELECT COALESCE(SUM({size}), 0) FROM groq_cache")
+                if total <= GROQ_CACHE_MAX_BYTES:
+                    return 0
+                # Оставляем самые ценные записи, пока их суммарный размер укладывается в цель
+                result = await conn.execute(f"""
+                DELETE FROM groq_cache g USING (
+                    SELECT prompt_hash, cache_type,
+                           SUM({size}) OVER (ORDER BY {order}, prompt_hash) AS kept_bytes
+                    FROM groq_cache
+                ) r
+                WHERE g.prompt_hash = r.prompt_hash AND g.cache_type = r.cache_type
+                  AND r.kept_bytes > $1
+                """, int(GROQ_CACHE_MAX_BYTES * GROQ_CACHE_EVICT_TO))
+                count = int(result.split(" ")[1]) if result and "DELETE" in result else 0
+                logger.info(f"🗜 groq_cache: {total // 1024} KB > бюджета, вытеснено {count} записей ({GROQ_CACHE_EVICTION})")
+                return count
+        except Exception as e:
+            logger.error(f"Ошибка вытеснения кэша: {e}", exc_info=True)
+            return 0
+
+    async def db_stats(self) -> Dict[str, Any]:
+        """Размер таблицы groq_cache: записи и байты."""
+        async with db.connection() as conn:
+            row = await conn.fetchrow(
+                "SELECT COUNT(*) AS rows, COALESCE(SUM(COALESCE(size_bytes, octet_length(response::text), 0)), 0) AS bytes FROM groq_cache"
+            )
+            return {"rows": row['rows'], "bytes": row['bytes'], "budget": GROQ_CACHE_MAX_BYTES}
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика L1 кэша (попадания/промахи по cache_type)."""
+        return self.memory.stats()
+
+    def filter_stats(self) -> Dict[str, Any]:
+        """Фильтр Блума: пропущенные запросы в БД и наблюдаемая доля ложных срабатываний."""
+        passed = self.bloom_counters["passed"]
+        return {
+            **self.bloom_counters,
+            "observed_fp_rate": round(self.bloom_counters["false_positives"] / passed, 4) if passed else 0.0,
+            **(self.bloom.stats() if self.bloom is not None else {"keys": 0}),
+        }
+
 groq_cache = CacheRepository()
\ No newline at end of file
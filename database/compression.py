@@ -0,0 +1,54 @@
+import zlib
+from typing import Dict
+
+# Общий словарь zlib (zdict) из типовых фрагментов ответов Groq: JSON анализа/списков блюд и разметка рецептов.
+# Короткие ответы без словаря почти не сжимаются. Менять словарь можно только вместе с DICT_VERSION:
+# старые записи распаковываются словарём своей версии.
+_COMMON = (
+    '{"categories": ["main", "soup", "salad", "breakfast", "dessert", "drink", "snack"], "suggestion": "💡 '
+    '[{"name": "", "desc": ""}, {"name": "", "desc": ""}] {"dishes": {"main": [{"name": "'
+    '\n- 1 tbsp olive oil\n- 2 cloves garlic\n- 1 onion\n- salt and pepper to taste\n- 200 g \n- 100 ml \n- 1 tsp \n'
+    '- 1 EL Olivenöl\n- 2 Knoblauchzehen\n- 1 Zwiebel\n- Salz und Pfeffer nach Geschmack\n'
+    "- 1 c. à soupe d'huile d'olive\n- 2 gousses d'ail\n- 1 oignon\n- sel et poivre au goût\n"
+    "- 1 cucchiaio di olio d'oliva\n- 2 spicchi d'aglio\n- 1 cipolla\n- sale e pepe q.b.\n"
+    "- 1 cucharada de aceite de oliva\n- 2 dientes de ajo\n- 1 cebolla\n- sal y pimienta al gusto\n"
+)
+_RECIPE = (
+    "\n\n🛒 **Ingredients:**\n\n👨‍🍳 **Preparation:**\n1. \n2. \n3. \n4. \n5. \n\n📊 **Details:**\n"
+    "- Time: 30 minutes\n- Servings: 4\n\n💡 **Secrets:**\n\n💪 **Nutrition:**\n"
+    "Calories: kcal, Protein: g, Fat: g, Carbohydrates: g per serving\n"
+    "🛒 **Zutaten:**\n👨‍🍳 **Zubereitung:**\n📊 **Details:**\n- Zeit: Minuten\n- Portionen: \n💡 **Geheimnisse:**\n"
+    "🛒 **Ingrédients :**\n👨‍🍳 **Préparation :**\n📊 **Détails :**\n- Temps : minutes\n- Portions : \n💡 **Astuces :**\n"
+    "🛒 **Ingredienti:**\n👨‍🍳 **Preparazione:**\n📊 **Dettagli:**\n- Tempo: minuti\n- Porzioni: \n💡 **Segreti:**\n"
+    "🛒 **Ingredientes:**\n👨‍🍳 **Preparación:**\n📊 **Detalles:**\n- Tiempo: minutos\n- Porciones: \n💡 **Secretos:**\n"
+)
+
+DICT_VERSION = 1
+_DICTS: Dict[int, bytes] = {1: (_COMMON + _RECIPE).encode("utf-8")}
+
+_RAW = 0  # 1-й байт: 0 - текст без сжатия, N - zlib со словарём версии N
+
+stats = {"raw_bytes": 0, "stored_bytes": 0}
+
+def compress(text: str) -> bytes:
+    """Сжимает ответ для groq_cache; если сжатие не выгодно - хранит как есть."""
+    raw = text.encode("utf-8")
+    co = zlib.compressobj(level=6, zdict=_DICTS[DICT_VERSION])
+    packed = co.compress(raw) + co.flush()
+    blob = bytes([DICT_VERSION]) + packed if len(packed) < len(raw) else bytes([_RAW]) + raw
+    stats["raw_bytes"] += len(raw)
+    stats["stored_bytes"] += len(blob)
+    return blob
+
+def decompress(blob: bytes) -> str:
+    version, body = blob[0], blob[1:]
+    if version == _RAW:
+        return body.decode("utf-8")
+    do = zlib.decompressobj(zdict=_DICTS[version])
+    return (do.decompress(body) + do.flush()).decode("utf-8")
+
+def ratio() -> float:
+    """Доля сэкономленных байт для записей, сжатых в этом процессе."""
+    if not stats["raw_bytes"]:
+        return 0.0
+    return round(1 - stats["stored_bytes"] / stats["raw_bytes"], 3)
@@ -1,14 +1,62 @@
 import logging
+import time
+from collections import OrderedDict
 from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime
 from . import db
 # Импорт моделей только для аннотации типов
 from .models import FavoriteRecipe
-from config import FAVORITES_PER_PAGE
+from config import FAVORITES_PER_PAGE, FAVORITES_COUNT_CACHE_SIZE, FAVORITES_COUNT_TTL
 
 logger = logging.getLogger(__name__)
 
+class FavoritesCountCache:
+    """Число избранных рецептов по пользователям (LRU + TTL), сбрасывается при изменениях избранного."""
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[int, Tuple[int, float]]" = OrderedDict()  # user_id -> (count, expires_at)
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, user_id: int) -> Optional[int]:
+        entry = self._data.get(user_id)
+        if entry is None or entry[1] <= time.monotonic():
+            self._data.pop(user_id, None)
+            self.stats["misses"] += 1
+            return None
+        self._data.move_to_end(user_id)
+        self.stats["hits"] += 1
+        return entry[0]
+
+    def set(self, user_id: int, count: int) -> None:
+        self._data.pop(user_id, None)
+        self._data[user_id] = (count, time.monotonic() + self.ttl)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._data.pop(user_id, None)
+
+favorites_counts = FavoritesCountCache(FAVORITES_COUNT_CACHE_SIZE, FAVORITES_COUNT_TTL)
+
+# Курсор страницы - (created_at, id) строки-границы; id добавлен для однозначного порядка
+_PAGE_COLUMNS = "id, dish_name, created_at, language"
+_CURSOR = "(SELECT created_at, id FROM favorites WHERE id = $2 AND user_id = $1)"
+
 class FavoritesRepository:
+    @staticmethod
+    async def ensure_schema() -> None:
+        """Покрывающий индекс для постраничного просмотра (идемпотентно, при старте)."""
+        try:
+            async with db.connection() as conn:
+                await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_favorites_user_created
+                ON favorites (user_id, created_at DESC, id DESC) INCLUDE (dish_name, language)
+                """)
+        except Exception as e:
+            logger.error(f"Ошибка миграции favorites: {e}", exc_info=True)
+
     @staticmethod
     async def add_favorite(favorite: FavoriteRecipe) -> bool:
         """Добавляет рецепт в избранное"""
@@ -51,6 +99,7 @@ class FavoritesRepository:
                     favorite.ingredients,
                     lang_val
                 )
+                favorites_counts.invalidate(favorite.user_id)
                 return row is not None
             except Exception as e:
                 logger.error(f"Ошибка при добавлении в избранное (add_favorite): {e}", exc_info=True)
@@ -62,34 +111,52 @@ class FavoritesRepository:
         async with db.connection() as conn:
             query = "DELETE FROM favorites WHERE user_id = $1 AND dish_name = $2"
             result = await conn.execute(query, user_id, dish_name)
+            favorites_counts.invalidate(user_id)
             return "DELETE" in result
     
     @staticmethod
-    async def get_favorites_page(user_id: int, page: int = 1) -> Tuple[List[Dict[str, Any]], int]:
-        """Получает страницу избранных рецептов с пагинацией"""
+    async def get_favorites_page(user_id: int, cursor: Optional[int] = None,
+                                 backward: bool = False) -> Tuple[List[Dict[str, Any]], bool, bool]:
+        """Страница избранного по курсору (keyset), новые сверху.
+
+        cursor - id крайнего рецепта соседней страницы: без backward берём более старые записи
+        после него, с backward - более новые перед ним. Время не зависит от номера страницы.
+        Возвращает (рецепты, есть ли страница новее, есть ли страница старше)."""
+        limit = FAVORITES_PER_PAGE + 1  # Лишняя строка показывает, есть ли следующая страница
         async with db.connection() as conn:
-            # Сначала получаем общее количество
-            count_query = "SELECT COUNT(*) FROM favorites WHERE user_id = $1"
-            total_count = await conn.fetchval(count_query, user_id)
-            
-            if total_count == 0:
-                return [], 0
-            
-            # Рассчитываем пагинацию
-            offset = (page - 1) * FAVORITES_PER_PAGE
-            total_pages = (total_count + FAVORITES_PER_PAGE - 1) // FAVORITES_PER_PAGE
-            
-            # Получаем рецепты для текущей страницы
-            data_query = """
-            SELECT id, dish_name, created_at, language
-            FROM favorites 
-            WHERE user_id = $1 
-            ORDER BY created_at DESC
-            LIMIT $2 OFFSET $3
-            """
-            
-            rows = await conn.fetch(data_query, user_id, FAVORITES_PER_PAGE, offset)
-            return [dict(row) for row in rows], total_pages
+            if cursor is None:
+                rows = await conn.fetch(
+                    f"""
+                    SELECT {_PAGE_COLUMNS} FROM favorites WHERE user_id = $1
+                    ORDER BY created_at DESC, id DESC LIMIT $2
+                    """,
+                    user_id, limit
+                )
+            elif not backward:
+                rows = await conn.fetch(
+                    f"""
+                    SELECT {_PAGE_COLUMNS} FROM favorites
+                    WHERE user_id = $1 AND (created_at, id) < {_CURSOR}
+                    ORDER BY created_at DESC, id DESC LIMIT $3
+                    """,
+                    user_id, cursor, limit
+                )
+            else:
+                rows = await conn.fetch(
+                    f"""
+                    SELECT {_PAGE_COLUMNS} FROM favorites
+                    WHERE user_id = $1 AND (created_at, id) > {_CURSOR}
+                    ORDER BY created_at ASC, id ASC LIMIT $3
+                    """,
+                    user_id, cursor, limit
+                )
+
+        items = [dict(row) for row in rows[:FAVORITES_PER_PAGE]]
+        more = len(rows) > FAVORITES_PER_PAGE
+        if backward and cursor is not None:
+            items.reverse()
+            return items, more, True
+        return items, cursor is not None, more
     
     @staticmethod
     async def get_favorite_by_id(fav_id: int) -> Optional[Dict[str, Any]]:
@@ -114,10 +181,14 @@ class FavoritesRepository:
 
     @staticmethod
     async def count_favorites(user_id: int) -> int:
-        """Считает количество избранных рецептов"""
-        async with db.connection() as conn:
-            query = "SELECT COUNT(*) FROM favorites WHERE user_id = $1"
-            return await conn.fetchval(query, user_id)
+        """Считает количество избранных рецептов (с кэшем на пользователя)"""
+        count = favorites_counts.get(user_id)
+        if count is None:
+            async with db.connection() as conn:
+                query = "SELECT COUNT(*) FROM favorites WHERE user_id = $1"
+                count = await conn.fetchval(query, user_id)
+            favorites_counts.set(user_id, count)
+        return count
     
     @staticmethod
     async def get_all_favorites(user_id: int) -> List[Dict[str, Any]]:
@@ -138,6 +209,7 @@ class FavoritesRepository:
         async with db.connection() as conn:
             query = "DELETE FROM favorites WHERE user_id = $1"
             result = await conn.execute(query, user_id)
+            favorites_counts.invalidate(user_id)
             return "DELETE" in result
 
 # Создаём экземпляр
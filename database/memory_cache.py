@@ -0,0 +1,86 @@
+import time
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+class MemoryCache:
+    """In-process L1 кэш (LRU + TTL) перед groq_cache в Postgres."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (response, expires_at (monotonic), size_bytes, cache_type)
+        self._data: "OrderedDict[str, Tuple[str, float, int, str]]" = OrderedDict()
+        self._bytes = 0
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, cache_type: str, field: str) -> None:
+        stats = self._stats.setdefault(cache_type, {"hits": 0, "misses": 0})
+        stats[field] += 1
+
+    def _pop(self, key: str) -> None:
+        entry = self._data.pop(key, None)
+        if entry:
+            self._bytes -= entry[2]
+
+    def get(self, key: str, cache_type: str) -> Optional[str]:
+        """Возвращает ответ из памяти или None (просроченные записи удаляются)."""
+        entry = self._data.get(key)
+        if entry is None:
+            self._count(cache_type, "misses")
+            return None
+
+        response, expires_at, _, _ = entry
+        if expires_at <= time.monotonic():
+            self._pop(key)
+            self._count(cache_type, "misses")
+            return None
+
+        self._data.move_to_end(key)
+        self._count(cache_type, "hits")
+        return response
+
+    def set(self, key: str, response: str, ttl: int, cache_type: str) -> None:
+        """Кладёт ответ в память, вытесняя самые старые записи при переполнении."""
+        size = len(response.encode('utf-8'))
+        if size > self.max_bytes:
+            return  # Слишком большой ответ не кэшируем в памяти
+
+        self._pop(key)
+        self._data[key] = (response, time.monotonic() + ttl, size, cache_type)
+        self._bytes += size
+
+        while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._data.popitem(last=False)
+            self._bytes -= evicted[2]
+
+    def invalidate(self, key: str) -> None:
+        self._pop(key)
+
+    def clear_expired(self) -> int:
+        """Удаляет просроченные записи, возвращает их количество."""
+        now = time.monotonic()
+        expired = [k for k, v in self._data.items() if v[1] <= now]
+        for k in expired:
+            self._pop(k)
+        return len(expired)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, object]:
+        """Статистика попаданий по типам кэша."""
+        by_type = {}
+        for cache_type, s in self._stats.items():
+            total = s["hits"] + s["misses"]
+            by_type[cache_type] = {**s, "hit_ratio": round(s["hits"] / total, 3) if total else 0.0}
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "by_type": by_type,
+        }
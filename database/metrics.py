@@ -1,14 +1,255 @@
+import asyncio
 import logging
 import json
-from typing import Dict, Any, Optional
-from datetime import datetime, timezone
+import re
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import date, datetime, timedelta, timezone
+
+import asyncpg
 
 from . import db
+from .metrics_buffer import metrics_buffer
+from config import (
+    METRICS_PARTITION_DAYS, METRICS_PARTITIONS_AHEAD, METRICS_RETENTION_DAYS, METRICS_MIGRATION_LOCK_TIMEOUT_MS,
+    METRICS_MIGRATION_TIMEOUT, METRICS_DETACH_RETRIES
+)
 
 logger = logging.getLogger(__name__)
 
+_PARTITION_ANCHOR = date(1970, 1, 5)  # Понедельник: недельные секции начинаются с понедельника
+_UPPER_BOUND_RE = re.compile(r"TO \('(\d{4}-\d{2}-\d{2})")
+_DELETE_BATCH = 10000
+
+def partition_start(day: date, period_days: int = METRICS_PARTITION_DAYS) -> date:
+    """Начало секции, в которую попадает day."""
+    return day - timedelta(days=(day - _PARTITION_ANCHOR).days % period_days)
+
+def partition_name(start: date) -> str:
+    return f"metrics_p{start:%Y%m%d}"
+
 class MetricsRepository:
     """Репозиторий для записи событий и метрик"""
+
+    partitioned: bool = False
+    _migration: Optional[asyncio.Lock] = None
+
+    def _migration_lock(self) -> asyncio.Lock:
+        """Перевод таблицы и очистка не идут одновременно (очистка во время перевода пропускается)."""
+        if self._migration is None:
+            self._migration = asyncio.Lock()
+        return self._migration
+
+    @staticmethod
+    async def _is_partitioned(conn) -> bool:
+        return await conn.fetchval("SELECT relkind::text FROM pg_class WHERE oid = to_regclass('public.metrics')") == 'p'
+
+    async def ensure_schema(self) -> None:
+        """Переводит metrics на секционирование по created_at (идемпотентно, при старте, в фоне).
+
+        Существующая таблица не копируется: она переименовывается в metrics_legacy и
+        подключается секцией (MINVALUE, граница перехода) - её целиком удалит ретеншн,
+        когда самые новые строки в ней устареют. Долгие проходы по старой таблице
+        (проверка ограничения, индекс) не блокируют запись; эксклюзивные блокировки
+        короткие и ограничены METRICS_MIGRATION_LOCK_TIMEOUT_MS. Если перевод не удался,
+        таблица остаётся как есть (очистка - пачками DELETE), попытка повторится при рестарте.
+        Долгие шаги идут с клиентским таймаутом METRICS_MIGRATION_TIMEOUT, а не DB_COMMAND_TIMEOUT пула."""
+        try:
+            async with self._migration_lock(), db.connection() as conn:
+                kind = await conn.fetchval("SELECT relkind::text FROM pg_class WHERE oid = to_regclass('public.metrics')")
+                if kind is None:
+                    await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS metrics (
+                        id BIGSERIAL,
+                        user_id BIGINT,
+                        event_name TEXT NOT NULL,
+                        data JSONB,
+                        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                    ) PARTITION BY RANGE (created_at)
+                    """)
+                elif kind == 'r':
+                    await self._convert_to_partitioned(conn)
+                    logger.info("✅ Таблица metrics переведена на секционирование по created_at")
+                await conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_metrics_event_created ON ONLY metrics (event_name, created_at)"
+                )
+                # Строки вне созданных секций (ensure_partitions отстал) попадают сюда, а не в ошибку
+                await conn.execute("CREATE TABLE IF NOT EXISTS metrics_default PARTITION OF metrics DEFAULT")
+            self.partitioned = True
+        except Exception as e:
+            self.partitioned = False
+            logger.error(f"Ошибка миграции metrics (секционирование не включено): {e}", exc_info=True)
+            return
+        await self.ensure_partitions()
+        await self.ensure_indexes()
+
+    @staticmethod
+    async def _convert_to_partitioned(conn) -> None:
+        # Запас в сутки: строки, записанные во время перевода, должны пройти ограничение
+        today = datetime.now(timezone.utc).date()
+        cutover = partition_start(today + timedelta(days=1)) + timedelta(days=METRICS_PARTITION_DAYS)
+        lock_timeout = f"SET LOCAL lock_timeout = {METRICS_MIGRATION_LOCK_TIMEOUT_MS}"
+
+        # 1. Строки без времени в секцию по диапазону не попадут: короткие пачки, только блокировки строк
+        while True:
+            # Поиск NULL - проход по всей старой таблице: таймауты пула и сервера его не ограничивают
+            async with conn.transaction():
+                await conn.execute("SET LOCAL statement_timeout = 0")
+                result = await conn.execute(
+                    """
+                    UPDATE metrics SET created_at = 'epoch' WHERE ctid = ANY(ARRAY(
+                        SELECT ctid FROM metrics WHERE created_at IS NULL LIMIT $1
+                    ))
+                    """,
+                    _DELETE_BATCH, timeout=METRICS_MIGRATION_TIMEOUT
+                )
+            if int(result.split(" ")[1]) < _DELETE_BATCH:
+                break
+
+        # 2. Ограничение, совпадающее с будущей границей секции: NOT VALID ставится мгновенно,
+        #    VALIDATE сканирует таблицу под SHARE UPDATE EXCLUSIVE (запись не блокируется)
+        async with conn.transaction():
+            await conn.execute(lock_timeout)
+            await conn.execute(f"""
+                ALTER TABLE metrics DROP CONSTRAINT IF EXISTS metrics_legacy_bound,
+                ADD CONSTRAINT metrics_legacy_bound
+                    CHECK (created_at IS NOT NULL AND created_at < '{cutover}') NOT VALID
+            """)
+        async with conn.transaction():
+            await conn.execute("SET LOCAL statement_timeout = 0")
+            await conn.execute("ALTER TABLE metrics VALIDATE CONSTRAINT metrics_legacy_bound",
+                               timeout=METRICS_MIGRATION_TIMEOUT)
+
+        # 3. Подмена таблицы: только каталог, ATTACH не сканирует строки благодаря ограничению
+        async with conn.transaction():
+            await conn.execute(lock_timeout)
+            await conn.execute("ALTER TABLE metrics RENAME TO metrics_legacy")
+            await conn.execute(
+                "CREATE TABLE metrics (LIKE metrics_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)"
+            )
+            # Счётчики (serial/identity) остались за старой таблицей - у родителя свои, продолжающие нумерацию
+            serials = await conn.fetch(
+                """
+                SELECT attname, pg_get_serial_sequence('metrics_legacy', attname) AS seq
+                FROM pg_attribute
+                WHERE attrelid = 'metrics_legacy'::regclass AND attnum > 0 AND NOT attisdropped
+                """
+            )
+            for row in serials:
+                if not row['seq']:
+                    continue
+                column, seq = row['attname'], f"metrics_{row['attname']}_seq_p"
+                await conn.execute(f'CREATE SEQUENCE {seq} AS bigint OWNED BY metrics."{column}"')
+                await conn.execute(f"SELECT setval('{seq}', GREATEST((SELECT last_value FROM {row['seq']}), 1))")
+                await conn.execute(f"ALTER TABLE metrics ALTER COLUMN \"{column}\" SET DEFAULT nextval('{seq}')")
+            await conn.execute(
+                f"ALTER TABLE metrics ATTACH PARTITION metrics_legacy FOR VALUES FROM (MINVALUE) TO ('{cutover}')"
+            )
+
+    async def ensure_partitions(self) -> int:
+        """Создаёт секции на текущий и METRICS_PARTITIONS_AHEAD следующих периодов. Возвращает число новых.
+
+        Новая секция начинается там, где кончается последняя существующая, и заканчивается
+        на ближайшей границе периода - после смены METRICS_PARTITION_DAYS границы не пересекаются."""
+        if not self.partitioned:
+            return 0
+        created = 0
+        try:
+            async with db.connection() as conn:
+                bounds = await self._partition_bounds(conn)
+                current = partition_start(datetime.now(timezone.utc).date())
+                until = current + timedelta(days=METRICS_PARTITION_DAYS * (METRICS_PARTITIONS_AHEAD + 1))
+                start = max(max(bounds.values(), default=current), current)
+                while start < until:
+                    end = partition_start(start) + timedelta(days=METRICS_PARTITION_DAYS)
+                    await self._create_partition(conn, start, end)
+                    created += 1
+                    start = end
+        except Exception as e:
+            logger.error(f"Ошибка создания секций metrics: {e}", exc_info=True)
+        if created:
+            logger.info(f"📅 Созданы секции metrics: {created}")
+        return created
+
+    @staticmethod
+    async def _create_partition(conn, start: date, end: date) -> None:
+        name = partition_name(start)
+        async with conn.transaction():
+            await conn.execute(f"SET LOCAL lock_timeout = {METRICS_MIGRATION_LOCK_TIMEOUT_MS}")
+            stray = await conn.fetchval(
+                "SELECT EXISTS (SELECT 1 FROM metrics_default WHERE created_at >= $1::date AND created_at < $2::date)",
+                start, end
+            )
+            if not stray:
+                await conn.execute(
+                    f"CREATE TABLE {name} PARTITION OF metrics FOR VALUES FROM ('{start}') TO ('{end}')"
+                )
+                return
+            # Строки периода уже легли в DEFAULT - переносим их в новую секцию, иначе она не создастся
+            await conn.execute(f"CREATE TABLE {name} (LIKE metrics INCLUDING DEFAULTS)")
+            await conn.execute(
+                f"""
+                WITH moved AS (
+                    DELETE FROM metrics_default WHERE created_at >= $1::date AND created_at < $2::date RETURNING *
+                )
+                INSERT INTO {name} SELECT * FROM moved
+                """,
+                start, end
+            )
+            await conn.execute(f"ALTER TABLE metrics ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')")
+            logger.warning(f"📅 Секция {name} создана с опозданием, строки перенесены из metrics_default")
+
+    async def ensure_indexes(self) -> None:
+        """Строит (CONCURRENTLY) и подцепляет к индексу родителя индексы секций, у которых их нет
+        (metrics_legacy после перевода). Пока подцеплены не все, индекс родителя невалиден."""
+        try:
+            async with db.connection() as conn:
+                rows = await conn.fetch(
+                    """
+                    SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                    WHERE i.inhparent = 'metrics'::regclass AND NOT EXISTS (
+                        SELECT 1 FROM pg_inherits ii JOIN pg_index x ON x.indexrelid = ii.inhrelid
+                        WHERE ii.inhparent = 'idx_metrics_event_created'::regclass AND x.indrelid = c.oid
+                    )
+                    """
+                )
+                for row in rows:
+                    table, index = row['relname'], f"{row['relname']}_event_created_idx"
+                    # Остаток прерванной сборки CONCURRENTLY - невалидный индекс, строим заново
+                    invalid = await conn.fetchval(
+                        "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)", index
+                    )
+                    await conn.execute("SET statement_timeout = 0")
+                    try:
+                        if invalid:
+                            await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{index}"',
+                                               timeout=METRICS_MIGRATION_TIMEOUT)
+                        await conn.execute(
+                            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{index}" ON "{table}" (event_name, created_at)',
+                            timeout=METRICS_MIGRATION_TIMEOUT
+                        )
+                    finally:
+                        await conn.execute("RESET statement_timeout")
+                    await conn.execute(f'ALTER INDEX idx_metrics_event_created ATTACH PARTITION "{index}"')
+                    logger.info(f"✅ Индекс секции {table} подключён")
+        except Exception as e:
+            logger.error(f"Ошибка индексов секций metrics: {e}", exc_info=True)
+
+    @staticmethod
+    async def _partition_bounds(conn) -> Dict[str, date]:
+        """Секции metrics и их верхние границы (дата, не включительно)."""
+        rows = await conn.fetch(
+            """
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'metrics'::regclass
+            """
+        )
+        bounds = {}
+        for row in rows:
+            m = _UPPER_BOUND_RE.search(row['bound'] or "")
+            if m:
+                bounds[row['relname']] = date.fromisoformat(m.group(1))
+        return bounds
     
     async def track_event(self, user_id: int, event_name: str, data: Dict[str, Any] = None) -> None:
         """Записывает событие в таблицу метрик"""
@@ -37,21 +278,144 @@ class MetricsRepository:
             logger.critical(f"💀 КРИТИЧЕСКАЯ ОШИБКА записи метрики в БД ({event_name}): {e}", exc_info=True)
 
 
-    async def cleanup_old_metrics(self, days_to_keep: int = 90) -> int:
-        """Удаляет старые метрики"""
+    def track_event_later(self, user_id: int, event_name: str, data: Dict[str, Any] = None) -> None:
+        """Кладёт событие в буфер; в БД оно уйдёт пачкой (COPY), не задерживая ответ пользователю"""
+        metrics_buffer.add(user_id, event_name, data)
+
+    async def get_completion_percentiles(self, percentile: float, days: int) -> Dict[str, Tuple[int, int]]:
+        """Перцентиль completion_tokens по маршрутам Groq за days дней: {route: (токены, число ответов)}"""
+        try:
+            async with db.connection() as conn:
+                query = """
+                SELECT data::jsonb->>'route' AS route,
+                       percentile_cont($1) WITHIN GROUP (ORDER BY (data::jsonb->>'completion_tokens')::int) AS tokens,
+                       COUNT(*) AS samples
+                FROM metrics
+                WHERE event_name = 'groq_request'
+                  AND created_at > NOW() - make_interval(days => $2)
+                  AND data::jsonb->>'completion_tokens' IS NOT NULL
+                GROUP BY 1
+                """
+                rows = await conn.fetch(query, percentile, days)
+                return {r['route']: (int(r['tokens']), r['samples']) for r in rows if r['route']}
+        except Exception as e:
+            logger.error(f"Ошибка чтения статистики токенов: {e}", exc_info=True)
+            return {}
+
+    async def get_analysis_latency(self, days: int) -> Dict[str, Dict[str, Any]]:
+        """Latency анализа по режимам (fused / two_step) за days дней: {mode: {samples, p50_ms, p95_ms, ok}}"""
+        try:
+            async with db.connection() as conn:
+                query = """
+                SELECT data::jsonb->>'mode' AS mode,
+                       COUNT(*) AS samples,
+                       percentile_cont(0.5) WITHIN GROUP (ORDER BY (data::jsonb->>'latency_ms')::int) AS p50,
+                       percentile_cont(0.95) WITHIN GROUP (ORDER BY (data::jsonb->>'latency_ms')::int) AS p95,
+                       AVG(CASE WHEN (data::jsonb->>'ok')::boolean THEN 1 ELSE 0 END) AS ok
+                FROM metrics
+                WHERE event_name = 'analysis_completed'
+                  AND created_at > NOW() - make_interval(days => $1)
+                  AND data::jsonb->>'latency_ms' IS NOT NULL
+                GROUP BY 1
+                """
+                rows = await conn.fetch(query, days)
+                return {r['mode']: {"samples": r['samples'], "p50_ms": int(r['p50']), "p95_ms": int(r['p95']),
+                                    "ok": round(float(r['ok']), 2)} for r in rows if r['mode']}
+        except Exception as e:
+            logger.error(f"Ошибка чтения latency анализа: {e}", exc_info=True)
+            return {}
+
+    async def get_top_direct_recipes(self, top_n: int, days: int) -> List[Dict[str, Any]]:
+        """Самые частые прямые запросы рецептов за days дней: top_n блюд на язык."""
         try:
             async with db.connection() as conn:
-                query = f"""
-                DELETE FROM metrics 
-                WHERE created_at < NOW() - interval '{days_to_keep} days'
+                # Старые события без lang/premium: язык берём из профиля, премиум считаем false
+                query = """
+                SELECT dish, lang, premium, hits FROM (
+                    SELECT m.data::jsonb->>'dish' AS dish,
+                           COALESCE(m.data::jsonb->>'lang', u.language_code, 'en') AS lang,
+                           COALESCE((m.data::jsonb->>'premium')::boolean, false) AS premium,
+                           COUNT(*) AS hits,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY COALESCE(m.data::jsonb->>'lang', u.language_code, 'en')
+                               ORDER BY COUNT(*) DESC
+                           ) AS rn
+                    FROM metrics m
+                    LEFT JOIN users u ON u.user_id = m.user_id
+                    WHERE m.event_name = 'recipe_generated'
+                      AND m.data::jsonb->>'direct' = 'true'
+                      AND m.created_at > NOW() - make_interval(days => $2)
+                    GROUP BY 1, 2, 3
+                ) ranked
+                WHERE rn <= $1 AND dish IS NOT NULL
+                ORDER BY lang, hits DESC
                 """
-                result = await conn.execute(query)
-                if result and "DELETE" in result:
-                    count_str = result.split(" ")[1]
-                    return int(count_str)
-                return 0
+                rows = await conn.fetch(query, top_n, days)
+                return [dict(r) for r in rows]
+        except Exception as e:
+            logger.error(f"Ошибка выборки популярных рецептов: {e}", exc_info=True)
+            return []
+
+    async def cleanup_old_metrics(self, days_to_keep: int = METRICS_RETENTION_DAYS) -> int:
+        """Удаляет метрики старше days_to_keep дней: секции целиком (DETACH + DROP), без секций - пачками DELETE.
+
+        Режим берётся из каталога; пока идёт перевод на секции, очистка пропускается.
+        Возвращает число удалённых секций (или строк для несекционированной таблицы)."""
+        lock = self._migration_lock()
+        if lock.locked():
+            logger.info("Таблица metrics переводится на секции - очистка отложена")
+            return 0
+        try:
+            async with lock, db.connection() as conn:
+                if await self._is_partitioned(conn):
+                    return await self._drop_old_partitions(conn, days_to_keep)
+                deleted = 0
+                while True:
+                    result = await conn.execute(
+                        """
+                        DELETE FROM metrics WHERE ctid = ANY(ARRAY(
+                            SELECT ctid FROM metrics WHERE created_at < NOW() - make_interval(days => $1) LIMIT $2
+                        ))
+                        """,
+                        days_to_keep, _DELETE_BATCH
+                    )
+                    count = int(result.split(" ")[1]) if result and "DELETE" in result else 0
+                    deleted += count
+                    if count < _DELETE_BATCH:
+                        return deleted
         except Exception as e:
             logger.error(f"Ошибка при очистке метрик: {e}", exc_info=True)
             return 0
 
+    async def _drop_old_partitions(self, conn, days_to_keep: int) -> int:
+        cutoff = datetime.now(timezone.utc).date() - timedelta(days=days_to_keep)
+        dropped = 0
+        for name, upper in sorted((await self._partition_bounds(conn)).items(), key=lambda kv: kv[1]):
+            if upper > cutoff:
+                continue
+            # Секция целиком старше срока хранения: отцепляем и удаляем без построчного DELETE
+            if not await self._detach_partition(conn, name):
+                break
+            await conn.execute(f'DROP TABLE "{name}"')
+            dropped += 1
+            logger.info(f"🗑 Удалена секция метрик {name} (до {upper})")
+        # В DEFAULT строки попадают лишь изредка - их чистим обычным DELETE
+        await conn.execute("DELETE FROM metrics_default WHERE created_at < $1::date", cutoff)
+        return dropped
+
+    @staticmethod
+    async def _detach_partition(conn, name: str) -> bool:
+        """DETACH берёт ACCESS EXCLUSIVE на metrics: ждём не дольше lock_timeout, иначе вставки
+        встанут в очередь за долгим читателем. CONCURRENTLY недоступен из-за секции DEFAULT."""
+        for attempt in range(METRICS_DETACH_RETRIES):
+            try:
+                async with conn.transaction():
+                    await conn.execute(f"SET LOCAL lock_timeout = {METRICS_MIGRATION_LOCK_TIMEOUT_MS}")
+                    await conn.execute(f'ALTER TABLE metrics DETACH PARTITION "{name}"')
+                return True
+            except asyncpg.LockNotAvailableError:
+                logger.warning(f"Секция {name} занята (попытка {attempt + 1}), DETACH отложен")
+                await asyncio.sleep(min(2 ** attempt, 30))
+        return False
+
 metrics = MetricsRepository()
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import asyncpg
+
+from . import db
+from config import METRICS_BATCH_SIZE, METRICS_FLUSH_MS, METRICS_BUFFER_MAX, METRICS_OVERFLOW
+
+logger = logging.getLogger(__name__)
+
+Record = Tuple[int, str, str, datetime]
+_COLUMNS = ["user_id", "event_name", "data", "created_at"]
+
+class MetricsBuffer:
+    """Копит события метрик в памяти и пишет пачкой (COPY) раз в METRICS_FLUSH_MS или по METRICS_BATCH_SIZE."""
+
+    def __init__(self, batch_size: int, flush_ms: int, max_size: int, overflow: str):
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.max_size = max_size
+        self.overflow = overflow  # "drop_oldest" | "drop_new"
+        self._records: Deque[Record] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._use_copy = True
+        self._closing = False
+        self.stats = {"added": 0, "flushed": 0, "batches": 0, "dropped": 0, "failed": 0}  # failed - неудачные сбросы
+
+    def add(self, user_id: int, event_name: str, data: Optional[Dict[str, Any]] = None) -> None:
+        """Добавляет событие в буфер без обращения к БД."""
+        self.stats["added"] += 1
+        if len(self._records) >= self.max_size:
+            self.stats["dropped"] += 1
+            if self.overflow == "drop_new":
+                return
+            self._records.popleft()
+        self._records.append((user_id, event_name, json.dumps(data or {}, default=str), datetime.now(timezone.utc)))
+        if len(self._records) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _write(self, batch: List[Record]) -> None:
+        async with db.connection() as conn:
+            if self._use_copy:
+                try:
+                    await conn.copy_records_to_table("metrics", records=batch, columns=_COLUMNS)
+                    return
+                except (asyncpg.exceptions.InterfaceError, asyncpg.exceptions.InternalClientError) as e:
+                    # COPY идёт в бинарном формате (кодек jsonb в database/__init__.py бинарный); если схема
+                    # таблицы не совпала с ожидаемой - переходим на INSERT
+                    logger.warning(f"Metrics COPY unavailable, using batched INSERT: {e}")
+                    self._use_copy = False
+            await conn.executemany(
+                "INSERT INTO metrics (user_id, event_name, data, created_at) VALUES ($1, $2, $3, $4)", batch
+            )
+
+    async def flush(self) -> int:
+        """Пишет всё накопленное пачками по batch_size. Возвращает число записанных событий."""
+        written = 0
+        while self._records:
+            batch = [self._records.popleft() for _ in range(min(self.batch_size, len(self._records)))]
+            try:
+                await self._write(batch)
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"Ошибка записи пачки метрик ({len(batch)} шт.): {e}", exc_info=True)
+                # Возвращаем пачку в начало буфера (сколько влезет) - повторим на следующем сбросе
+                room = self.max_size - len(self._records)
+                if room < len(batch):
+                    self.stats["dropped"] += len(batch) - max(room, 0)
+                self._records.extendleft(reversed(batch[:max(room, 0)]))
+                break
+            written += len(batch)
+            self.stats["flushed"] += len(batch)
+            self.stats["batches"] += 1
+        return written
+
+    async def _loop(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._loop())
+            logger.info(f"✅ Буфер метрик запущен (пачка {self.batch_size}, раз в {self.flush_interval:.1f} сек.)")
+
+    def pending(self) -> int:
+        return len(self._records)
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Останавливает фоновую запись, дописав остаток (не дольше timeout)."""
+        self._closing = True
+        if self._task:
+            # Текущий сброс не прерываем, чтобы не потерять уже вынутую пачку
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._task, timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Метрики: не успели записать {len(self._records)} событий при остановке")
+            self._task = None
+        elif self._records:
+            await self.flush()
+
+metrics_buffer = MetricsBuffer(METRICS_BATCH_SIZE, METRICS_FLUSH_MS, METRICS_BUFFER_MAX, METRICS_OVERFLOW)
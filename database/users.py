@@ -1,88 +1,159 @@
 import logging
-from typing import Optional, Dict, Any, Tuple
+import time
+from collections import OrderedDict, deque
+from typing import Optional, Dict, Any, Tuple, Iterable, List
 from datetime import datetime, date, timedelta, timezone 
 from . import db
 from .models import UserBase, UserLanguage 
-from config import FREE_USER_LIMITS, PREMIUM_USER_LIMITS, TRIAL_DURATION_DAYS
+from config import (
+    FREE_USER_LIMITS, PREMIUM_USER_LIMITS, TRIAL_DELAY_HOURS, TRIAL_DURATION_DAYS, USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL
+)
 
 logger = logging.getLogger(__name__)
 
+_PROFILE_FIELDS = ("language_code", "is_premium", "premium_until")
+
+class UserProfileCache:
+    """Процессный кэш профилей пользователей (LRU + TTL).
+
+    Хранит только то, что нужно почти каждому хендлеру: язык и премиум-статус.
+    Записи в users через репозиторий сразу обновляют кэш (write-through); TTL
+    ограничивает устаревание, если строку поменяли в обход бота."""
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # user_id -> (language_code, is_premium, premium_until, loaded_at (monotonic))
+        self._data: "OrderedDict[int, Tuple[str, bool, Optional[datetime], float]]" = OrderedDict()
+        self._ages: deque = deque(maxlen=1000)  # Возраст записей, отданных из кэша (сек.)
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "updates": 0, "invalidations": 0, "evictions": 0}
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        entry = self._data.get(user_id)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        age = time.monotonic() - entry[3]
+        if age >= self.ttl:
+            del self._data[user_id]
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return None
+        self._data.move_to_end(user_id)
+        self.stats["hits"] += 1
+        self._ages.append(age)
+        return {"user_id": user_id, **dict(zip(_PROFILE_FIELDS, entry[:3]))}
+
+    def put(self, row: Optional[Dict[str, Any]]) -> None:
+        """Кладёт профиль из строки users (лишние колонки отбрасываются)."""
+        if not row or row.get("user_id") is None:
+            return
+        user_id = row["user_id"]
+        self._data.pop(user_id, None)
+        self._data[user_id] = (
+            row.get("language_code") or "en", bool(row.get("is_premium")), row.get("premium_until"), time.monotonic()
+        )
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def patch(self, user_id: int, **fields: Any) -> None:
+        """Отражает запись в users. Время загрузки не сдвигаем: TTL считается от чтения из БД."""
+        entry = self._data.get(user_id)
+        if entry is None:
+            return
+        profile = dict(zip(_PROFILE_FIELDS, entry[:3]))
+        profile.update((k, v) for k, v in fields.items() if k in profile)
+        self._data[user_id] = (profile["language_code"], profile["is_premium"], profile["premium_until"], entry[3])
+        self.stats["updates"] += 1
+
+    def invalidate(self, user_ids: Iterable[int]) -> None:
+        for user_id in user_ids:
+            if self._data.pop(user_id, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Размер, доля попаданий и возраст отданных записей (насколько они могли устареть)."""
+        total = self.stats["hits"] + self.stats["misses"]
+        ages = sorted(self._ages)
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "hit_ratio": round(self.stats["hits"] / total, 3) if total else 0.0,
+            "age_avg_s": round(sum(ages) / len(ages), 1) if ages else 0.0,
+            "age_p95_s": round(ages[min(len(ages) - 1, int(len(ages) * 0.95))], 1) if ages else 0.0,
+            "ttl": self.ttl,
+            **self.stats,
+        }
+
+user_profiles = UserProfileCache(USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL)
+
 class UserRepository:
     """Репозиторий для работы с пользователями с поддержкой лимитов"""
-    
+
     @staticmethod
-    async def _reset_daily_limits_if_needed(user_id: int) -> None:
-        """Сбрасывает дневные лимиты, если наступил новый день"""
-        async with db.connection() as conn:
-            user = await conn.fetchrow(
-                "SELECT last_reset_date FROM users WHERE user_id = $1", 
-                user_id
-            )
-            
-            if user:
-                today = await conn.fetchval("SELECT CURRENT_DATE")
-                last_reset = user['last_reset_date']
-                
-                if last_reset != today:
-                    await conn.execute(
-                        """
-                        UPDATE users 
-                        SET requests_today = 0, 
-                            voice_requests_today = 0,
-                            last_reset_date = $1
-                        WHERE user_id = $2
-                        """,
-                        today, user_id
+    async def ensure_schema() -> None:
+        """Отметка об уведомлении о триале и индексы для фоновых задач (идемпотентно, при старте)."""
+        try:
+            async with db.connection() as conn:
+                async with conn.transaction():
+                    exists = await conn.fetchval(
+                        "SELECT 1 FROM information_schema.columns WHERE table_name = 'users' AND column_name = 'trial_notified_at'"
                     )
-                    logger.info(f"Сброшены лимиты для пользователя {user_id}")
+                    if not exists:
+                        await conn.execute("ALTER TABLE users ADD COLUMN trial_notified_at TIMESTAMPTZ")
+                        # Уже активированным триалам уведомление отправлял прежний код
+                        await conn.execute("UPDATE users SET trial_notified_at = NOW() WHERE trial_status = 'active'")
+                await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_users_trial_pending ON users (created_at) WHERE trial_status = 'pending';
+                CREATE INDEX IF NOT EXISTS idx_users_trial_unnotified ON users (user_id)
+                    WHERE trial_status = 'active' AND trial_notified_at IS NULL;
+                """)
+        except Exception as e:
+            logger.error(f"Ошибка миграции users: {e}", exc_info=True)
     
     @staticmethod
     async def check_and_increment_request(user_id: int, request_type: str = "text") -> Tuple[bool, int, int]:
-        """Проверяет и увеличивает счетчик запросов."""
-        await UserRepository._reset_daily_limits_if_needed(user_id)
-        
+        """Проверяет и увеличивает счетчик запросов одним атомарным UPDATE.
+
+        Сброс счётчиков при смене дня, выбор лимита (премиум/free) и инкремент делает сам запрос:
+        условие лимита проверяется по актуальной версии строки, поэтому параллельные сообщения
+        не могут превысить лимит. Возвращает (разрешено, использовано сегодня, лимит)."""
+        if request_type == "voice":
+            field, other, limit_key = "voice_requests_today", "requests_today", "voice_per_day"
+        else:
+            field, other, limit_key = "requests_today", "voice_requests_today", "daily_requests"
+        # Счётчик с учётом смены дня (вчерашние значения считаем нулём)
+        used = f"CASE WHEN last_reset_date IS DISTINCT FROM CURRENT_DATE THEN 0 ELSE {field} END"
+        limit = "CASE WHEN is_premium THEN $3::int ELSE $2::int END"
+
         async with db.connection() as conn:
-            user = await conn.fetchrow(
-                """
-                SELECT is_premium, requests_today, voice_requests_today 
-                FROM users 
-                WHERE user_id = $1
-                FOR UPDATE
-                """, 
-                user_id
-            )
-            
-            if not user:
-                return False, 0, 0
-            
-            is_premium = user['is_premium']
-            limits = PREMIUM_USER_LIMITS if is_premium else FREE_USER_LIMITS
-            
-            if request_type == "voice":
-                current_count = user['voice_requests_today']
-                limit = limits['voice_per_day']
-                update_field = "voice_requests_today"
-            else:
-                current_count = user['requests_today']
-                limit = limits['daily_requests']
-                update_field = "requests_today"
-            
-            if current_count >= limit:
-                return False, current_count, limit
-            
-            new_count = current_count + 1
-            await conn.execute(
+            row = await conn.fetchrow(
                 f"""
-                UPDATE users 
-                SET {update_field} = $1, 
-                    total_requests = total_requests + 1,
-                    last_active_at = NOW()
-                WHERE user_id = $2
+                WITH upd AS (
+                    UPDATE users
+                    SET {field} = {used} + 1,
+                        {other} = CASE WHEN last_reset_date IS DISTINCT FROM CURRENT_DATE THEN 0 ELSE {other} END,
+                        last_reset_date = CURRENT_DATE,
+                        total_requests = total_requests + 1,
+                        last_active_at = NOW()
+                    WHERE user_id = $1 AND {used} < {limit}
+                    RETURNING {field} AS used, {limit} AS lim
+                )
+                SELECT TRUE AS allowed, used, lim FROM upd
+                UNION ALL
+                SELECT FALSE, {used}, {limit} FROM users
+                WHERE user_id = $1 AND NOT EXISTS (SELECT 1 FROM upd)
                 """,
-                new_count, user_id
+                user_id, FREE_USER_LIMITS[limit_key], PREMIUM_USER_LIMITS[limit_key]
             )
-            
-            return True, new_count, limit
+
+            if not row:
+                return False, 0, 0
+            return row['allowed'], row['used'], row['lim']
     
     @staticmethod
     async def get_usage_stats(user_id: int) -> Dict[str, Any]:
@@ -91,8 +162,8 @@ class UserRepository:
             row = await conn.fetchrow(
                 """
                 SELECT 
-                    requests_today,
-                    voice_requests_today,
+                    CASE WHEN last_reset_date IS DISTINCT FROM CURRENT_DATE THEN 0 ELSE requests_today END AS requests_today,
+                    CASE WHEN last_reset_date IS DISTINCT FROM CURRENT_DATE THEN 0 ELSE voice_requests_today END AS voice_requests_today,
                     total_requests,
                     is_premium,
                     premium_until,
@@ -130,6 +201,7 @@ class UserRepository:
                 "UPDATE users SET is_premium = TRUE, premium_until = $1 WHERE user_id = $2",
                 premium_until, user_id
             )
+            user_profiles.patch(user_id, is_premium=True, premium_until=premium_until)
             return result is not None
     
     @staticmethod
@@ -139,56 +211,80 @@ class UserRepository:
                 "UPDATE users SET is_premium = FALSE, premium_until = NULL WHERE user_id = $1",
                 user_id
             )
+            user_profiles.patch(user_id, is_premium=False, premium_until=None)
             return result is not None
 
     @staticmethod
-    async def process_trial_activations() -> list[int]:
-        """Активирует триал пользователям, зарегистрированным 48+ часов назад"""
+    async def process_trial_activations() -> List[Dict[str, Any]]:
+        """Активирует триал пользователям, зарегистрированным TRIAL_DELAY_HOURS+ часов назад.
+
+        Один UPDATE на всех; возвращает [{user_id, language_code}] для уведомлений."""
+        premium_until = datetime.now(timezone.utc) + timedelta(days=TRIAL_DURATION_DAYS)
         async with db.connection() as conn:
-            users = await conn.fetch(
+            rows = await conn.fetch(
                 """
-                SELECT user_id FROM users 
+                UPDATE users 
+                SET is_premium = TRUE, 
+                    premium_until = $1,
+                    trial_status = 'active'
                 WHERE trial_status = 'pending' 
-                  AND created_at < NOW() - INTERVAL '48 hours'
+                  AND created_at < NOW() - make_interval(hours => $2)
                   AND is_premium = FALSE
+                RETURNING user_id, language_code
+                """,
+                premium_until, TRIAL_DELAY_HOURS
+            )
+        for row in rows:
+            user_profiles.patch(row['user_id'], is_premium=True, premium_until=premium_until)
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    async def get_unnotified_trials(limit: int = 10000) -> List[Dict[str, Any]]:
+        """Активированные триалы без отправленного уведомления (остались после сбоя)."""
+        async with db.connection() as conn:
+            rows = await conn.fetch(
                 """
+                SELECT user_id, language_code FROM users
+                WHERE trial_status = 'active' AND trial_notified_at IS NULL
+                LIMIT $1
+                """,
+                limit
             )
-            
-            activated_ids = []
-            for row in users:
-                uid = row['user_id']
-                premium_until = datetime.now(timezone.utc) + timedelta(days=TRIAL_DURATION_DAYS)
-                
-                await conn.execute(
-                    """
-                    UPDATE users 
-                    SET is_premium = TRUE, 
-                        premium_until = $1,
-                        trial_status = 'active'
-                    WHERE user_id = $2
-                    """,
-                    premium_until, uid
-                )
-                activated_ids.append(uid)
-                
-            return activated_ids
+            return [dict(row) for row in rows]
+
+    @staticmethod
+    async def mark_trial_notified(user_ids: List[int]) -> List[int]:
+        """Отмечает уведомление о триале до отправки и возвращает тех, кого ещё не отметили.
+
+        Отметка раньше отправки: после сбоя посреди рассылки уведомление не уйдёт повторно
+        (в худшем случае потеряется у последней отмеченной пачки)."""
+        async with db.connection() as conn:
+            rows = await conn.fetch(
+                """
+                UPDATE users SET trial_notified_at = NOW()
+                WHERE user_id = ANY($1::bigint[]) AND trial_notified_at IS NULL
+                RETURNING user_id
+                """,
+                user_ids
+            )
+            return [row['user_id'] for row in rows]
     
     @staticmethod
     async def check_premium_expiry() -> int:
         """Проверяет истечение срока премиума"""
         async with db.connection() as conn:
-            result = await conn.execute(
+            rows = await conn.fetch(
                 """
                 UPDATE users 
                 SET is_premium = FALSE,
                     premium_until = NULL
                 WHERE is_premium = TRUE 
                   AND premium_until < CURRENT_DATE
+                RETURNING user_id
                 """
             )
-            if result and "UPDATE" in result:
-                return int(result.split(" ")[1])
-            return 0
+            user_profiles.invalidate(row['user_id'] for row in rows)
+            return len(rows)
     
     @staticmethod
     async def get_or_create(user_id: int, first_name: str, 
@@ -210,22 +306,45 @@ class UserRepository:
             """
             try:
                 row = await conn.fetchrow(query, user_id, first_name, username, language)
-                return dict(row) if row else {}
+                user_data = dict(row) if row else {}
+                user_profiles.put(user_data)
+                return user_data
             except Exception as e:
                 logger.error(f"Ошибка при создании пользователя {user_id}: {e}")
                 raise
     
     @staticmethod
     async def get_user(user_id: int) -> Optional[Dict[str, Any]]:
+        """Полная строка users (всегда из БД). Для языка и премиума - get_profile."""
         async with db.connection() as conn:
             row = await conn.fetchrow("SELECT * FROM users WHERE user_id = $1", user_id)
-            return dict(row) if row else None
+            user_data = dict(row) if row else None
+            user_profiles.put(user_data)
+            return user_data
+
+    @staticmethod
+    async def load_profile(user_id: int) -> Optional[Dict[str, Any]]:
+        """Читает профиль из БД (мимо кэша) и кладёт его в кэш."""
+        async with db.connection() as conn:
+            row = await conn.fetchrow(
+                "SELECT user_id, language_code, is_premium, premium_until FROM users WHERE user_id = $1", user_id
+            )
+        if not row:
+            return None
+        user_profiles.put(dict(row))
+        return dict(row)
+
+    @staticmethod
+    async def get_profile(user_id: int) -> Optional[Dict[str, Any]]:
+        """Язык и премиум-статус: из кэша профилей, при промахе - из БД."""
+        return user_profiles.get(user_id) or await UserRepository.load_profile(user_id)
     
     @staticmethod
     async def update_language(user_id: int, language: Any) -> bool:
         lang_val = language.value if hasattr(language, 'value') else str(language)
         async with db.connection() as conn:
             result = await conn.execute("UPDATE users SET language_code = $1 WHERE user_id = $2", lang_val, user_id)
+            user_profiles.patch(user_id, language_code=lang_val)
             return result is not None
     
     @staticmethod
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from config import WRITE_BEHIND_QUEUE_SIZE, WRITE_BEHIND_WORKERS, WRITE_BEHIND_OVERFLOW
+
+logger = logging.getLogger(__name__)
+
+Job = Tuple[str, Callable[[], Awaitable[object]]]
+
+class WriteBehind:
+    """Фоновая очередь записей в БД (кэш, метрики), чтобы не задерживать ответ пользователю."""
+
+    def __init__(self, maxsize: int, workers: int, overflow: str):
+        self.maxsize = maxsize
+        self.workers = workers
+        self.overflow = overflow  # "drop_oldest" | "drop_new"
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.stats = {"submitted": 0, "done": 0, "failed": 0, "dropped": 0}
+
+    def _get_queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+        return self._queue
+
+    def submit(self, label: str, factory: Callable[[], Awaitable[object]]) -> None:
+        """Ставит запись в очередь без ожидания; при переполнении применяет политику overflow."""
+        queue = self._get_queue()
+        self.stats["submitted"] += 1
+        if queue.full():
+            self.stats["dropped"] += 1
+            if self.overflow == "drop_new":
+                logger.warning(f"Write-behind queue full, dropped: {label}")
+                return
+            dropped_label, _ = queue.get_nowait()
+            queue.task_done()
+            logger.warning(f"Write-behind queue full, dropped oldest: {dropped_label}")
+        queue.put_nowait((label, factory))
+
+    async def _worker(self) -> None:
+        queue = self._get_queue()
+        while True:
+            label, factory = await queue.get()
+            try:
+                await factory()
+                self.stats["done"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"Write-behind job failed ({label}): {e}", exc_info=True)
+            finally:
+                queue.task_done()
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            logger.info(f"✅ Write-behind запущен ({self.workers} воркеров)")
+
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Дожидается записи очереди (не дольше timeout) и останавливает воркеров."""
+        if self._queue is not None and self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Write-behind: не успели записать {self._queue.qsize()} задач при остановке")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+write_behind = WriteBehind(WRITE_BEHIND_QUEUE_SIZE, WRITE_BEHIND_WORKERS, WRITE_BEHIND_OVERFLOW)
@@ -4,10 +4,17 @@ from .common import register_common_handlers
 from .recipes import register_recipe_handlers
 from .voice import register_voice_handlers
 from .favorites import register_favorites_handlers
+from .broadcast import register_broadcast_handlers
+from .middleware import user_context_middleware
 
 def register_all_handlers(dp: Dispatcher):
     """Регистрирует все обработчики"""
+    # Один контекст пользователя на апдейт: хендлеры не перечитывают users по нескольку раз
+    dp.message.middleware(user_context_middleware)
+    dp.callback_query.middleware(user_context_middleware)
+
     register_common_handlers(dp)
+    register_broadcast_handlers(dp)
     register_favorites_handlers(dp)
     register_voice_handlers(dp)
-    register_recipe_handlers(dp)
\ No newline at end of file
+    register_recipe_handlers(dp)
@@ -0,0 +1,87 @@
+import logging
+import re
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Dispatcher
+from aiogram.filters import Command
+from aiogram.types import Message
+
+from database.metrics import metrics
+from services.broadcaster import broadcaster
+from config import ADMIN_IDS, SUPPORTED_LANGUAGES
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_HELP = (
+    "Usage: /broadcast [lang=de,fr] [premium=yes|no] text\n"
+    "Localized text: one block per language, each starting with a [xx] line:\n"
+    "[en]\nHello!\n[de]\nHallo!\n"
+    "Users without their language get the untagged text, otherwise [en]."
+)
+
+_LANG_TAG_RE = re.compile(r"^\[([a-z]{2})\]\s*$", re.MULTILINE)
+_TOKEN_RE = re.compile(r"(\S+)\s*")
+
+async def track_safely(user_id: int, event_name: str, data: dict = None):
+    # Запись уходит в фоновую очередь (write-behind), ответ пользователю не ждёт БД
+    try: metrics.track_event_later(user_id, event_name, data)
+    except: pass
+
+def parse_broadcast(args: str) -> Tuple[Dict[str, str], Optional[List[str]], Optional[bool]]:
+    """Разбирает аргументы /broadcast: фильтры в начале, затем текст (общий и/или блоки [xx])."""
+    languages, premium = None, None
+    rest = args.strip()
+    while True:
+        m = _TOKEN_RE.match(rest)
+        if not m:
+            break
+        token = m.group(1).lower()
+        if token.startswith("lang="):
+            languages = [l for l in token[5:].split(",") if l in SUPPORTED_LANGUAGES] or None
+        elif token in ("premium=yes", "premium=no"):
+            premium = token == "premium=yes"
+        else:
+            break
+        rest = rest[m.end():]
+
+    texts: Dict[str, str] = {}
+    parts = _LANG_TAG_RE.split(rest)
+    if parts[0].strip():
+        texts["default"] = parts[0].strip()
+    for lang, text in zip(parts[1::2], parts[2::2]):
+        if text.strip():
+            texts[lang] = text.strip()
+
+    # Без общего/английского текста шлём только тем, для чьего языка текст есть
+    if texts and "default" not in texts and "en" not in texts:
+        languages = [l for l in (languages or list(texts)) if l in texts]
+    return texts, languages, premium
+
+async def cmd_broadcast(message: Message):
+    if message.from_user.id not in ADMIN_IDS: return
+    args = (message.text or "").split(maxsplit=1)
+    texts, languages, premium = parse_broadcast(args[1] if len(args) > 1 else "")
+    if not texts:
+        await message.answer(BROADCAST_HELP)
+        return
+
+    broadcast = await broadcaster.start(message.bot, message.from_user.id, texts, languages, premium)
+    if broadcast is None:
+        await message.answer("⚠️ Another broadcast is running. /broadcast_status or /broadcast_stop")
+        return
+    await track_safely(message.from_user.id, "broadcast_started", {
+        "id": broadcast['id'], "total": broadcast['total'], "languages": languages, "premium": premium
+    })
+
+async def cmd_broadcast_status(message: Message):
+    if message.from_user.id not in ADMIN_IDS: return
+    await message.answer(broadcaster.format_progress(), parse_mode="HTML")
+
+async def cmd_broadcast_stop(message: Message):
+    if message.from_user.id not in ADMIN_IDS: return
+    await message.answer("🛑 Stopping..." if broadcaster.stop() else "No running broadcast")
+
+def register_broadcast_handlers(dp: Dispatcher):
+    dp.message.register(cmd_broadcast, Command("broadcast"))
+    dp.message.register(cmd_broadcast_status, Command("broadcast_status"))
+    dp.message.register(cmd_broadcast_stop, Command("broadcast_stop"))
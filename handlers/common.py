@@ -9,16 +9,29 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram import html
 
 from database import db 
-from database.users import users_repo
+from database.users import users_repo, user_profiles
 from database.favorites import favorites_repo
 from database.metrics import metrics
+from database.write_behind import write_behind
+from database.metrics_buffer import metrics_buffer
+from database.cache import groq_cache
+from database import compression
 from locales.texts import get_text
-from config import SUPPORTED_LANGUAGES, ADMIN_IDS, SECRET_PROMO_CODE
+from services.groq_scheduler import groq_scheduler
+from services.groq_service import groq_service
+from services.resilience import breaker_stats
+from services.similarity_cache import similarity_cache
+from services.token_budget import token_budget
+from services.cache_warmer import cache_warmer
+from services.input_filter import input_filter
+from handlers.middleware import UserContext, user_context_middleware
+from config import SUPPORTED_LANGUAGES, ADMIN_IDS, SECRET_PROMO_CODE, GROQ_ROUTES, FUSED_PIPELINE_ENABLED, FUSED_PIPELINE_LANGS
 
 logger = logging.getLogger(__name__)
 
 async def track_safely(user_id: int, event_name: str, data: dict = None):
-    try: await metrics.track_event(user_id, event_name, data)
+    # Запись уходит в фоновую очередь (write-behind), ответ пользователю не ждёт БД
+    try: metrics.track_event_later(user_id, event_name, data)
     except: pass
 
 def safe_format_text(text: str) -> str:
@@ -40,7 +53,7 @@ def get_main_menu_keyboard(lang: str, is_premium: bool) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 # --- START ---
-async def cmd_start(message: Message):
+async def cmd_start(message: Message, user_ctx: UserContext = None):
     user_id = message.from_user.id
     first_name = message.from_user.first_name or "User"
     username = message.from_user.username
@@ -54,6 +67,7 @@ async def cmd_start(message: Message):
 
     # 2. Создаем/обновляем юзера
     user_data = await users_repo.get_or_create(user_id, first_name, username, language=default_lang)
+    UserContext.of(user_ctx, user_id).set_user(user_data)
     
     # 3. Актуализируем язык
     current_lang = user_data.get('language_code')
@@ -76,11 +90,10 @@ async def cmd_start(message: Message):
                 await message.answer(gift_text, parse_mode="HTML")
 
 # --- COMMANDS ---
-async def cmd_lang(message: Message):
-    user_id = message.from_user.id
-    user_data = await users_repo.get_user(user_id)
+async def cmd_lang(message: Message, user_ctx: UserContext = None):
+    # Из callback сюда приходит сообщение бота, поэтому пользователь берётся из контекста
     # Если юзер удален из БД, но нажал команду -> фоллбэк на EN
-    lang = user_data.get('language_code', 'en') if user_data else 'en'
+    lang = await UserContext.of(user_ctx, message.from_user.id).lang()
     
     builder = InlineKeyboardBuilder()
     for l_code in SUPPORTED_LANGUAGES:
@@ -99,30 +112,22 @@ async def cmd_lang(message: Message):
     header = safe_format_text(header_raw)
     await message.answer(header, reply_markup=builder.as_markup(), parse_mode="HTML")
 
-async def cmd_favorites(message: Message):
+async def cmd_favorites(message: Message, user_ctx: UserContext = None):
     user_id = message.from_user.id
-    user_data = await users_repo.get_user(user_id)
-    lang = user_data.get('language_code', 'en') if user_data else 'en'
+    lang = await UserContext.of(user_ctx, user_id).lang()
     
-    favorites, pages = await favorites_repo.get_favorites_page(user_id, 1)
-    if not favorites:
+    from handlers.favorites import render_favorites_page
+    rendered = await render_favorites_page(user_id, lang)
+    if not rendered:
         await message.answer(get_text(lang, "favorites_empty"))
         return
     
-    header_text = safe_format_text(get_text(lang, "favorites_title")) + f" (1/{pages})"
-    b = InlineKeyboardBuilder()
-    for fav in favorites:
-        b.row(InlineKeyboardButton(text=f"{fav['dish_name']} ({fav['created_at'].strftime('%d.%m')})", callback_data=f"view_fav_{fav['id']}"))
-    if pages > 1:
-        b.row(InlineKeyboardButton(text="➡️", callback_data="fav_page_2"))
-    b.row(InlineKeyboardButton(text=get_text(lang, "btn_back"), callback_data="main_menu"))
-    await message.answer(header_text, reply_markup=b.as_markup(), parse_mode="HTML")
+    header_text, markup = rendered
+    await message.answer(header_text, reply_markup=markup, parse_mode="HTML")
     await track_safely(user_id, "favorites_viewed", {"page": 1})
 
-async def cmd_help(message: Message):
-    user_id = message.from_user.id
-    user_data = await users_repo.get_user(user_id)
-    lang = user_data.get('language_code', 'en') if user_data else 'en'
+async def cmd_help(message: Message, user_ctx: UserContext = None):
+    lang = await UserContext.of(user_ctx, message.from_user.id).lang()
     
     title = safe_format_text(get_text(lang, 'help_title'))
     text = safe_format_text(get_text(lang, 'help_text'))
@@ -131,10 +136,10 @@ async def cmd_help(message: Message):
     builder.row(InlineKeyboardButton(text=get_text(lang, "btn_back"), callback_data="main_menu"))
     await message.answer(f"<b>{title}</b>\n\n{text}", reply_markup=builder.as_markup(), parse_mode="HTML")
 
-async def cmd_code(message: Message):
+async def cmd_code(message: Message, user_ctx: UserContext = None):
     user_id = message.from_user.id
-    user_data = await users_repo.get_user(user_id)
-    lang = user_data.get('language_code', 'en') if user_data else 'en'
+    user_ctx = UserContext.of(user_ctx, user_id)
+    lang = await user_ctx.lang()
     
     args = message.text.split()
     if len(args) < 2:
@@ -145,19 +150,20 @@ async def cmd_code(message: Message):
     code = args[1].strip()
     if code == SECRET_PROMO_CODE:
         await users_repo.activate_premium(user_id, 365*99)
+        user_ctx.update(is_premium=True)
         await message.answer("💎 Success!", parse_mode="HTML")
         kb = get_main_menu_keyboard(lang, True)
         await message.answer(get_text(lang, "menu"), reply_markup=kb, parse_mode="HTML")
     else:
         await message.answer("🚫 Invalid")
 
-async def cmd_stats(message: Message):
+async def cmd_stats(message: Message, user_ctx: UserContext = None):
     uid = message.from_user.id
     st = await users_repo.get_usage_stats(uid)
     if not st: 
         await message.answer("No data")
         return
-    lang = (await users_repo.get_user(uid) or {}).get('language_code', 'en')
+    lang = await UserContext.of(user_ctx, uid).lang()
     s = "💎 PREMIUM" if st.get('is_premium') else "👤 FREE"
     t = (f"📊 <b>Statistics</b>\n\n{s}\n📝 Text: {st['text_requests_used']}/{st['text_requests_limit']}\n🎤 Voice: {st['voice_requests_used']}/{st['voice_requests_limit']}")
     b = InlineKeyboardBuilder()
@@ -166,23 +172,69 @@ async def cmd_stats(message: Message):
     await message.answer(t, reply_markup=b.as_markup(), parse_mode="HTML")
 
 async def cmd_admin(message: Message):
-    if message.from_user.id in ADMIN_IDS: await message.answer("Admin: /stats /broadcast")
+    if message.from_user.id not in ADMIN_IDS: return
+    q = groq_scheduler.stats()
+    t = (f"Admin: /stats /broadcast /broadcast_status /broadcast_stop\n\n"
+         f"⚙️ <b>Groq queue</b>\n"
+         f"Queue: {q['queue_depth']} | In flight: {q['in_flight']}\n"
+         f"Wait avg/p95: {q['wait_avg']}s / {q['wait_p95']}s\n"
+         f"429: {q['rate_limited']} | Failed: {q['failed']}")
+    for model, left in q['models'].items():
+        t += f"\n{model}: {left['rpm_left']} req / {left['tpm_left']} tok left"
+    sim = similarity_cache.stats()
+    t += (f"\n\n≈ <b>Similarity cache</b>\n"
+          f"Hits: {sim['hits']}/{sim['lookups']} | Avg Jaccard: {sim['avg_similarity']}")
+    breakers = ", ".join(f"{m}: {state}" for m, state in breaker_stats(groq_service.breakers).items()) or "-"
+    t += f"\n\n⚡️ <b>Circuits</b>\n{breakers}\nCalls retried after 429: {groq_service.retried_calls}"
+    budgets = "\n".join(f"{r}: {b['max_tokens']} (cut: {b['truncated']})" for r, b in token_budget.stats(GROQ_ROUTES).items())
+    t += f"\n\n🎯 <b>max_tokens</b>\n{budgets}"
+    f = input_filter.stats
+    t += (f"\n\n🚫 <b>Input filter</b>\nGroq calls saved: {input_filter.saved_calls()}"
+          f" (prefilter {f['rejected']}/{f['checked']}, negative cache {f['negative_hits']})"
+          f"\nKnown products (no cache lookup): {f['known']}")
+    w = cache_warmer.stats
+    t += f"\n\n🔥 <b>Warmup</b>\nTargets: {len(cache_warmer.targets)} | Generated: {w['generated']} | Failed: {w['failed']}"
+    try:
+        c = await groq_cache.db_stats()
+        t += (f"\n\n🗜 <b>groq_cache</b>\nRows: {c['rows']} | {c['bytes'] // 1024} / {c['budget'] // 1024} KB"
+              f" | Saved: {int(compression.ratio() * 100)}%")
+        bf = groq_cache.filter_stats()
+        t += (f"\nBloom: {bf['keys']} keys | DB lookups skipped: {bf['skipped']}"
+              f" | FP: {bf['observed_fp_rate']} (expected {bf.get('expected_fp_rate', 0)})")
+    except Exception as e:
+        logger.warning(f"Cache stats error: {e}")
+    fused = ", ".join(FUSED_PIPELINE_LANGS) if FUSED_PIPELINE_ENABLED and FUSED_PIPELINE_LANGS else "off"
+    t += f"\n\n🔀 <b>Analysis (7d)</b> fused: {fused}"
+    for mode, a in (await metrics.get_analysis_latency(7)).items():
+        t += f"\n{mode}: p50 {a['p50_ms']} / p95 {a['p95_ms']} ms | ok {a['ok']} | n={a['samples']}"
+    p = db.stats()
+    t += (f"\n\n🐘 <b>DB pool</b>{' (pgbouncer)' if p['pgbouncer'] else ''}\n"
+          f"In use: {p['in_use']}/{p['max_size']} (max {p['max_in_use']}) | Idle: {p['idle']}\n"
+          f"Acquire wait avg/p95: {p['wait_avg_ms']} / {p['wait_p95_ms']} ms | Timeouts: {p['acquire_timeouts']}")
+    wb = write_behind.stats
+    t += (f"\n\n📝 <b>Write-behind</b>\n"
+          f"Pending: {write_behind.pending()} | Failed: {wb['failed']} | Dropped: {wb['dropped']}")
+    up = user_profiles.snapshot()
+    t += (f"\n\n👤 <b>User profiles</b>\nDB queries per update: {user_context_middleware.queries_per_update()}"
+          f" | Cache: {up['entries']} | Hit ratio: {up['hit_ratio']} | Age avg/p95: {up['age_avg_s']} / {up['age_p95_s']}s")
+    mb = metrics_buffer.stats
+    t += (f"\n\n📈 <b>Metrics buffer</b>\n"
+          f"Pending: {metrics_buffer.pending()} | Written: {mb['flushed']} in {mb['batches']} batches"
+          f" | Dropped: {mb['dropped']}")
+    await message.answer(t, parse_mode="HTML")
 
 # --- CALLBACKS ---
 
-async def handle_restart(c: CallbackQuery):
-    uid = c.from_user.id
-    ud = await users_repo.get_user(uid)
-    lang = ud.get('language_code', 'en') if ud else 'en'
+async def handle_restart(c: CallbackQuery, user_ctx: UserContext = None):
+    lang = await UserContext.of(user_ctx, c.from_user.id).lang()
     welcome_text = safe_format_text(get_text(lang, "welcome", name=html.quote(c.from_user.first_name)))
     # Без кнопок при рестарте!
     try: await c.message.edit_text(welcome_text, reply_markup=None, parse_mode="HTML")
     except: await c.message.answer(welcome_text, reply_markup=None, parse_mode="HTML")
     await c.answer()
 
-async def handle_main_menu(c: CallbackQuery):
-    uid = c.from_user.id
-    ud = await users_repo.get_user(uid)
+async def handle_main_menu(c: CallbackQuery, user_ctx: UserContext = None):
+    ud = await UserContext.of(user_ctx, c.from_user.id).user()
     lang = ud.get('language_code', 'en') if ud else 'en'
     kb = get_main_menu_keyboard(lang, ud.get('is_premium', False)) if ud else None
     txt = safe_format_text(get_text(lang, "menu"))
@@ -190,18 +242,19 @@ async def handle_main_menu(c: CallbackQuery):
     except: await c.message.answer(txt, reply_markup=kb, parse_mode="HTML")
     await c.answer()
 
-async def handle_show_favorites(c):
+async def handle_show_favorites(c, user_ctx: UserContext = None):
     from handlers.favorites import handle_favorite_pagination
     # Симуляция нажатия без параметра страницы -> откроется 1-я
-    await handle_favorite_pagination(c)
+    await handle_favorite_pagination(c, user_ctx)
 
-async def handle_change_language(c: CallbackQuery):
-    await cmd_lang(c.message)
+async def handle_change_language(c: CallbackQuery, user_ctx: UserContext = None):
+    await cmd_lang(c.message, UserContext.of(user_ctx, c.from_user.id))
     await c.answer()
 
-async def handle_set_language(c: CallbackQuery):
+async def handle_set_language(c: CallbackQuery, user_ctx: UserContext = None):
     l = c.data.split("_")[2]
     await users_repo.update_language(c.from_user.id, l)
+    if user_ctx: user_ctx.update(language_code=l)
     
     welcome = safe_format_text(get_text(l, "welcome", name=html.quote(c.from_user.first_name)))
     await c.message.edit_text(welcome, reply_markup=None, parse_mode="HTML")
@@ -209,12 +262,13 @@ async def handle_set_language(c: CallbackQuery):
     await track_safely(c.from_user.id, "language_changed", {"lang": l})
     await c.answer(get_text(l, "lang_changed"))
 
-async def handle_show_help(c): await cmd_help(c.message); await c.answer()
+async def handle_show_help(c, user_ctx: UserContext = None):
+    await cmd_help(c.message, UserContext.of(user_ctx, c.from_user.id)); await c.answer()
 async def handle_noop(c): await c.answer()
 
 # --- PAYMENT ---
-async def handle_buy_premium(c):
-    lang = (await users_repo.get_user(c.from_user.id)).get('language_code', 'en')
+async def handle_buy_premium(c, user_ctx: UserContext = None):
+    lang = await UserContext.of(user_ctx, c.from_user.id).lang()
     b = InlineKeyboardBuilder()
     b.row(InlineKeyboardButton(text="1 Mon - 100 ⭐️", callback_data="premium_1_month"))
     b.row(InlineKeyboardButton(text="3 Mon - 250 ⭐️ (-17%)", callback_data="premium_3_months"))
@@ -234,12 +288,13 @@ async def handle_premium_buy(c):
     await c.answer()
 
 async def on_pre(q): await q.answer(ok=True)
-async def on_pay(m):
+async def on_pay(m, user_ctx: UserContext = None):
     p = m.successful_payment.invoice_payload
     d = 30
     if "90" in p or "3_months" in p: d = 90
     elif "365" in p or "1_year" in p: d = 365
     await users_repo.activate_premium(m.from_user.id, d)
+    if user_ctx: user_ctx.update(is_premium=True)
     name = html.quote(m.from_user.full_name)
     for adm in ADMIN_IDS:
         try: await m.bot.send_message(adm, f"💰 Sale! {name}: {d} days")
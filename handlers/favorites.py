@@ -4,33 +4,39 @@ from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardBut
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from state_manager import state_manager
-from database.users import users_repo
 from database.favorites import favorites_repo
 from database.metrics import metrics
 from locales.texts import get_text
 from config import FAVORITES_PER_PAGE, FREE_USER_LIMITS
 from database.models import FavoriteRecipe, Category
+from handlers.middleware import UserContext
 
 logger = logging.getLogger(__name__)
 
 async def track_safely(user_id: int, event_name: str, data: dict = None):
-    try: await metrics.track_event(user_id, event_name, data)
+    # Запись уходит в фоновую очередь (write-behind), ответ пользователю не ждёт БД
+    try: metrics.track_event_later(user_id, event_name, data)
     except: pass
 
-async def handle_favorite_pagination(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    lang = (await users_repo.get_user(user_id)).get('language_code', 'en')
-    
-    try: page = int(callback.data.split('_')[2])
-    except: page = 1
-    
-    favorites, total = await favorites_repo.get_favorites_page(user_id, page)
-    
+def _page_callback(page: int, cursor: int, backward: bool) -> str:
+    # fav_page_{номер}_{o|n}_{id}: o - страница старше рецепта id, n - новее (влезает в 64 байта callback_data)
+    return f"fav_page_{page}_{'n' if backward else 'o'}_{cursor}"
+
+async def render_favorites_page(user_id: int, lang: str, page: int = 1, cursor: int = None,
+                                backward: bool = False):
+    """Текст и клавиатура страницы избранного или None, если избранное пусто."""
+    favorites, has_newer, has_older = await favorites_repo.get_favorites_page(user_id, cursor, backward)
+    if not favorites and cursor is not None:
+        # Рецепт-курсор удалили - начинаем с первой страницы
+        page = 1
+        favorites, has_newer, has_older = await favorites_repo.get_favorites_page(user_id)
     if not favorites:
-        try: await callback.message.edit_text(get_text(lang, "favorites_empty"))
-        except: await callback.message.answer(get_text(lang, "favorites_empty"))
-        return 
-    
+        return None
+
+    total = max(1, -(-await favorites_repo.count_favorites(user_id) // FAVORITES_PER_PAGE))
+    if not has_newer: page = 1
+    elif not has_older: page = total
+    page = min(max(page, 1), total)
     header = get_text(lang, "favorites_title") + f" ({page}/{total})"
     # Удаляем лишние звездочки для чистого HTML заголовка
     header = header.replace("**", "") 
@@ -41,18 +47,41 @@ async def handle_favorite_pagination(callback: CallbackQuery):
         btn_text = f"{fav['dish_name']} ({fav['created_at'].strftime('%d.%m')})"
         builder.row(InlineKeyboardButton(text=btn_text, callback_data=f"view_fav_{fav['id']}"))
     
-    if total > 1:
+    if has_newer or has_older:
         row = []
-        if page > 1: row.append(InlineKeyboardButton(text="⬅️", callback_data=f"fav_page_{page - 1}"))
+        if has_newer: row.append(InlineKeyboardButton(text="⬅️", callback_data=_page_callback(page - 1, favorites[0]['id'], True)))
         row.append(InlineKeyboardButton(text=f"{page}/{total}", callback_data="noop"))
-        if page < total: row.append(InlineKeyboardButton(text="➡️", callback_data=f"fav_page_{page + 1}"))
+        if has_older: row.append(InlineKeyboardButton(text="➡️", callback_data=_page_callback(page + 1, favorites[-1]['id'], False)))
         builder.row(*row)
     
     builder.row(InlineKeyboardButton(text=get_text(lang, "btn_back"), callback_data="main_menu"))
+    return header, builder.as_markup()
+
+async def show_favorites_page(callback: CallbackQuery, user_id: int, lang: str, page: int = 1,
+                              cursor: int = None, backward: bool = False):
+    rendered = await render_favorites_page(user_id, lang, page, cursor, backward)
+    if not rendered:
+        try: await callback.message.edit_text(get_text(lang, "favorites_empty"))
+        except: await callback.message.answer(get_text(lang, "favorites_empty"))
+        return 
     
-    await callback.message.edit_text(header, reply_markup=builder.as_markup(), parse_mode="HTML")
+    header, markup = rendered
+    await callback.message.edit_text(header, reply_markup=markup, parse_mode="HTML")
     await track_safely(user_id, "favorites_page_viewed", {"page": page})
 
+async def handle_favorite_pagination(callback: CallbackQuery, user_ctx: UserContext = None):
+    user_id = callback.from_user.id
+    lang = await UserContext.of(user_ctx, user_id).lang()
+    
+    # fav_page_{номер} (первая страница) или fav_page_{номер}_{o|n}_{id}
+    parts = callback.data.split('_')
+    try: page = int(parts[2])
+    except: page = 1
+    try: cursor, backward = int(parts[4]), parts[3] == 'n'
+    except: cursor, backward = None, False
+    
+    await show_favorites_page(callback, user_id, lang, page, cursor, backward)
+
 async def handle_view_favorite(callback: CallbackQuery):
     user_id = callback.from_user.id
     try:
@@ -74,29 +103,30 @@ async def handle_view_favorite(callback: CallbackQuery):
         logger.error(f"View error: {e}")
         await callback.answer("Error")
 
-async def handle_delete_favorite_by_id(callback: CallbackQuery):
+async def handle_delete_favorite_by_id(callback: CallbackQuery, user_ctx: UserContext = None):
     user_id = callback.from_user.id
+    user_ctx = UserContext.of(user_ctx, user_id)
     try:
         fav_id = int(callback.data.split('_')[3])
         fav = await favorites_repo.get_favorite_by_id(fav_id)
         if fav and await favorites_repo.remove_favorite(user_id, fav['dish_name']):
+            user_ctx.favorite_changed(fav['dish_name'], False)
             await callback.answer("🗑 Deleted", show_alert=False) # Маленькое уведомление
-            callback.data = "fav_page_1"
-            await handle_favorite_pagination(callback)
+            await show_favorites_page(callback, user_id, await user_ctx.lang())
         else:
             await callback.answer("Error or already deleted")
     except: await callback.answer("Error")
 
 # --- ДОБАВЛЕНИЕ (FIX УВЕДОМЛЕНИЯ) ---
-async def handle_add_to_favorites(callback: CallbackQuery):
+async def handle_add_to_favorites(callback: CallbackQuery, user_ctx: UserContext = None):
     user_id = callback.from_user.id
-    user_data = await users_repo.get_user(user_id)
-    lang = user_data.get('language_code', 'en')
-    is_premium = user_data.get('is_premium', False)
+    user_ctx = UserContext.of(user_ctx, user_id)
+    lang = await user_ctx.lang()
+    is_premium = await user_ctx.is_premium()
 
     try:
         if not is_premium:
-            current_count = await favorites_repo.count_favorites(user_id)
+            current_count = await user_ctx.favorites_count()
             if current_count >= FREE_USER_LIMITS["max_favorites"]:
                 # Paywall через ALERT (чтобы юзер точно нажал ОК)
                 await callback.answer(get_text(lang, "limit_favorites_exceeded"), show_alert=True)
@@ -124,6 +154,7 @@ async def handle_add_to_favorites(callback: CallbackQuery):
         )
         
         if await favorites_repo.add_favorite(fav):
+            user_ctx.favorite_changed(dish_name, True)
             msg = get_text(lang, "favorite_added").format(dish_name=dish_name)
             # !!! ФИКС: show_alert=False - это стандартное уведомление внизу. 
             # Если хотите окно по центру - show_alert=True. 
@@ -140,9 +171,10 @@ async def handle_add_to_favorites(callback: CallbackQuery):
         logger.error(f"Fav Add Error: {e}")
         await callback.answer("Error")
 
-async def handle_remove_from_favorites(callback: CallbackQuery):
+async def handle_remove_from_favorites(callback: CallbackQuery, user_ctx: UserContext = None):
     user_id = callback.from_user.id
-    lang = (await users_repo.get_user(user_id)).get('language_code', 'en')
+    user_ctx = UserContext.of(user_ctx, user_id)
+    lang = await user_ctx.lang()
     try:
         dish_index = int(callback.data.split('_')[2])
         current = state_manager.get_current_dish(user_id)
@@ -151,6 +183,7 @@ async def handle_remove_from_favorites(callback: CallbackQuery):
         dish_name = current.get('name') if current else (dishes[dish_index].get('name') if dishes else None)
         
         if dish_name and await favorites_repo.remove_favorite(user_id, dish_name):
+            user_ctx.favorite_changed(dish_name, False)
             await callback.answer("🗑 Removed from Favorites", show_alert=False)
             await update_favorite_button(callback, dish_index, False, lang)
         else: await callback.answer("Error")
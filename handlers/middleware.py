@@ -0,0 +1,112 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from database.users import users_repo, user_profiles
+from database.favorites import favorites_repo
+
+logger = logging.getLogger(__name__)
+
+class UserContext:
+    """Данные пользователя в рамках одного апдейта.
+
+    Профиль пользователя, результат проверки лимита и ответы по избранному запрашиваются
+    у БД не больше одного раза; свои записи хендлер отражает через update()/invalidate()."""
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self._user: Optional[Dict[str, Any]] = None
+        self._loaded = False
+        self._favorites: Dict[str, bool] = {}
+        self._favorites_count: Optional[int] = None
+        self.limits: Optional[Tuple[bool, int, int]] = None  # (разрешено, использовано, лимит) последней проверки
+        self.queries = 0  # Сколько обращений к БД сделал контекст
+
+    @classmethod
+    def of(cls, user_ctx: Optional["UserContext"], user_id: int) -> "UserContext":
+        """Контекст из middleware или новый (если хендлер вызван напрямую)."""
+        return user_ctx if user_ctx is not None else cls(user_id)
+
+    async def user(self) -> Optional[Dict[str, Any]]:
+        """Профиль пользователя (язык, премиум): из кэша профилей, при промахе - один запрос к БД."""
+        if not self._loaded:
+            self._user = user_profiles.get(self.user_id)
+            if self._user is None:
+                self.queries += 1
+                self._user = await users_repo.load_profile(self.user_id)
+            self._loaded = True
+        return self._user
+
+    async def lang(self) -> str:
+        return (await self.user() or {}).get('language_code', 'en')
+
+    async def is_premium(self) -> bool:
+        return bool((await self.user() or {}).get('is_premium', False))
+
+    def set_user(self, user_data: Optional[Dict[str, Any]]) -> None:
+        """Строка уже получена другим запросом (например, get_or_create)."""
+        self._user, self._loaded = user_data, True
+
+    def update(self, **fields: Any) -> None:
+        """Отражает в контексте собственную запись хендлера (язык, премиум)."""
+        if self._loaded and self._user is not None:
+            self._user.update(fields)
+
+    def invalidate(self) -> None:
+        """Следующее чтение снова пойдёт в БД."""
+        self._user, self._loaded = None, False
+        self._favorites.clear()
+        self._favorites_count = None
+
+    async def check_and_increment_request(self, request_type: str = "text") -> Tuple[bool, int, int]:
+        self.queries += 1
+        self.limits = await users_repo.check_and_increment_request(self.user_id, request_type)
+        return self.limits
+
+    async def is_favorite(self, dish_name: str) -> bool:
+        if dish_name not in self._favorites:
+            self.queries += 1
+            self._favorites[dish_name] = await favorites_repo.is_favorite(self.user_id, dish_name)
+        return self._favorites[dish_name]
+
+    async def favorites_count(self) -> int:
+        if self._favorites_count is None:
+            self.queries += 1
+            self._favorites_count = await favorites_repo.count_favorites(self.user_id)
+        return self._favorites_count
+
+    def favorite_changed(self, dish_name: str, is_favorite: bool) -> None:
+        self._favorites[dish_name] = is_favorite
+        self._favorites_count = None
+
+class UserContextMiddleware(BaseMiddleware):
+    """Кладёт в данные хендлера user_ctx - ленивый контекст пользователя на время апдейта."""
+
+    def __init__(self):
+        self.stats = {"updates": 0, "queries": 0}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        # main.py регистрирует хендлеры повторно в on_startup - второй экземпляр контекста не нужен
+        if from_user is None or "user_ctx" in data:
+            return await handler(event, data)
+
+        ctx = UserContext(from_user.id)
+        data["user_ctx"] = ctx
+        try:
+            return await handler(event, data)
+        finally:
+            self.stats["updates"] += 1
+            self.stats["queries"] += ctx.queries
+
+    def queries_per_update(self) -> float:
+        return round(self.stats["queries"] / self.stats["updates"], 2) if self.stats["updates"] else 0.0
+
+user_context_middleware = UserContextMiddleware()
@@ -1,20 +1,24 @@
 import logging
 import re
+import time
 from aiogram import Dispatcher, F, html
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from database.users import users_repo
-from database.favorites import favorites_repo
 from database.metrics import metrics
 from services.groq_service import groq_service
+from services.prefetch import dish_prefetcher
+from services.input_filter import input_filter
+from handlers.middleware import UserContext
 from locales.texts import get_text
 from state_manager import state_manager
+from config import GROQ_STREAMING, STREAM_EDIT_INTERVAL
 
 logger = logging.getLogger(__name__)
 
 async def track_safely(user_id: int, event_name: str, data: dict = None):
-    try: await metrics.track_event(user_id, event_name, data)
+    # Запись уходит в фоновую очередь (write-behind), ответ пользователю не ждёт БД
+    try: metrics.track_event_later(user_id, event_name, data)
     except: pass
 
 def safe_format_recipe_text(text: str) -> str:
@@ -59,27 +63,58 @@ def parse_direct_request(text: str) -> str | None:
                 # .title() делает "Apple Pie", "Pizza Margherita"
     return None
 
-async def generate_and_send_recipe(message_or_callback, user_id, dish_name, products, lang, is_direct=False):
+STREAM_PREVIEW_LIMIT = 4000  # Лимит Telegram на сообщение - 4096 символов
+
+async def stream_recipe_to_message(wait_msg: Message, user_id, dish_name, products, lang, is_premium, is_direct) -> str:
+    """Стримит рецепт, периодически правя сообщение-заглушку. Возвращает полный текст."""
+    parts = []
+    last_edit = 0.0  # Первый кусок показываем сразу, дальше - не чаще STREAM_EDIT_INTERVAL
+    last_preview = ""
+
+    async for chunk in groq_service.stream_recipe(dish_name, products, lang, user_id, is_premium, is_direct):
+        parts.append(chunk)
+        now = time.monotonic()
+        if now - last_edit < STREAM_EDIT_INTERVAL:
+            continue
+
+        preview = safe_format_recipe_text("".join(parts))
+        if len(preview) > STREAM_PREVIEW_LIMIT:
+            continue  # Длинный текст отправим целиком в конце
+        if preview and preview != last_preview:
+            try:
+                await wait_msg.edit_text(preview + " ▌", parse_mode="HTML")
+                last_preview = preview
+            except Exception as e:
+                logger.debug(f"Stream edit skipped: {e}")
+        last_edit = now
+
+    return "".join(parts)
+
+async def generate_and_send_recipe(message_or_callback, user_id, dish_name, products, lang, is_direct=False,
+                                   user_ctx: UserContext = None):
+    user_ctx = UserContext.of(user_ctx, user_id)
     try:
-        user_data = await users_repo.get_user(user_id)
-        is_premium = user_data.get('is_premium', False)
+        is_premium = await user_ctx.is_premium()
         
         msg_obj = message_or_callback if isinstance(message_or_callback, Message) else message_or_callback.message
         
         if isinstance(message_or_callback, Message): wait_msg = await msg_obj.answer(get_text(lang, "processing"))
         else: wait_msg = await msg_obj.edit_text(get_text(lang, "processing"))
             
-        recipe = await groq_service.generate_recipe(dish_name, products, lang, user_id, is_premium, is_direct)
-        await wait_msg.delete()
+        if GROQ_STREAMING:
+            recipe = await stream_recipe_to_message(wait_msg, user_id, dish_name, products, lang, is_premium, is_direct)
+        else:
+            recipe = await groq_service.generate_recipe(dish_name, products, lang, user_id, is_premium, is_direct)
 
         if get_text(lang, "safety_refusal") in recipe:
+             await wait_msg.delete()
              await msg_obj.answer(get_text(lang, "safety_refusal"))
              return
 
         final_recipe_text = safe_format_recipe_text(recipe)
         state_manager.set_current_recipe_text(user_id, final_recipe_text)
 
-        await track_safely(user_id, "recipe_generated", {"dish": dish_name, "direct": is_direct})
+        await track_safely(user_id, "recipe_generated", {"dish": dish_name, "direct": is_direct, "lang": lang, "premium": is_premium})
         
         if is_direct:
             fake_dishes = [{"name": dish_name, "category": "direct"}]
@@ -95,7 +130,7 @@ async def generate_and_send_recipe(message_or_callback, user_id, dish_name, prod
                      state_manager.set_current_dish(user_id, d)
                      break
         
-        is_favorite = await favorites_repo.is_favorite(user_id, dish_name)
+        is_favorite = await user_ctx.is_favorite(dish_name)
         builder = InlineKeyboardBuilder()
         
         if is_favorite:
@@ -113,6 +148,14 @@ async def generate_and_send_recipe(message_or_callback, user_id, dish_name, prod
                 InlineKeyboardButton(text=get_text(lang, "btn_back"), callback_data=back_data)
             )
         
+        # При стриминге превращаем заглушку в итоговое сообщение, иначе отправляем новое
+        if GROQ_STREAMING:
+            try:
+                await wait_msg.edit_text(final_recipe_text, reply_markup=builder.as_markup(), parse_mode="HTML")
+                return
+            except Exception as e:
+                logger.debug(f"Final stream edit failed, resending: {e}")
+        await wait_msg.delete()
         await msg_obj.answer(final_recipe_text, reply_markup=builder.as_markup(), parse_mode="HTML")
         
     except Exception as e:
@@ -123,16 +166,52 @@ async def generate_and_send_recipe(message_or_callback, user_id, dish_name, prod
         except: pass
 
 
-async def handle_text_message(message: Message):
+async def analyze_and_store(user_id: int, text: str, lang: str, is_premium: bool):
+    """Анализирует продукты и сохраняет категории (и блюда в объединённом режиме) в state_manager."""
+    fused = groq_service.is_fused_enabled(lang)
+    started = time.monotonic()
+    if fused:
+        analysis_result = await groq_service.analyze_with_dishes(text, lang, user_id, is_premium)
+    else:
+        analysis_result = await groq_service.analyze_products(text, lang, user_id, is_premium)
+    latency_ms = int((time.monotonic() - started) * 1000)
+
+    # Для сравнения объединённого режима с двухшаговым
+    await track_safely(user_id, "analysis_completed", {
+        "mode": "fused" if fused else "two_step", "latency_ms": latency_ms, "ok": bool(analysis_result)
+    })
+    if not analysis_result or not analysis_result.get("categories"):
+        return None
+
+    categories = analysis_result["categories"]
+    state_manager.set_categories(user_id, categories)
+    if analysis_result.get("dishes"):
+        state_manager.set_category_dishes(user_id, analysis_result["dishes"])
+
+    # Предзагружаем только категории, для которых блюд ещё нет
+    missing = [c for c in categories if not (analysis_result.get("dishes") or {}).get(c.lower().strip())]
+    dish_prefetcher.schedule(user_id, text, missing, lang, is_premium)
+    return analysis_result
+
+async def handle_text_message(message: Message, user_ctx: UserContext = None):
     user_id = message.from_user.id
     text = message.text.strip()
     
     if text.startswith("/"): return
 
-    user_data = await users_repo.get_user(user_id)
-    lang = user_data.get('language_code', 'en')
+    user_ctx = UserContext.of(user_ctx, user_id)
+    lang = await user_ctx.lang()
     
-    check_result = await users_repo.check_and_increment_request(user_id, "text")
+    # Явный мусор отсекаем локально: без вызова Groq и без списания лимита
+    direct_dish = parse_direct_request(text)
+    if not direct_dish:
+        reason = await input_filter.rejection_reason(text, lang)
+        if reason:
+            await track_safely(user_id, "groq_call_saved", {"reason": reason, "length": len(text)})
+            await message.answer(get_text(lang, "error_not_enough_products"))
+            return
+
+    check_result = await user_ctx.check_and_increment_request("text")
     allowed = check_result[0]
     
     if not allowed:
@@ -141,20 +220,19 @@ async def handle_text_message(message: Message):
         await message.answer(get_text(lang, "limit_text_exceeded"), parse_mode="HTML")
         return
 
-    direct_dish = parse_direct_request(text)
     if direct_dish:
         state_manager.set_products(user_id, "") 
-        await generate_and_send_recipe(message, user_id, direct_dish, "", lang, is_direct=True)
+        await generate_and_send_recipe(message, user_id, direct_dish, "", lang, is_direct=True, user_ctx=user_ctx)
         return
 
     state_manager.set_products(user_id, text)
     wait_msg = await message.answer(get_text(lang, "processing"))
     
     try:
-        analysis_result = await groq_service.analyze_products(text, lang, user_id)
+        analysis_result = await analyze_and_store(user_id, text, lang, await user_ctx.is_premium())
         await wait_msg.delete()
         
-        if not analysis_result or not analysis_result.get("categories"):
+        if not analysis_result:
             await track_safely(user_id, "category_analysis_failed", {"products": text})
             await message.answer(get_text(lang, "error_not_enough_products"))
             return
@@ -162,7 +240,6 @@ async def handle_text_message(message: Message):
         categories = analysis_result["categories"]
         suggestion = analysis_result.get("suggestion")
         
-        state_manager.set_categories(user_id, categories)
         if suggestion: await message.answer(suggestion)
             
         builder = InlineKeyboardBuilder()
@@ -190,17 +267,27 @@ async def handle_text_message(message: Message):
         await message.answer(get_text(lang, "error_generation"))
 
 
-async def handle_category_selection(callback: CallbackQuery):
+async def handle_category_selection(callback: CallbackQuery, user_ctx: UserContext = None):
     user_id = callback.from_user.id
-    lang = (await users_repo.get_user(user_id)).get('language_code', 'en')
+    user_ctx = UserContext.of(user_ctx, user_id)
+    lang = await user_ctx.lang()
+    is_premium = await user_ctx.is_premium()
     category = callback.data.split('_')[1]
     products = state_manager.get_products(user_id)
     if not products and products != "":
         await callback.message.edit_text(get_text(lang, "start_manual"))
         return
-    wait_msg = await callback.message.edit_text(get_text(lang, "processing"))
+    # Объединённый режим: блюда уже получены вместе с категориями
+    dishes = state_manager.get_category_dishes(user_id, category)
+    if dishes:
+        await track_safely(user_id, "dish_list_served", {"source": "pipeline"})
+        wait_msg = callback.message
+    else:
+        dish_prefetcher.mark_used(user_id, category)
+        wait_msg = await callback.message.edit_text(get_text(lang, "processing"))
     try:
-        dishes = await groq_service.generate_dishes_list(products, category, lang)
+        if not dishes:
+            dishes = await groq_service.generate_dishes_list(products, category, lang, user_id, is_premium)
         await wait_msg.delete()
         if not dishes:
             await callback.message.answer(get_text(lang, "error_generation"))
@@ -215,9 +302,10 @@ async def handle_category_selection(callback: CallbackQuery):
         await callback.message.answer(dish_header, reply_markup=builder.as_markup())
     except: await callback.message.answer(get_text(lang, "error_generation"))
 
-async def handle_dish_selection(callback: CallbackQuery):
+async def handle_dish_selection(callback: CallbackQuery, user_ctx: UserContext = None):
     user_id = callback.from_user.id
-    lang = (await users_repo.get_user(user_id)).get('language_code', 'en')
+    user_ctx = UserContext.of(user_ctx, user_id)
+    lang = await user_ctx.lang()
     try:
         dish_index = int(callback.data.split('_')[1])
         dishes = state_manager.get_generated_dishes(user_id)
@@ -227,12 +315,13 @@ async def handle_dish_selection(callback: CallbackQuery):
         dish = dishes[dish_index]
         state_manager.set_current_dish(user_id, dish)
         await callback.answer()
-        await generate_and_send_recipe(callback, user_id, dish.get('name'), state_manager.get_products(user_id), lang, is_direct=False)
+        await generate_and_send_recipe(callback, user_id, dish.get('name'), state_manager.get_products(user_id), lang, is_direct=False,
+                                       user_ctx=user_ctx)
     except: await callback.message.answer(get_text(lang, "error_generation"))
 
-async def handle_back_to_categories(callback: CallbackQuery):
+async def handle_back_to_categories(callback: CallbackQuery, user_ctx: UserContext = None):
     user_id = callback.from_user.id
-    lang = (await users_repo.get_user(user_id)).get('language_code', 'en')
+    lang = await UserContext.of(user_ctx, user_id).lang()
     categories = state_manager.get_categories(user_id)
     if not categories:
         await callback.message.edit_text(get_text(lang, "error_session_expired"))
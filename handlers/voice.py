@@ -3,30 +3,30 @@ import os
 from aiogram import Dispatcher, F
 from aiogram.types import Message
 from aiogram import types
-from database.users import users_repo
 from database.metrics import metrics
 from services.voice_service import VoiceService
-from services.groq_service import groq_service
+from services.input_filter import input_filter
 from locales.texts import get_text
 from state_manager import state_manager
-from handlers.recipes import parse_direct_request, generate_and_send_recipe
+from handlers.recipes import parse_direct_request, generate_and_send_recipe, analyze_and_store
+from handlers.middleware import UserContext
 
 logger = logging.getLogger(__name__)
 voice_service = VoiceService()
 
 async def track_safely(user_id: int, event_name: str, data: dict = None):
     try: 
-        await metrics.track_event(user_id, event_name, data)
+        metrics.track_event_later(user_id, event_name, data)
     except: 
         pass
 
-async def handle_voice_message(message: Message):
+async def handle_voice_message(message: Message, user_ctx: UserContext = None):
     user_id = message.from_user.id
-    user_data = await users_repo.get_user(user_id)
-    lang = user_data.get('language_code', 'en')
+    user_ctx = UserContext.of(user_ctx, user_id)
+    lang = await user_ctx.lang()
     
     # ✅ ИСПРАВЛЕНО: Правильная обработка результата
-    limit_result = await users_repo.check_and_increment_request(user_id, "voice")
+    limit_result = await user_ctx.check_and_increment_request("voice")
     if not limit_result[0]:  # limit_result[0] = success (True/False)
         await message.answer(get_text(lang, "limit_voice_exceeded"), parse_mode="HTML")
         return
@@ -56,25 +56,30 @@ async def handle_voice_message(message: Message):
         direct_dish = parse_direct_request(text)
         if direct_dish:
             state_manager.set_products(user_id, "")
-            await generate_and_send_recipe(message, user_id, direct_dish, "", lang, is_direct=True)
+            await generate_and_send_recipe(message, user_id, direct_dish, "", lang, is_direct=True, user_ctx=user_ctx)
             await track_safely(user_id, "voice_command_success", {"cmd": text})
             return
 
         # --- 2. АНАЛИЗ ПРОДУКТОВ ---
+        reason = await input_filter.rejection_reason(text, lang)
+        if reason:
+            await track_safely(user_id, "groq_call_saved", {"reason": reason, "length": len(text), "voice": True})
+            await message.answer(get_text(lang, "error_not_enough_products"))
+            return
+
         state_manager.set_products(user_id, text)
         wait_msg = await message.answer(get_text(lang, "processing"))
         
-        analysis_result = await groq_service.analyze_products(text, lang, user_id)  # ✅ Добавлен user_id
+        analysis_result = await analyze_and_store(user_id, text, lang, await user_ctx.is_premium())
         await wait_msg.delete()
         
-        if not analysis_result or not analysis_result.get("categories"):
+        if not analysis_result:
             await message.answer(get_text(lang, "error_not_enough_products"))
             return
         
         categories = analysis_result["categories"]
         suggestion = analysis_result.get("suggestion")
 
-        state_manager.set_categories(user_id, categories)
         
         # Показываем умный совет
         if suggestion:
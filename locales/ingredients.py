@@ -0,0 +1,92 @@
+from typing import Dict, List
+
+# Словари продуктов для локального пре-фильтра (services/input_filter.py).
+# Формы - единственное число в нижнем регистре; множественное число и синонимы
+# приводятся через services/canonical. Список не обязан быть полным: достаточно,
+# чтобы в реальном списке продуктов нашлось хотя бы одно знакомое слово.
+
+INGREDIENTS: Dict[str, List[str]] = {
+    "en": [
+        # Овощи и зелень
+        "potato", "tomato", "onion", "garlic", "carrot", "cabbage", "cucumber", "pepper", "bell pepper", "chili",
+        "zucchini", "eggplant", "pumpkin", "squash", "broccoli", "cauliflower", "spinach", "lettuce", "kale", "celery",
+        "leek", "beet", "radish", "corn", "pea", "bean", "green bean", "lentil", "chickpea", "asparagus", "artichoke",
+        "mushroom", "avocado", "olive", "ginger", "herb", "parsley", "dill", "basil", "cilantro", "mint", "thyme",
+        "rosemary", "oregano", "green onion", "arugula", "sweet potato", "turnip", "shallot",
+        # Фрукты и ягоды
+        "apple", "pear", "banana", "orange", "lemon", "lime", "grape", "strawberry", "raspberry", "blueberry", "cherry",
+        "peach", "apricot", "plum", "mango", "pineapple", "kiwi", "melon", "watermelon", "coconut", "raisin", "date",
+        "fig", "berry", "pomegranate",
+        # Мясо, рыба, яйца
+        "meat", "beef", "pork", "lamb", "veal", "chicken", "turkey", "duck", "bacon", "ham", "sausage", "salami",
+        "ground meat", "steak", "fillet", "breast", "wing", "liver", "fish", "salmon", "tuna", "cod", "trout",
+        "shrimp", "crab", "squid", "mussel", "egg",
+        # Молочное
+        "milk", "cream", "sour cream", "butter", "cheese", "yogurt", "cottage cheese", "mozzarella", "parmesan",
+        "feta", "ricotta", "kefir",
+        # Крупы, мука, хлеб
+        "rice", "pasta", "spaghetti", "noodle", "flour", "bread", "oat", "oatmeal", "buckwheat", "quinoa", "couscous",
+        "semolina", "tortilla", "dough", "cracker", "cereal",
+        # Прочее
+        "sugar", "honey", "salt", "oil", "olive oil", "vinegar", "soy sauce", "ketchup", "mayonnaise", "mustard",
+        "chocolate", "cocoa", "coffee", "tea", "nut", "walnut", "almond", "peanut", "hazelnut", "seed", "tofu",
+        "yeast", "vanilla", "cinnamon", "water", "juice", "wine", "broth", "stock", "jam", "syrup", "spice",
+    ],
+    "de": [
+        "kartoffel", "tomate", "zwiebel", "knoblauch", "karotte", "kohl", "kohlrabi", "rosenkohl", "sauerkraut",
+        "gurke", "paprika", "chili", "zucchini",
+        "aubergine", "kürbis", "brokkoli", "blumenkohl", "spinat", "salat", "sellerie", "lauch", "rote bete", "radieschen",
+        "mais", "erbse", "bohne", "linse", "kichererbse", "spargel", "pilz", "champignon", "avocado", "olive", "ingwer",
+        "petersilie", "dill", "basilikum", "minze", "frühlingszwiebel", "süßkartoffel", "apfel", "birne", "banane",
+        "orange", "zitrone", "limette", "traube", "erdbeere", "himbeere", "heidelbeere", "kirsche", "pfirsich",
+        "aprikose", "pflaume", "mango", "ananas", "kiwi", "melone", "fleisch", "rind", "rindfleisch", "schwein",
+        "schweinefleisch", "lamm", "hähnchen", "huhn", "pute", "ente", "speck", "schinken", "wurst", "hack", "steak",
+        "leber", "fisch", "lachs", "thunfisch", "kabeljau", "forelle", "garnele", "ei", "milch", "sahne", "butter",
+        "käse", "joghurt", "quark", "schmand", "reis", "nudel", "spaghetti", "mehl", "brot", "haferflocke",
+        "buchweizen", "grieß", "teig", "zucker", "honig", "salz", "öl", "olivenöl", "essig", "senf", "schokolade",
+        "kakao", "kaffee", "tee", "nuss", "walnuss", "mandel", "erdnuss", "haselnuss", "tofu", "hefe", "zimt",
+        "wasser", "saft", "wein", "brühe", "marmelade",
+    ],
+    "fr": [
+        "patate", "tomate", "oignon", "ail", "carotte", "chou", "concombre", "poivron", "piment", "courgette",
+        "aubergine", "potiron", "citrouille", "brocoli", "chou-fleur", "épinard", "salade", "laitue", "céleri",
+        "poireau", "betterave", "radis", "maïs", "petit pois", "pois", "haricot", "lentille", "pois chiche", "asperge",
+        "champignon", "avocat", "olive", "gingembre", "persil", "aneth", "basilic", "coriandre", "menthe", "thym",
+        "échalote", "pomme", "poire", "banane", "orange", "citron", "raisin", "fraise", "framboise", "myrtille",
+        "cerise", "pêche", "abricot", "prune", "mangue", "ananas", "kiwi", "melon", "viande", "boeuf", "bœuf", "porc",
+        "agneau", "veau", "poulet", "dinde", "canard", "lardon", "jambon", "saucisse", "haché", "steak", "foie",
+        "poisson", "saumon", "thon", "cabillaud", "truite", "crevette", "moule", "oeuf", "œuf", "lait", "crème",
+        "beurre", "fromage", "yaourt", "riz", "pâte", "pâtes", "spaghetti", "nouille", "farine", "pain", "avoine",
+        "semoule", "sucre", "miel", "sel", "huile", "vinaigre", "moutarde", "chocolat", "cacao", "café", "thé",
+        "noix", "amande", "cacahuète", "noisette", "tofu", "levure", "cannelle", "eau", "jus", "vin", "bouillon",
+        "confiture",
+    ],
+    "it": [
+        "patata", "pomodoro", "cipolla", "aglio", "carota", "cavolo", "cetriolo", "peperone", "peperoncino",
+        "zucchina", "zucchine", "melanzana", "zucca", "broccolo", "broccoli", "cavolfiore", "spinaci", "insalata",
+        "lattuga", "sedano", "porro", "barbabietola", "ravanello", "mais", "pisello", "fagiolo", "lenticchia", "cece",
+        "asparago", "fungo", "avocado", "oliva", "zenzero", "prezzemolo", "aneto", "basilico", "menta", "rosmarino",
+        "origano", "rucola", "mela", "pera", "banana", "arancia", "limone", "uva", "fragola", "lampone", "mirtillo",
+        "ciliegia", "pesca", "albicocca", "prugna", "mango", "ananas", "kiwi", "melone", "anguria", "carne", "manzo",
+        "maiale", "agnello", "vitello", "pollo", "tacchino", "anatra", "pancetta", "prosciutto", "salsiccia",
+        "salame", "carne macinata", "bistecca", "fegato", "pesce", "salmone", "tonno", "merluzzo", "trota",
+        "gambero", "cozza", "calamaro", "uovo", "latte", "panna", "burro", "formaggio", "yogurt", "mozzarella",
+        "parmigiano", "ricotta", "riso", "pasta", "spaghetti", "farina", "pane", "avena", "semola", "zucchero",
+        "miele", "sale", "olio", "aceto", "senape", "cioccolato", "cacao", "caffè", "tè", "noce", "mandorla",
+        "arachide", "nocciola", "tofu", "lievito", "cannella", "acqua", "succo", "vino", "brodo", "marmellata",
+    ],
+    "es": [
+        "patata", "tomate", "cebolla", "ajo", "zanahoria", "col", "repollo", "pepino", "pimiento", "chile",
+        "calabacín", "berenjena", "calabaza", "brócoli", "coliflor", "espinaca", "lechuga", "apio", "puerro",
+        "remolacha", "rábano", "maíz", "guisante", "judía", "lenteja", "garbanzo", "espárrago", "champiñón", "seta",
+        "aguacate", "aceituna", "jengibre", "perejil", "eneldo", "albahaca", "cilantro", "menta", "tomillo", "romero",
+        "orégano", "manzana", "pera", "plátano", "banana", "naranja", "limón", "lima", "uva", "fresa", "frambuesa",
+        "arándano", "cereza", "melocotón", "durazno", "albaricoque", "ciruela", "mango", "piña", "kiwi", "melón",
+        "sandía", "carne", "ternera", "res", "cerdo", "cordero", "pollo", "pavo", "pato", "tocino", "beicon", "jamón",
+        "salchicha", "chorizo", "carne molida", "bistec", "hígado", "pescado", "salmón", "atún", "bacalao", "trucha",
+        "camarón", "mejillón", "calamar", "huevo", "leche", "nata", "crema", "mantequilla", "queso", "yogur", "arroz",
+        "pasta", "espagueti", "fideo", "harina", "pan", "avena", "sémola", "tortilla", "azúcar", "miel", "sal",
+        "aceite", "vinagre", "mostaza", "chocolate", "cacao", "café", "té", "nuez", "almendra", "cacahuete", "maní",
+        "avellana", "tofu", "levadura", "canela", "agua", "zumo", "jugo", "vino", "caldo", "mermelada",
+    ],
+}
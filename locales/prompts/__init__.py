@@ -26,6 +26,9 @@ PROMPTS_REGISTRY = {
     "es": es_prompts,
 }
 
+# Версия промптов: увеличьте при смысловой правке, чтобы старые ответы в кэше не переиспользовались
+PROMPTS_VERSION = 1
+
 # 3. Главная функция
 def get_prompt(lang: str, key: str) -> str:
     """Получает текст промпта с безопасным фоллбэком на Английский."""
@@ -46,4 +49,8 @@ def get_prompt(lang: str, key: str) -> str:
     if not val:
         val = PROMPTS_REGISTRY["en"].get(key, "")
         
-    return val
\ No newline at end of file
+    return val
+
+def has_prompt(lang: str, key: str) -> bool:
+    """Проверяет, задан ли промпт в словаре самого языка (без фоллбэка на EN)."""
+    return bool(PROMPTS_REGISTRY.get(lang, {}).get(key))
@@ -19,6 +19,27 @@ JSON Array: [{"name": "Name", "desc": "Beschreibung auf Deutsch"}]
 Nur JSON.""",
     "dish_generation_user": "Zutaten: {products}\nKategorie: {category}\nSchlage 4-6 Gerichte vor.",
 
+    # Объединённый режим: категории + блюда одним запросом (удалите ключи, чтобы выключить для языка)
+    "fused_analysis": """You are an expert chef.
+Step 1: Analyze input ingredients and pick VIABLE dish categories (+ basics like salt, oil, water).
+Step 2: For EACH chosen category suggest 4-6 specific dishes.
+Step 3: Suggest ONE clever "missing link" ingredient.
+
+IMPORTANT: Use ONLY ENGLISH KEYS for categories: ["soup", "main", "salad", "breakfast", "dessert", "drink", "snack"].
+Dish names and descriptions in German.
+
+Return JSON object:
+{
+  "categories": ["main", "soup"],
+  "dishes": {
+    "main": [{"name": "Dish Name", "desc": "Brief description"}],
+    "soup": [{"name": "Dish Name", "desc": "Brief description"}]
+  },
+  "suggestion": "💡 Tipp: Füge [Zutat] hinzu!"
+}
+Only JSON.""",
+    "fused_analysis_user": "Zutaten: {products}\nGib Kategorien und je 4-6 Gerichte zurück.",
+
     "recipe_generation": """Detaillierter Kochlehrer.
 SPRACHE: Deutsch.
 
@@ -22,6 +22,27 @@ Return JSON array: [{"name": "Dish Name", "desc": "Brief description"}]
 Only JSON.""",
     "dish_generation_user": "Ingredients: {products}\nCategory: {category}\nSuggest 4-6 dishes.",
 
+    # Объединённый режим: категории + блюда одним запросом (удалите ключи, чтобы выключить для языка)
+    "fused_analysis": """You are an expert chef.
+Step 1: Analyze input ingredients and pick VIABLE dish categories (+ basics like salt, oil, water).
+Step 2: For EACH chosen category suggest 4-6 specific dishes.
+Step 3: Suggest ONE clever "missing link" ingredient.
+
+IMPORTANT: Use ONLY ENGLISH KEYS for categories: ["soup", "main", "salad", "breakfast", "dessert", "drink", "snack"].
+Dish names and descriptions in English.
+
+Return JSON object:
+{
+  "categories": ["main", "soup"],
+  "dishes": {
+    "main": [{"name": "Dish Name", "desc": "Brief description"}],
+    "soup": [{"name": "Dish Name", "desc": "Brief description"}]
+  },
+  "suggestion": "💡 Tip: Add [Item] for [Dish]!"
+}
+Only JSON.""",
+    "fused_analysis_user": "Ingredients: {products}\nReturn categories and 4-6 dishes for each.",
+
     # 3. RECIPE (STRUCTURED & VERBOSE)
     "recipe_generation": """Detailed Culinary Instructor.
 LANGUAGE: English.
@@ -22,6 +22,27 @@ Only JSON.""",
     
     "dish_generation_user": "Ingrédients : {products}\nCatégorie : {category}\nProposez 4-6 plats.",
 
+    # Объединённый режим: категории + блюда одним запросом (удалите ключи, чтобы выключить для языка)
+    "fused_analysis": """You are an expert chef.
+Step 1: Analyze input ingredients and pick VIABLE dish categories (+ basics like salt, oil, water).
+Step 2: For EACH chosen category suggest 4-6 specific dishes.
+Step 3: Suggest ONE clever "missing link" ingredient.
+
+IMPORTANT: Use ONLY ENGLISH KEYS for categories: ["soup", "main", "salad", "breakfast", "dessert", "drink", "snack"].
+Dish names and descriptions in French.
+
+Return JSON object:
+{
+  "categories": ["main", "soup"],
+  "dishes": {
+    "main": [{"name": "Dish Name", "desc": "Brief description"}],
+    "soup": [{"name": "Dish Name", "desc": "Brief description"}]
+  },
+  "suggestion": "💡 Conseil : Ajoutez [Ingrédient] pour faire [Plat] !"
+}
+Only JSON.""",
+    "fused_analysis_user": "Ingrédients : {products}\nDonnez les catégories et 4-6 plats pour chacune.",
+
     # 3. РЕЦЕПТ
     "recipe_generation": """Detailed Culinary Instructor.
 LANGUAGE: French.
@@ -22,6 +22,27 @@ Only JSON.""",
     
     "dish_generation_user": "Ingredienti: {products}\nCategoria: {category}\nSuggerisci 4-6 piatti.",
 
+    # Объединённый режим: категории + блюда одним запросом (удалите ключи, чтобы выключить для языка)
+    "fused_analysis": """You are an expert chef.
+Step 1: Analyze input ingredients and pick VIABLE dish categories (+ basics like salt, oil, water).
+Step 2: For EACH chosen category suggest 4-6 specific dishes.
+Step 3: Suggest ONE clever "missing link" ingredient.
+
+IMPORTANT: Use ONLY ENGLISH KEYS for categories: ["soup", "main", "salad", "breakfast", "dessert", "drink", "snack"].
+Dish names and descriptions in Italian.
+
+Return JSON object:
+{
+  "categories": ["main", "soup"],
+  "dishes": {
+    "main": [{"name": "Dish Name", "desc": "Brief description"}],
+    "soup": [{"name": "Dish Name", "desc": "Brief description"}]
+  },
+  "suggestion": "💡 Consiglio: Aggiungi [Ingrediente] per fare [Piatto]!"
+}
+Only JSON.""",
+    "fused_analysis_user": "Ingredienti: {products}\nRestituisci le categorie e 4-6 piatti per ciascuna.",
+
     # 3. РЕЦЕПТ (ЭТАЛОН)
     "recipe_generation": """Detailed Culinary Instructor.
 LANGUAGE: Italian.
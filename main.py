@@ -14,12 +14,23 @@ from aiohttp import web
 # Импорты локальных модулей
 # Убедитесь, что все эти файлы существуют
 from config import TELEGRAM_TOKEN, LOG_FILE, LOG_LEVEL, ADMIN_IDS, validate_config
+from config import WARMUP_INTERVAL, WARMUP_START_HOUR, WARMUP_END_HOUR, TRIAL_NOTIFY_CHUNK
 from database import db
 from database.metrics import metrics
 from database.cache import groq_cache
 from database.users import users_repo 
+from database.favorites import favorites_repo
+from database.broadcasts import broadcasts_repo
+from database.write_behind import write_behind
+from database.metrics_buffer import metrics_buffer
 from handlers import register_all_handlers
 from services.groq_service import groq_service 
+from services.prefetch import dish_prefetcher
+from services.groq_scheduler import groq_scheduler
+from services.token_budget import token_budget
+from services.cache_warmer import cache_warmer
+from services.telegram_sender import telegram_sender
+from services.broadcaster import broadcaster
 from locales.texts import get_text
 
 # Константы
@@ -118,42 +129,76 @@ async def cleanup_tasks_periodically():
             cleared_cache = await groq_cache.clear_expired()
             if cleared_cache > 0:
                 logger.info(f"🗑 Очищено {cleared_cache} просроченных записей кэша")
+            # Ограничение размера таблицы кэша (лимиты хранилища Supabase)
+            await groq_cache.enforce_size_budget()
+            # Снимок пула БД - чтобы сопоставлять всплески задержек с исчерпанием пула
+            metrics.track_event_later(0, "db_pool_stats", db.stats())
+            # Секции metrics на ближайшие периоды
+            await metrics.ensure_partitions()
             
             # Чистка метрик (только в 4 утра)
             current_hour_msk = datetime.now(MSK_TZ).hour
             if current_hour_msk == 4:
-                cleared_metrics = await metrics.cleanup_old_metrics(days_to_keep=30)
+                cleared_metrics = await metrics.cleanup_old_metrics()
                 if cleared_metrics > 0:
-                    logger.info(f"📉 Очищено {cleared_metrics} старых метрик")
+                    logger.info(f"📉 Очистка метрик: удалено {cleared_metrics} (секций или строк)")
+                # Пересчёт max_tokens по свежей статистике ответов
+                await token_budget.load()
         except asyncio.CancelledError:
             break
         except Exception as e:
             logger.error(f"❌ Ошибка в задачах очистки: {e}", exc_info=True)
             await asyncio.sleep(3600)
 
+async def warm_cache_periodically():
+    """Прогрев кэша популярных прямых рецептов: ночью - полный, днём - обновление перед истечением TTL"""
+    while True:
+        try:
+            await asyncio.sleep(WARMUP_INTERVAL)
+            off_peak = WARMUP_START_HOUR <= datetime.now(MSK_TZ).hour < WARMUP_END_HOUR
+            await cache_warmer.run_once(off_peak)
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logger.error(f"❌ Ошибка прогрева кэша: {e}", exc_info=True)
+
+async def notify_trial_users(rows: list) -> None:
+    """Рассылает уведомления о триале пачками: пачка отмечается в БД до отправки (без дублей после сбоя)."""
+    total, done = len(rows), 0
+    counts = {}
+    for i in range(0, total, TRIAL_NOTIFY_CHUNK):
+        chunk = rows[i:i + TRIAL_NOTIFY_CHUNK]
+        claimed = set(await users_repo.mark_trial_notified([r['user_id'] for r in chunk]))
+        messages = [
+            (r['user_id'], get_text(r.get('language_code') or 'en', "trial_activated_notification"))  # По дефолту EN
+            for r in chunk if r['user_id'] in claimed
+        ]
+        for result, n in (await telegram_sender.send_many(bot, messages)).items():
+            counts[result] = counts.get(result, 0) + n
+        done += len(chunk)
+        logger.info(f"🎁 Уведомления о триале: {done}/{total} ({counts})")
+
 async def check_trials_periodically():
     """Раз в час проверяет и выдает подарочный триал"""
+    recover = True  # После рестарта (или сбоя) досылаем уведомления, которые не успели уйти
     while True:
         try:
-            # logger.info("🎁 Проверка триалов...") # Можно раскомментировать для дебага
-            user_ids = await users_repo.process_trial_activations()
-            
-            for uid in user_ids:
-                try:
-                    user = await users_repo.get_user(uid)
-                    lang = user.get('language_code', 'en') # По дефолту EN
-                    # Отправляем сообщение
-                    await bot.send_message(uid, get_text(lang, "trial_activated_notification"))
-                    logger.info(f"🎁 Триал выдан: {uid}")
-                    await asyncio.sleep(0.5) # Пауза чтобы не спамить
-                except Exception as e:
-                    logger.warning(f"Не удалось отправить уведомление о триале юзеру {uid}: {e}")
+            rows = await users_repo.process_trial_activations()
+            if rows:
+                logger.info(f"🎁 Триал выдан: {len(rows)} польз.")
+            if recover:
+                seen = {r['user_id'] for r in rows}
+                rows += [r for r in await users_repo.get_unnotified_trials() if r['user_id'] not in seen]
+                recover = False
+            if rows:
+                await notify_trial_users(rows)
             
             await asyncio.sleep(3600) # Спим час
         except asyncio.CancelledError:
             break
         except Exception as e:
             logger.error(f"❌ Ошибка задачи триалов: {e}", exc_info=True)
+            recover = True
             await asyncio.sleep(3600)
 
 # --- HOOKS ---
@@ -194,12 +239,23 @@ async def lifespan():
         logger.error("❌ Критическая ошибка: Нет соединения с БД. Проверьте DATABASE_URL.")
         sys.exit(1)
 
+    await groq_cache.ensure_schema()
+    await users_repo.ensure_schema()
+    await favorites_repo.ensure_schema()
+    await broadcasts_repo.ensure_schema()
+    # Перевод metrics на секции может сканировать большую таблицу - старт бота его не ждёт
+    metrics_schema_task = asyncio.create_task(metrics.ensure_schema())
+    write_behind.start()
+    metrics_buffer.start()
+    await token_budget.load()
     logger.info("✅ Ресурсы инициализированы.")
     
     # Запуск фоновых задач
     premium_task = asyncio.create_task(check_premium_expiry_periodically()) 
     cleanup_task = asyncio.create_task(cleanup_tasks_periodically()) 
     trial_task = asyncio.create_task(check_trials_periodically())
+    warmup_task = asyncio.create_task(warm_cache_periodically())
+    await broadcaster.resume(bot)  # Рассылка, прерванная рестартом, продолжается с контрольной точки
     logger.info("✅ Фоновые задачи запущены.")
 
     try:
@@ -210,9 +266,18 @@ async def lifespan():
         premium_task.cancel()
         cleanup_task.cancel()
         trial_task.cancel()
+        warmup_task.cancel()
+        metrics_schema_task.cancel()
         
         # Закрываем соединения
+        await dish_prefetcher.close()
+        await groq_scheduler.close()
         await groq_service.close()
+        await broadcaster.close()  # Сохраняет контрольную точку рассылки
+        # Дописываем отложенные записи кэша/метрик до закрытия пула
+        write_behind.submit("cache:hits", groq_cache.flush_hits)
+        await write_behind.close()
+        await metrics_buffer.close()
         await db.close() 
         logger.info("✅ Ресурсы закрыты.")
 
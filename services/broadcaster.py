@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from aiogram import Bot
+
+from config import BROADCAST_CHECKPOINT_INTERVAL, BROADCAST_PROGRESS_INTERVAL
+from database.broadcasts import broadcasts_repo
+from services.telegram_sender import telegram_sender, SENT, BLOCKED, FAILED
+
+logger = logging.getLogger(__name__)
+
+_RATE_WINDOW = 30.0  # Скорость считаем по последним 30 сек.
+
+def pick_text(texts: Dict[str, str], lang: Optional[str]) -> Optional[str]:
+    """Текст на языке пользователя, иначе общий, иначе английский."""
+    return texts.get(lang or "") or texts.get("default") or texts.get("en")
+
+class Broadcaster:
+    """Рассылка по всем (или отфильтрованным) пользователям с продолжением после рестарта.
+
+    Получатели читаются курсором по возрастанию user_id, отправка идёт через telegram_sender.
+    Контрольная точка - наибольший user_id, до которого обработаны все получатели: после
+    рестарта повторно получат сообщение только те, что были в работе с последнего сохранения."""
+
+    def __init__(self, checkpoint_interval: float, progress_interval: float):
+        self.checkpoint_interval = checkpoint_interval
+        self.progress_interval = progress_interval
+        self._task: Optional[asyncio.Task] = None
+        self._stop = False
+        self._state: Optional[Dict[str, Any]] = None
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, bot: Bot, admin_id: int, texts: Dict[str, str], languages: Optional[List[str]],
+                    premium: Optional[bool]) -> Optional[Dict[str, Any]]:
+        """Создаёт и запускает рассылку. None, если другая ещё идёт."""
+        if self.is_running():
+            return None
+        total = await broadcasts_repo.count_recipients(languages, premium)
+        broadcast = await broadcasts_repo.create(admin_id, texts, languages, premium, total)
+        self._launch(bot, broadcast)
+        return broadcast
+
+    async def resume(self, bot: Bot) -> None:
+        """Продолжает рассылку, прерванную рестартом."""
+        if self.is_running():
+            return
+        running = await broadcasts_repo.get_running()
+        if running:
+            logger.info(f"📣 Продолжаем рассылку #{running[0]['id']} с user_id > {running[0]['last_user_id']}")
+            self._launch(bot, running[0])
+
+    def _launch(self, bot: Bot, broadcast: Dict[str, Any]) -> None:
+        self._stop = False
+        self._task = asyncio.create_task(self._run(bot, broadcast))
+
+    def stop(self) -> bool:
+        """Останавливает текущую рассылку (она будет помечена как stopped)."""
+        if not self.is_running():
+            return False
+        self._stop = True
+        return True
+
+    async def _run(self, bot: Bot, broadcast: Dict[str, Any]) -> None:
+        texts = broadcast['texts']
+        counts = {SENT: broadcast['sent'], BLOCKED: broadcast['blocked'], FAILED: broadcast['failed']}
+        state = self._state = {
+            "id": broadcast['id'], "admin_id": broadcast['created_by'], "total": broadcast['total'],
+            "counts": counts, "started": time.monotonic(), "done_at": deque(maxlen=5000),
+            "checkpoint": broadcast['last_user_id'], "status": "running",
+        }
+        dispatched: Deque[int] = deque()  # user_id в порядке выдачи
+        completed: Set[int] = set()
+        last_saved = time.monotonic()
+
+        async def save(status: str = "running") -> None:
+            try:
+                await broadcasts_repo.checkpoint(state["id"], state["checkpoint"], counts, status)
+            except Exception as e:
+                logger.error(f"Не удалось сохранить прогресс рассылки #{state['id']}: {e}")
+
+        async def messages():
+            async for user_id, lang in recipients:
+                if self._stop:
+                    return
+                dispatched.append(user_id)
+                yield user_id, pick_text(texts, lang)
+
+        async def on_result(user_id: int, result: str) -> None:
+            nonlocal last_saved
+            counts[result] += 1
+            state["done_at"].append(time.monotonic())
+            completed.add(user_id)
+            # Контрольная точка сдвигается только по непрерывному префиксу обработанных
+            while dispatched and dispatched[0] in completed:
+                completed.discard(dispatched[0])
+                state["checkpoint"] = dispatched.popleft()
+            if time.monotonic() - last_saved >= self.checkpoint_interval:
+                last_saved = time.monotonic()
+                await save()
+
+        recipients = broadcasts_repo.iter_recipients(broadcast['languages'], broadcast['premium'],
+                                                     broadcast['last_user_id'])
+        progress_msg = await self._send_progress(bot, None)
+        reporter = asyncio.create_task(self._report_progress(bot, progress_msg))
+        try:
+            await telegram_sender.send_many(bot, messages(), on_result)
+            state["status"] = "stopped" if self._stop else "done"
+            await save(state["status"])
+            logger.info(f"📣 Рассылка #{state['id']} завершена: {state['status']}, {counts}")
+        except asyncio.CancelledError:
+            # Остановка бота: сохраняем прогресс, статус running - продолжим после рестарта
+            await save()
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка рассылки #{state['id']}: {e}", exc_info=True)
+            await save()
+            state["status"] = "error"
+        finally:
+            await recipients.aclose()
+            reporter.cancel()
+            if progress_msg is not None:
+                await self._send_progress(bot, progress_msg)
+
+    def progress(self) -> Optional[Dict[str, Any]]:
+        """Прогресс текущей (или последней) рассылки: счётчики, скорость, ETA."""
+        state = self._state
+        if state is None:
+            return None
+        now = time.monotonic()
+        processed = sum(state["counts"].values())
+        window = min(_RATE_WINDOW, max(now - state["started"], 1.0))
+        rate = sum(1 for t in state["done_at"] if t >= now - window) / window
+        remaining = max(state["total"] - processed, 0)
+        return {
+            "id": state["id"], "status": state["status"], "total": state["total"], "processed": processed,
+            **state["counts"], "rate": round(rate, 1),
+            "eta_s": int(remaining / rate) if rate > 0 and state["status"] == "running" else None,
+        }
+
+    def format_progress(self) -> str:
+        p = self.progress()
+        if not p:
+            return "📣 No broadcasts yet"
+        eta = f"{p['eta_s'] // 60}m {p['eta_s'] % 60}s" if p['eta_s'] is not None else "-"
+        return (f"📣 <b>Broadcast #{p['id']}</b> ({p['status']})\n"
+                f"Progress: {p['processed']}/{p['total']}\n"
+                f"Sent: {p[SENT]} | Blocked: {p[BLOCKED]} | Failed: {p[FAILED]}\n"
+                f"Speed: {p['rate']} msg/s | ETA: {eta}")
+
+    async def _send_progress(self, bot: Bot, message: Any) -> Any:
+        """Отправляет или обновляет сообщение с прогрессом у автора рассылки."""
+        try:
+            if message is None:
+                return await bot.send_message(self._state["admin_id"], self.format_progress(), parse_mode="HTML")
+            await bot.edit_message_text(self.format_progress(), chat_id=message.chat.id,
+                                        message_id=message.message_id, parse_mode="HTML")
+        except Exception as e:
+            logger.debug(f"Broadcast progress message skipped: {e}")
+        return message
+
+    async def _report_progress(self, bot: Bot, message: Any) -> None:
+        while message is not None:
+            await asyncio.sleep(self.progress_interval)
+            await self._send_progress(bot, message)
+
+    async def close(self) -> None:
+        if self.is_running():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+broadcaster = Broadcaster(BROADCAST_CHECKPOINT_INTERVAL, BROADCAST_PROGRESS_INTERVAL)
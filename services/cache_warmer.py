@@ -0,0 +1,59 @@
+import logging
+import time
+from typing import Any, Dict, List
+
+from config import (
+    WARMUP_ENABLED, WARMUP_TOP_N, WARMUP_HISTORY_DAYS, WARMUP_REFRESH_MARGIN,
+    WARMUP_MAX_PER_RUN, WARMUP_MAX_LOAD
+)
+from database.metrics import metrics
+from services.groq_service import groq_service
+
+logger = logging.getLogger(__name__)
+
+_RELOAD_INTERVAL = 24 * 3600  # Список популярных блюд пересчитываем раз в сутки
+
+class CacheWarmer:
+    """Держит в groq_cache готовые рецепты самых частых прямых запросов."""
+
+    def __init__(self):
+        self.targets: List[Dict[str, Any]] = []
+        self._loaded_at = 0.0
+        self.stats = {"runs": 0, "generated": 0, "failed": 0, "skipped_load": 0}
+
+    async def _load_targets(self) -> None:
+        self.targets = await metrics.get_top_direct_recipes(WARMUP_TOP_N, WARMUP_HISTORY_DAYS)
+        self._loaded_at = time.monotonic()
+        logger.info(f"🔥 Прогрев: {len(self.targets)} популярных рецептов")
+
+    async def run_once(self, off_peak: bool) -> int:
+        """Один проход прогрева. В непиковые часы генерирует недостающие рецепты,
+        в остальное время только обновляет уже прогретые записи перед истечением."""
+        if not WARMUP_ENABLED:
+            return 0
+        self.stats["runs"] += 1
+        if not self.targets or time.monotonic() - self._loaded_at > _RELOAD_INTERVAL:
+            await self._load_targets()
+
+        generated = 0
+        for target in self.targets:
+            if generated >= WARMUP_MAX_PER_RUN:
+                break
+            # Живые запросы важнее: при нагрузке откладываем прогрев до следующего прохода
+            if groq_service.current_load() > WARMUP_MAX_LOAD:
+                self.stats["skipped_load"] += 1
+                break
+            try:
+                if await groq_service.warm_recipe(target["dish"], target["lang"], target["premium"],
+                                                  WARMUP_REFRESH_MARGIN, only_existing=not off_peak):
+                    generated += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.warning(f"Warmup failed ({target['dish']}, {target['lang']}): {e}")
+
+        self.stats["generated"] += generated
+        if generated:
+            logger.info(f"🔥 Прогрето рецептов: {generated}")
+        return generated
+
+cache_warmer = CacheWarmer()
@@ -0,0 +1,149 @@
+import re
+import sys
+from typing import Dict, List, Set
+
+from locales.ingredients import INGREDIENTS
+
+# Разделители элементов списка продуктов (включая союзы "и" на поддерживаемых языках)
+_SPLIT_RE = re.compile(r"[,;\n\r/+&•]|\s(?:and|und|et|e|y|и)\s", re.IGNORECASE)
+_SPACES_RE = re.compile(r"\s+")
+_EDGE_JUNK = " .!?:-*\"'«»()[]"
+
+# Синонимы -> каноническое имя (после приведения к единственному числу)
+SYNONYMS: Dict[str, Dict[str, str]] = {
+    "en": {
+        "scallion": "green onion", "spring onion": "green onion",
+        "aubergine": "eggplant", "courgette": "zucchini",
+        "coriander": "cilantro", "garbanzo": "chickpea", "garbanzo bean": "chickpea",
+        "capsicum": "bell pepper", "mince": "ground meat", "minced meat": "ground meat",
+        "prawn": "shrimp", "rocket": "arugula", "beetroot": "beet",
+    },
+    "de": {
+        "erdapfel": "kartoffel", "paradeiser": "tomate", "möhre": "karotte", "rüebli": "karotte",
+        "hackfleisch": "hack", "faschierte": "hack", "lauchzwiebel": "frühlingszwiebel",
+    },
+    "fr": {
+        "pomme de terre": "patate", "pommes de terre": "patate", "crevette rose": "crevette", "viande hachée": "haché",
+    },
+    "it": {
+        "macinato": "carne macinata", "gamberetto": "gambero",
+    },
+    "es": {
+        "papa": "patata", "jitomate": "tomate", "frijol": "judía", "alubia": "judía",
+        "carne picada": "carne molida", "gamba": "camarón",
+    },
+}
+
+# Неправильные формы множественного числа
+IRREGULAR_PLURALS: Dict[str, Dict[str, str]] = {
+    "en": {"leaves": "leaf", "loaves": "loaf", "halves": "half", "knives": "knife",
+           "potatoes": "potato", "tomatoes": "tomato", "mice": "mouse"},
+    "de": {"eier": "ei", "äpfel": "apfel", "nüsse": "nuss", "würste": "wurst"},
+    "fr": {"oeufs": "oeuf", "œufs": "œuf", "choux": "chou", "poireaux": "poireau"},
+    "it": {"uova": "uovo", "pomodori": "pomodoro", "funghi": "fungo", "fagioli": "fagiolo",
+           "peperoni": "peperone", "limoni": "limone", "spinaci": "spinaci"},
+    "es": {"huevos": "huevo", "limones": "limón", "champiñones": "champiñón", "jamones": "jamón"},
+}
+
+# Слова, которые выглядят как множественное число, но им не являются
+_EN_KEEP = ("ss", "us", "is", "ous")
+INVARIANT_WORDS: Dict[str, Set[str]] = {
+    "en": {"molasses", "hummus", "citrus", "swiss", "grits"},
+    "de": {"ananas", "kürbis", "reis", "mais", "lachs"},
+    "fr": {"radis", "ananas", "anis", "cassis", "maïs", "pois", "noix", "jus", "pâtes", "couscous"},
+    "it": {"ananas", "mais"},
+    "es": {"ananás", "res", "brócolis"},
+}
+_MIN_STEM = 3
+
+def _build_lexicon(lang: str) -> Set[str]:
+    """Известные формы единственного числа: последние слова словаря продуктов и синонимов."""
+    items = [*INGREDIENTS.get(lang, []), *SYNONYMS.get(lang, {}), *SYNONYMS.get(lang, {}).values(),
+             *IRREGULAR_PLURALS.get(lang, {}).values()]
+    return {item.lower().split(" ")[-1] for item in items}
+
+_LEXICON: Dict[str, Set[str]] = {lang: _build_lexicon(lang) for lang in INGREDIENTS}
+
+def _plural_candidates(word: str, lang: str) -> List[str]:
+    """Возможные формы единственного числа по окончанию."""
+    if lang == "en":
+        if word.endswith("ies"): return [word[:-3] + "y"]
+        if word.endswith(("ches", "shes", "xes", "oes")): return [word[:-2], word[:-1]]
+        if word.endswith("s") and not word.endswith(_EN_KEEP): return [word[:-1]]
+    elif lang == "de":
+        # Tomaten -> Tomate, Kartoffeln -> Kartoffel, Zwiebeln -> Zwiebel
+        if len(word) > 5 and word.endswith(("en", "ln", "rn")): return [word[:-1]]
+    elif lang == "fr":
+        if word.endswith(("s", "x")): return [word[:-1]]
+    elif lang == "es":
+        if word.endswith("ones"): return [word[:-2]]
+        if word.endswith("s"): return [word[:-1]]
+    return []
+
+def _singular_word(word: str, lang: str) -> str:
+    irregular = IRREGULAR_PLURALS.get(lang, {})
+    if word in irregular:
+        return irregular[word]
+    lexicon = _LEXICON.get(lang, set())
+    if len(word) <= 3 or word in lexicon or word in INVARIANT_WORDS.get(lang, ()):
+        return word
+    # Окончание отрезаем, только если получилось знакомое слово: radis, ananas, molasses не портим
+    for singular in _plural_candidates(word, lang):
+        if len(singular) >= _MIN_STEM and singular in lexicon:
+            return singular
+    return word
+
+def normalize_item(item: str, lang: str) -> str:
+    """Приводит один продукт к канонической форме."""
+    item = _SPACES_RE.sub(" ", item.lower()).strip(_EDGE_JUNK)
+    if not item:
+        return ""
+    synonyms = SYNONYMS.get(lang, {})
+    if item in synonyms:
+        return synonyms[item]
+    # Множественное число определяем по последнему слову ("green beans" -> "green bean")
+    words = item.split(" ")
+    words[-1] = _singular_word(words[-1], lang)
+    item = " ".join(words)
+    return synonyms.get(item, item)
+
+def canonical_items(products: str, lang: str) -> List[str]:
+    """Список продуктов: нижний регистр, без дублей, отсортирован."""
+    items = {normalize_item(part, lang) for part in _SPLIT_RE.split(products or "")}
+    items.discard("")
+    return sorted(items)
+
+def canonicalize_products(products: str, lang: str) -> str:
+    """Каноническая строка продуктов для ключа кэша ("eggs, tomato" == "Tomato,  eggs")."""
+    return ", ".join(canonical_items(products, lang))
+
+def hit_ratio_report(lines: List[str], lang: str = "en") -> Dict[str, float]:
+    """Сравнивает долю повторов (потенциальных попаданий в кэш) для точных и канонических ключей."""
+    exact_seen, canon_seen = set(), set()
+    exact_hits = canon_hits = 0
+    for line in lines:
+        if "\t" in line:
+            line_lang, text = line.split("\t", 1)
+        else:
+            line_lang, text = lang, line
+        text = text.strip()
+        if not text:
+            continue
+        exact_key = (line_lang, text)
+        canon_key = (line_lang, canonicalize_products(text, line_lang))
+        exact_hits += exact_key in exact_seen
+        canon_hits += canon_key in canon_seen
+        exact_seen.add(exact_key)
+        canon_seen.add(canon_key)
+
+    total = exact_hits + len(exact_seen)
+    return {
+        "requests": total,
+        "exact_hit_ratio": round(exact_hits / total, 3) if total else 0.0,
+        "canonical_hit_ratio": round(canon_hits / total, 3) if total else 0.0,
+    }
+
+if __name__ == "__main__":
+    # python -m services.canonical corpus.txt  (строки: "текст" или "lang<TAB>текст")
+    with open(sys.argv[1], encoding="utf-8") as f:
+        print(hit_ratio_report(f.readlines()))
@@ -0,0 +1,283 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from config import GROQ_RPM, GROQ_TPM, GROQ_MODEL_LIMITS, GROQ_MAX_CONCURRENCY, GROQ_MAX_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты (меньше = раньше)
+PRIORITY_PREMIUM = 0
+PRIORITY_FREE = 1
+PRIORITY_BACKGROUND_PREMIUM = 2
+PRIORITY_BACKGROUND_FREE = 3
+
+def get_priority(is_premium: bool, background: bool = False) -> int:
+    """Премиум раньше бесплатных, интерактивные запросы раньше фоновых (prefetch, прогрев)."""
+    if background:
+        return PRIORITY_BACKGROUND_PREMIUM if is_premium else PRIORITY_BACKGROUND_FREE
+    return PRIORITY_PREMIUM if is_premium else PRIORITY_FREE
+
+class TokenBucket:
+    """Классический token bucket: capacity единиц, пополняется равномерно за минуту."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Сколько секунд ждать, пока в ведре наберётся amount единиц."""
+        self._refill()
+        amount = min(amount, self.capacity)  # Запрос больше ведра ждёт полного ведра
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        """Списывает amount (отрицательное - возврат). Расход сверх резерва остаётся долгом
+        (уровень до -capacity): следующие запросы ждут, пока ведро его отработает."""
+        self._refill()
+        self.tokens = min(self.capacity, max(-self.capacity, self.tokens - amount))
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """Достаёт Retry-After (сек) из ответа 429, если он есть."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def is_rate_limited(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+class ModelLimits:
+    """Лимиты одной модели Groq: ведра RPM и TPM и пауза после 429."""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+
+    def wait_time(self, est_tokens: int) -> float:
+        return max(self.paused_until - time.monotonic(), self.requests.wait_time(1), self.tokens.wait_time(est_tokens))
+
+    def reserve(self, est_tokens: int) -> None:
+        self.requests.consume(1)
+        self.tokens.consume(est_tokens)
+
+class GroqScheduler:
+    """Очередь запросов к Groq с приоритетами, лимитами RPM/TPM по моделям и обработкой 429."""
+
+    def __init__(self, limits: Dict[str, Dict[str, int]], rpm: int, tpm: int, max_concurrency: int, max_retries: int):
+        self.limits = limits
+        self.default_rpm = rpm
+        self.default_tpm = tpm
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._models: Dict[str, ModelLimits] = {}
+
+        # (priority, seq, est_tokens, model, future, key)
+        self._queue: List[Tuple[int, int, int, str, asyncio.Future, Optional[str]]] = []
+        self._promoted: Dict[str, int] = {}  # key -> повышенный приоритет (для повторов после 429)
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._closing = False
+
+        self._waits: Deque[float] = deque(maxlen=500)
+        self.stats_counters = {"completed": 0, "failed": 0, "rate_limited": 0, "retries": 0, "promoted": 0}
+
+    def model_limits(self, model: str) -> ModelLimits:
+        if model not in self._models:
+            limits = self.limits.get(model, {})
+            self._models[model] = ModelLimits(limits.get("rpm", self.default_rpm), limits.get("tpm", self.default_tpm))
+        return self._models[model]
+
+    def _ensure_dispatcher(self) -> None:
+        if self._dispatcher is None or self._dispatcher.done():
+            self._closing = False
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    def _next_ready(self) -> Tuple[Optional[Tuple], Optional[float]]:
+        """Первый по приоритету запрос, чья модель может его принять, иначе - через сколько
+        секунд освободится хоть одна модель. Исчерпанный лимит одной модели не держит очередь
+        к другой; внутри модели порядок приоритетов сохраняется."""
+        delay = None
+        blocked = set()
+        for item in sorted(self._queue):
+            model, future = item[3], item[4]
+            if future.done() or model in blocked:
+                continue
+            wait = self.model_limits(model).wait_time(item[2])
+            if wait <= 0:
+                return item, None
+            blocked.add(model)
+            delay = wait if delay is None else min(delay, wait)
+        return None, delay
+
+    async def _dispatch_loop(self) -> None:
+        """Выдаёт слоты ожидающим запросам в порядке приоритета, соблюдая лимиты."""
+        # Флаг, а не только cancel(): wait_for может проглотить отмену, если событие пришло одновременно
+        while not self._closing:
+            self._wakeup.clear()
+            delay = None
+
+            # Отменённые ожидающие
+            if any(item[4].done() for item in self._queue):
+                self._queue = [item for item in self._queue if not item[4].done()]
+                heapq.heapify(self._queue)
+
+            while self._queue and self._in_flight < self.max_concurrency:
+                item, delay = self._next_ready()
+                if item is None:
+                    break
+                self._queue.remove(item)
+                heapq.heapify(self._queue)
+                _, _, est_tokens, model, future, _ = item
+                # Резерв списывается до отправки: ведро не уходит в минус
+                self.model_limits(model).reserve(est_tokens)
+                self._in_flight += 1
+                future.set_result(None)
+
+            try:
+                if delay and delay > 0:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                else:
+                    await self._wakeup.wait()
+            except asyncio.TimeoutError:
+                pass
+
+    async def _acquire(self, priority: int, est_tokens: int, model: str, key: Optional[str]) -> None:
+        self._ensure_dispatcher()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), est_tokens, model, future, key))
+        self._wakeup.set()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Слот уже выдан, а ожидающий отменён - возвращаем слот
+            if future.done() and not future.cancelled():
+                self._release(est_tokens, None, model)
+            raise
+
+    def _release(self, est_tokens: int, used_tokens: Optional[int], model: str) -> None:
+        self._in_flight -= 1
+        if used_tokens is not None:
+            # Сверяем резерв с фактическим расходом (возврат или доплата)
+            self.model_limits(model).tokens.consume(used_tokens - est_tokens)
+        self._wakeup.set()
+
+    def promote(self, key: str, priority: int) -> bool:
+        """Поднимает приоритет запроса key: к фоновому запросу (prefetch) присоединился
+        интерактивный. Действует и на ожидающий слот, и на повторы после 429."""
+        if key not in self._promoted or priority >= self._promoted[key]:
+            return False
+        self._promoted[key] = priority
+        promoted = False
+        for i, item in enumerate(self._queue):
+            if item[5] == key and item[0] > priority and not item[4].done():
+                self._queue[i] = (priority, *item[1:])
+                promoted = True
+        if promoted:
+            heapq.heapify(self._queue)
+            self.stats_counters["promoted"] += 1
+            if self._wakeup is not None:
+                self._wakeup.set()
+        return promoted
+
+    async def run(self, fn: Callable[[], Awaitable[Any]], priority: int = PRIORITY_FREE,
+                  est_tokens: int = 1000, usage_of: Optional[Callable[[Any], Optional[int]]] = None,
+                  model: str = "", key: Optional[str] = None) -> Any:
+        """Выполняет fn() в порядке очереди в пределах лимитов model; на 429 ждёт Retry-After с джиттером и повторяет.
+        key - идентификатор запроса для promote()."""
+        if key is not None:
+            self._promoted[key] = min(priority, self._promoted.get(key, priority))
+        try:
+            return await self._run(fn, priority, est_tokens, usage_of, model, key)
+        finally:
+            if key is not None:
+                self._promoted.pop(key, None)
+
+    async def _run(self, fn: Callable[[], Awaitable[Any]], priority: int, est_tokens: int,
+                   usage_of: Optional[Callable[[Any], Optional[int]]], model: str, key: Optional[str]) -> Any:
+        attempt = 0
+        while True:
+            if key is not None:
+                priority = min(priority, self._promoted.get(key, priority))
+            queued_at = time.monotonic()
+            await self._acquire(priority, est_tokens, model, key)
+            self._waits.append(time.monotonic() - queued_at)
+
+            used_tokens = None
+            try:
+                result = await fn()
+                used_tokens = usage_of(result) if usage_of else None
+                self.stats_counters["completed"] += 1
+                return result
+            except Exception as e:
+                if not is_rate_limited(e) or attempt >= self.max_retries:
+                    self.stats_counters["failed"] += 1
+                    raise
+
+                self.stats_counters["rate_limited"] += 1
+                self.stats_counters["retries"] += 1
+                retry_after = get_retry_after(e)
+                base = retry_after if retry_after is not None else 2 ** attempt
+                delay = base + random.uniform(0, base * 0.5)
+                # Лимит исчерпан у этой модели: притормаживаем только её запросы
+                limits = self.model_limits(model)
+                limits.paused_until = max(limits.paused_until, time.monotonic() + delay)
+                logger.warning(f"Groq 429 ({model}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                attempt += 1
+            finally:
+                self._release(est_tokens, used_tokens, model)
+
+    def queue_depth(self) -> int:
+        return sum(1 for item in self._queue if not item[4].done())
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди, занятые слоты, время ожидания (сек) и остаток лимитов по моделям."""
+        waits = sorted(self._waits)
+        p95 = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        models = {}
+        for model, limits in self._models.items():
+            limits.requests.wait_time(0)  # Пополнение ведер перед снимком
+            limits.tokens.wait_time(0)
+            models[model] = {"rpm_left": int(limits.requests.tokens), "tpm_left": int(limits.tokens.tokens)}
+        return {
+            "queue_depth": self.queue_depth(),
+            "in_flight": self._in_flight,
+            "wait_avg": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "wait_p95": round(p95, 3),
+            "models": models,
+            **self.stats_counters,
+        }
+
+    async def close(self) -> None:
+        if self._dispatcher:
+            self._closing = True
+            self._wakeup.set()
+            self._dispatcher.cancel()
+            try: await self._dispatcher
+            except asyncio.CancelledError: pass
+        for item in self._queue:
+            if not item[4].done(): item[4].cancel()
+        self._queue.clear()
+
+groq_scheduler = GroqScheduler(GROQ_MODEL_LIMITS, GROQ_RPM, GROQ_TPM, GROQ_MAX_CONCURRENCY, GROQ_MAX_RETRIES)
@@ -1,12 +1,24 @@
 import logging
 import json
+import asyncio
 import hashlib
-from typing import Dict, List, Optional
+import time
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
 from groq import AsyncGroq 
-from config import GROQ_API_KEY, GROQ_MODEL, GROQ_MAX_TOKENS
+from config import GROQ_API_KEY, GROQ_ROUTES, FUSED_PIPELINE_ENABLED, FUSED_PIPELINE_LANGS
+from config import SIMILARITY_CACHE_ENABLED, SIMILARITY_CACHE_TYPES
+from config import BREAKER_FAILURE_RATE, BREAKER_MIN_CALLS, BREAKER_WINDOW, BREAKER_SLOW_CALL_SEC, BREAKER_OPEN_SECONDS
+from config import HEDGE_ENABLED, HEDGE_ROUTES, HEDGE_MIN_DELAY
 from database.cache import groq_cache
 from database.metrics import metrics
-from locales.prompts import get_prompt 
+from locales.prompts import get_prompt, has_prompt, PROMPTS_VERSION
+from services.canonical import canonical_items
+from services.similarity_cache import similarity_cache
+from services.single_flight import SingleFlight, ChunkBroadcast
+from services.groq_scheduler import groq_scheduler, get_priority, is_rate_limited, PRIORITY_FREE
+from services.resilience import CircuitBreaker, CircuitOpenError, LatencyWindow, hedged
+from services.token_budget import token_budget
+from services.input_filter import input_filter
 
 logger = logging.getLogger(__name__)
 
@@ -16,48 +28,278 @@ class GroqService:
             logger.warning("Groq API Key missing.")
             self.client = None
         else:
-            self.client = AsyncGroq(api_key=GROQ_API_KEY)
+            # Повторы при 429 делает groq_scheduler (с учётом Retry-After)
+            self.client = AsyncGroq(api_key=GROQ_API_KEY, max_retries=0)
+        self._flight = SingleFlight()
+        self._streams: Dict[str, ChunkBroadcast] = {}  # Идущие стримы рецептов по ключу single-flight
+        self._stream_tasks: Set[asyncio.Task] = set()
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._latency: Dict[str, LatencyWindow] = {}
+        self.retried_calls = 0  # Успешные вызовы, которым понадобились повторы после 429
             
     async def close(self):
+        for task in list(self._stream_tasks):
+            task.cancel()
+        if self._stream_tasks:
+            await asyncio.gather(*self._stream_tasks, return_exceptions=True)
         if self.client and hasattr(self.client, 'close'):
             await self.client.close()
 
+    def current_load(self) -> int:
+        """Количество уникальных запросов к Groq, выполняющихся или ждущих в очереди."""
+        return len(self._flight) + groq_scheduler.queue_depth()
+
+    def _breaker(self, model: str) -> CircuitBreaker:
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker(
+                model, BREAKER_FAILURE_RATE, BREAKER_MIN_CALLS, BREAKER_WINDOW, BREAKER_SLOW_CALL_SEC, BREAKER_OPEN_SECONDS
+            )
+        return self.breakers[model]
+
+    async def _call_model(self, model: str, route: Dict, route_name: str, request, priority: int, est_tokens: int,
+                          usage_of=None, hedge: bool = False, key: Optional[str] = None):
+        """Вызов модели через очередь с предохранителем и (опционально) хеджированием."""
+        breaker = self._breaker(model)
+        if not breaker.allow():
+            raise CircuitOpenError(model)
+
+        window = self._latency.setdefault(f"{route_name}:{model}", LatencyWindow())
+
+        async def call():
+            # Время только самого HTTP-вызова: ожидание в очереди и паузы после 429 - наш лимит, а не медленная модель
+            timing = {"attempts": 0, "latency": 0.0}
+            async def timed():
+                timing["attempts"] += 1
+                started = time.monotonic()
+                result = await request()
+                timing["latency"] = time.monotonic() - started
+                return result
+            result = await groq_scheduler.run(timed, priority=priority, est_tokens=est_tokens, usage_of=usage_of,
+                                              model=model, key=key)
+            return result, timing
+
+        try:
+            # Под нагрузкой не хеджируем: вторая попытка только усилит очередь
+            if hedge and groq_scheduler.queue_depth() == 0:
+                delay = max(HEDGE_MIN_DELAY, window.percentile(0.95, default=route["timeout"] / 2))
+                result, timing = await hedged(call, delay, on_hedge=lambda: logger.info(f"Hedged request: {route_name} ({model})"))
+            else:
+                result, timing = await call()
+        except asyncio.CancelledError:
+            breaker.release_probe()
+            raise
+        except Exception as e:
+            if is_rate_limited(e): breaker.release_probe()  # 429 - это наш лимит, а не сбой модели
+            else: breaker.record(False)
+            raise
+
+        breaker.record(True, timing["latency"])
+        if timing["attempts"] > 1:
+            # Ответ после повторов на 429 учитываем отдельно: в окно задержки хеджирования он не идёт
+            self.retried_calls += 1
+        else:
+            window.add(timing["latency"])
+        return result
+
+    async def _degraded_response(self, cache_key: str, lang: str, cache_type: str, models: List[str],
+                                 similar: Optional[Tuple[str, List[str]]], user_id: int, reason: str) -> Optional[str]:
+        """При сбое Groq: просроченный ответ из groq_cache или ответ для похожего набора продуктов."""
+        source, response = "none", None
+        try:
+            for model in models:
+                response = await groq_cache.get_stale(prompt=cache_key, lang=lang, model=model, cache_type=cache_type)
+                if response:
+                    source = "stale"
+                    break
+        except Exception as e:
+            logger.error(f"Stale cache read error: {e}")
+        if not response and similar:
+            match = similarity_cache.lookup(*similar)
+            if match:
+                source, response = "similar", match[0]
+        metrics.track_event_later(user_id, "groq_degraded", {"key": cache_key, "source": source, "reason": reason})
+        return response
+
+    @staticmethod
+    def _route(name: str) -> Dict:
+        return GROQ_ROUTES.get(name) or GROQ_ROUTES["default"]
+
+    @staticmethod
+    def _route_models(route: Dict) -> List[str]:
+        """Основная модель маршрута и (если задана) запасная."""
+        models = [route["model"]]
+        if route.get("fallback") and route["fallback"] != route["model"]:
+            models.append(route["fallback"])
+        return models
+
+    @staticmethod
+    def _estimate_tokens(lang: str, system_prompt: str, user_prompt: str, max_tokens: int) -> int:
+        """Оценка токенов запроса для лимита TPM (промпт по языку + резерв на ответ)."""
+        return token_budget.estimate_prompt_tokens(lang, system_prompt, user_prompt) + max_tokens
+
+    @staticmethod
+    def _finish_reason(choice) -> Optional[str]:
+        return getattr(choice, "finish_reason", None)
+
+    def _report_truncated(self, user_id: int, route_name: str, model: str, limit: int, stream: bool) -> None:
+        """Ответ упёрся в max_tokens - логируем и пишем метрику groq_truncated."""
+        logger.warning(f"Groq response truncated ({route_name}, {model}, max_tokens={limit})")
+        metrics.track_event_later(user_id, "groq_truncated", {
+            "route": route_name, "model": model, "max_tokens": limit, "stream": stream
+        })
+
+    @staticmethod
+    def _cache_key(system_prompt: str, user_prompt: str, lang: str, route_name: str, key_source: Optional[str] = None) -> str:
+        """Ключ запроса: по канонической форме входа (если есть) или по полному тексту промптов.
+        Модель, которая реально ответила, добавляется к ключу в groq_cache."""
+        if key_source is None:
+            key_source = f"{system_prompt}_{user_prompt}"
+        return groq_cache._generate_hash(key_source, lang, route_name)
+
+    @staticmethod
+    def _canonical_input(prompt_key: str, lang: str, products: str, *extra: str) -> Tuple[str, Tuple[str, List[str]]]:
+        """Источник ключа (версия + отпечаток шаблона промпта + канонический список продуктов)
+        и область/набор продуктов для приблизительного кэша."""
+        template = get_prompt(lang, prompt_key) + get_prompt(lang, f"{prompt_key}_user")
+        fingerprint = hashlib.sha256(template.encode('utf-8')).hexdigest()[:12]
+        scope = "|".join([f"v{PROMPTS_VERSION}", lang, prompt_key, fingerprint, *extra])
+        items = canonical_items(products, lang)
+        return f"{scope}|{', '.join(items)}", (scope, items)
+
+    async def _get_cached(self, cache_key: str, lang: str, cache_type: str, models: List[str]) -> Optional[str]:
+        """Ищет ответ основной модели (L1 + БД), ответ запасной - только в L1."""
+        for i, model in enumerate(models):
+            cached = await groq_cache.get(prompt=cache_key, lang=lang, model=model, cache_type=cache_type, local_only=i > 0)
+            if cached:
+                return cached
+        return None
+
     async def _send_request(self, system_prompt: str, user_prompt: str, 
-                            temperature: float = 0.5, cache_type: str = "general", lang: str = "en", user_id: int = 0) -> str:
+                            temperature: float = 0.5, cache_type: str = "general", lang: str = "en", user_id: int = 0,
+                            priority: int = PRIORITY_FREE, key_source: Optional[str] = None,
+                            similar: Optional[Tuple[str, List[str]]] = None, route_name: Optional[str] = None) -> str:
         if not self.client: return "API Error"
         
         try:
-            cache_key = groq_cache._generate_hash(f"{system_prompt[:300]}_{user_prompt[:300]}", lang, GROQ_MODEL)
-            cached = await groq_cache.get(prompt=cache_key, lang=lang, model=GROQ_MODEL, cache_type=cache_type)
+            route_name = route_name or cache_type
+            cache_key = self._cache_key(system_prompt, user_prompt, lang, route_name, key_source)
+            models = self._route_models(self._route(route_name))
+            cached = await self._get_cached(cache_key, lang, cache_type, models)
+            use_similar = similar is not None and SIMILARITY_CACHE_ENABLED and cache_type in SIMILARITY_CACHE_TYPES
             if cached:
-                await metrics.track_event(user_id, "groq_cache_hit", {"key": cache_key})
+                if use_similar:
+                    similarity_cache.add(*similar, cached, groq_cache._get_ttl(cache_type))
+                metrics.track_event_later(user_id, "groq_cache_hit", {"key": cache_key})
                 return cached
 
-            is_json = cache_type in ["analysis", "validation", "intent", "dish_list"]
-            if is_json and "json" not in system_prompt.lower():
-                system_prompt += " Respond in JSON."
+            # Почти такой же набор продуктов уже разбирали - отдаём тот ответ (с пометкой в метриках)
+            if use_similar:
+                match = similarity_cache.lookup(*similar)
+                if match:
+                    response, similarity = match
+                    metrics.track_event_later(user_id, "groq_similar_hit", {
+                        "key": cache_key, "cache_type": cache_type, "similarity": round(similarity, 3)
+                    })
+                    return response
 
-            completion = await self.client.chat.completions.create(
-                messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
-                model=GROQ_MODEL, temperature=temperature, max_tokens=GROQ_MAX_TOKENS,
-                response_format={"type": "json_object"} if is_json else None,
-                timeout=60.0
-            )
-            text = completion.choices[0].message.content
-            await groq_cache.set(prompt=cache_key, response=text, lang=lang, model=GROQ_MODEL, tokens_used=completion.usage.total_tokens, cache_type=cache_type)
-            await metrics.track_event(user_id, "groq_request", {"key": cache_key}) 
-            return text
+            # Одинаковые одновременные запросы ждут один общий вызов Groq
+            flight_key = f"{cache_type}:{cache_key}"
+            if self._flight.is_inflight(flight_key):
+                # Интерактивный запрос присоединился к фоновому (prefetch) - тот не должен ждать в хвосте очереди
+                promoted = groq_scheduler.promote(flight_key, priority)
+                metrics.track_event_later(user_id, "groq_request_coalesced", {"key": cache_key, "promoted": promoted})
+            try:
+                return await self._flight.do(
+                    flight_key,
+                    lambda: self._complete(system_prompt, user_prompt, temperature, cache_type, lang, user_id, cache_key, priority,
+                                           similar if use_similar else None, route_name)
+                )
+            except Exception as e:
+                logger.error(f"Groq API Error: {e}", exc_info=not isinstance(e, CircuitOpenError))
+                degraded = await self._degraded_response(cache_key, lang, cache_type, models, similar, user_id, type(e).__name__)
+                return degraded or "Server Error"
         except Exception as e:
             logger.error(f"Groq API Error: {e}", exc_info=True)
             return "Server Error"
 
+    async def _complete(self, system_prompt: str, user_prompt: str, temperature: float,
+                        cache_type: str, lang: str, user_id: int, cache_key: str, priority: int,
+                        similar: Optional[Tuple[str, List[str]]] = None, route_name: Optional[str] = None) -> str:
+        """Реальный вызов Groq + запись в кэш (выполняется один раз на ключ)."""
+        is_json = cache_type in ["analysis", "validation", "intent", "dish_list"]
+        if is_json and "json" not in system_prompt.lower():
+            system_prompt += " Respond in JSON."
+
+        route_name = route_name or cache_type
+        route = self._route(route_name)
+        max_tokens = token_budget.max_tokens(route_name, route)
+        cap = route.get("max_tokens_cap", route["max_tokens"])
+        prompt_chars = len(system_prompt) + len(user_prompt)
+
+        def request(model: str, limit: int):
+            return self._call_model(
+                model, route, route_name,
+                lambda: self.client.chat.completions.create(
+                    messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
+                    model=model, temperature=temperature, max_tokens=limit,
+                    response_format={"type": "json_object"} if is_json else None,
+                    timeout=route["timeout"]
+                ),
+                priority=priority,
+                est_tokens=self._estimate_tokens(lang, system_prompt, user_prompt, limit),
+                usage_of=lambda c: c.usage.total_tokens if c.usage else None,
+                hedge=HEDGE_ENABLED and is_json and route_name in HEDGE_ROUTES,
+                key=f"{cache_type}:{cache_key}"
+            )
+
+        last_error: Optional[Exception] = None
+        for model in self._route_models(route):
+            started = time.monotonic()
+            limit = max_tokens
+            try:
+                completion = await request(model, limit)
+                truncated = self._finish_reason(completion.choices[0]) == "length"
+                if truncated:
+                    self._report_truncated(user_id, route_name, model, limit, stream=False)
+                    token_budget.record(route_name, lang, prompt_chars, completion.usage, limit, truncated=True)
+                    # Обрезанный ответ (особенно JSON) бесполезен - один повтор с потолком маршрута
+                    if limit < cap:
+                        limit = cap
+                        completion = await request(model, limit)
+                        truncated = self._finish_reason(completion.choices[0]) == "length"
+                        if truncated: self._report_truncated(user_id, route_name, model, limit, stream=False)
+            except Exception as e:
+                last_error = e
+                logger.warning(f"Groq model {model} failed ({route_name}): {e}")
+                continue
+
+            text = completion.choices[0].message.content
+            usage = completion.usage
+            if not truncated:
+                token_budget.record(route_name, lang, prompt_chars, usage, limit)
+                groq_cache.set_later(prompt=cache_key, response=text, lang=lang, model=model, tokens_used=usage.total_tokens if usage else 0, cache_type=cache_type)
+                if similar:
+                    similarity_cache.add(*similar, text, groq_cache._get_ttl(cache_type))
+            metrics.track_event_later(user_id, "groq_request", {
+                "key": cache_key, "route": route_name, "model": model,
+                "fallback": model != route["model"],
+                "latency_ms": int((time.monotonic() - started) * 1000),
+                "max_tokens": limit, "truncated": truncated,
+                "prompt_tokens": usage.prompt_tokens if usage else None,
+                "completion_tokens": usage.completion_tokens if usage else None,
+            })
+            return text
+
+        raise last_error
+
     # 1. АНАЛИЗ (ТУТ БЫЛИ ПРОБЛЕМЫ)
-    async def analyze_products(self, products: str, lang: str = "en", user_id: int = 0) -> Optional[Dict]:
+    async def analyze_products(self, products: str, lang: str = "en", user_id: int = 0, is_premium: bool = False) -> Optional[Dict]:
         system = get_prompt(lang, "category_analysis")
         user = get_prompt(lang, "category_analysis_user").format(products=products)
         
         # Temp 0.1 -> Максимальная строгость, минимум фантазий о рецептах
-        response = await self._send_request(system, user, 0.1, "analysis", lang, user_id)
+        key_source, similar = self._canonical_input("category_analysis", lang, products)
+        response = await self._send_request(system, user, 0.1, "analysis", lang, user_id, get_priority(is_premium), key_source, similar)
         
         logger.info(f"Analysis Raw: {response[:200]}...") 
         
@@ -87,13 +329,52 @@ class GroqService:
             
             if result["categories"]:
                 return result
+            # Модель явно ответила пустым списком категорий - запоминаем (ненадолго); прочие ответы не кэшируем
+            if isinstance(data, dict) and data.get("categories") == []:
+                input_filter.remember_bad(products, lang)
                 
         except Exception as e:
             logger.error(f"Analysis Parse Error: {e}", exc_info=True)
         return None
 
+    # 1b. АНАЛИЗ + СПИСКИ БЛЮД ОДНИМ ЗАПРОСОМ
+    def is_fused_enabled(self, lang: str) -> bool:
+        """Объединённый режим: общий флаг, язык в FUSED_PIPELINE_LANGS и промпт fused_analysis."""
+        return FUSED_PIPELINE_ENABLED and lang in FUSED_PIPELINE_LANGS and has_prompt(lang, "fused_analysis")
+
+    async def analyze_with_dishes(self, products: str, lang: str = "en", user_id: int = 0, is_premium: bool = False) -> Optional[Dict]:
+        """Возвращает категории, подсказку и блюда по каждой категории за один вызов LLM."""
+        system = get_prompt(lang, "fused_analysis")
+        user = get_prompt(lang, "fused_analysis_user").format(products=products)
+        key_source, similar = self._canonical_input("fused_analysis", lang, products)
+        response = await self._send_request(system, user, 0.3, "analysis", lang, user_id, get_priority(is_premium), key_source, similar,
+                                            route_name="fused_analysis")
+
+        try:
+            if "{" not in response: raise ValueError("No JSON found")
+            data = json.loads(response[response.find('{'):response.rfind('}')+1])
+            if not isinstance(data, dict): return None
+
+            categories = data.get("categories") or data.get("category") or []
+            if isinstance(categories, str): categories = [categories]
+            raw_dishes = data.get("dishes") if isinstance(data.get("dishes"), dict) else {}
+
+            dishes = {}
+            for cat, items in raw_dishes.items():
+                if isinstance(items, list):
+                    valid = [d for d in items if isinstance(d, dict) and d.get("name")]
+                    if valid: dishes[str(cat).lower().strip()] = valid
+
+            if categories:
+                return {"categories": categories, "suggestion": data.get("suggestion"), "dishes": dishes}
+            if data.get("categories") == []:
+                input_filter.remember_bad(products, lang)
+        except Exception as e:
+            logger.error(f"Fused Analysis Parse Error: {e}", exc_info=True)
+        return None
+
     # 2. РЕЦЕПТ
-    async def generate_recipe(self, dish_name: str, products: str, lang: str = "en", user_id: int = 0, is_premium: bool = False, is_direct: bool = False) -> str:
+    def _build_recipe_prompts(self, dish_name: str, products: str, lang: str, is_premium: bool, is_direct: bool) -> Tuple[str, str]:
         base_prompt = get_prompt(lang, "recipe_generation")
         
         if is_direct:
@@ -115,14 +396,195 @@ class GroqService:
         user_prompt = get_prompt(lang, "recipe_generation_user").format(dish_name=dish_name, products=products)
         marker = "DIRECT" if is_direct else "INVENTORY"
         user_prompt += f"\n[Mode: {marker}]"
-        
-        return await self._send_request(system_prompt, user_prompt, 0.7, "recipe", lang, user_id)
+        return system_prompt, user_prompt
+
+    async def generate_recipe(self, dish_name: str, products: str, lang: str = "en", user_id: int = 0, is_premium: bool = False, is_direct: bool = False) -> str:
+        system_prompt, user_prompt = self._build_recipe_prompts(dish_name, products, lang, is_premium, is_direct)
+        return await self._send_request(system_prompt, user_prompt, 0.7, "recipe", lang, user_id, get_priority(is_premium),
+                                        route_name=self._recipe_route(is_premium))
+
+    async def warm_recipe(self, dish_name: str, lang: str, is_premium: bool, refresh_margin: int,
+                          only_existing: bool = False) -> bool:
+        """Прогрев кэша прямого рецепта фоновым запросом: генерирует заново, если записи нет
+        или до её истечения меньше refresh_margin сек. Возвращает True, если был запрос к Groq."""
+        if not self.client: return False
+        system_prompt, user_prompt = self._build_recipe_prompts(dish_name, "", lang, is_premium, True)
+        route_name = self._recipe_route(is_premium)
+        route = self._route(route_name)
+        cache_key = self._cache_key(system_prompt, user_prompt, lang, route_name)
+
+        ttl_left = await groq_cache.ttl_left(prompt=cache_key, lang=lang, model=route["model"], cache_type="recipe")
+        if ttl_left is None and only_existing:
+            return False
+        if ttl_left is not None and ttl_left > refresh_margin:
+            return False
+
+        await self._flight.do(
+            f"recipe:{cache_key}",
+            lambda: self._complete(system_prompt, user_prompt, 0.7, "recipe", lang, 0, cache_key,
+                                   get_priority(is_premium, background=True), route_name=route_name)
+        )
+        return True
+
+    @staticmethod
+    def _recipe_route(is_premium: bool) -> str:
+        """Премиум-рецепт длиннее (блок КБЖУ) - у него свой маршрут и свой бюджет токенов."""
+        return "recipe_premium" if is_premium else "recipe"
+
+    async def stream_recipe(self, dish_name: str, products: str, lang: str = "en", user_id: int = 0,
+                            is_premium: bool = False, is_direct: bool = False) -> AsyncIterator[str]:
+        """Потоковая генерация рецепта: отдаёт куски текста по мере прихода токенов.
+
+        Одинаковые одновременные запросы склеиваются: стрим к Groq открывает первый, остальные
+        получают те же куски (с начала). Запрос без стрима с тем же ключом ждёт итоговый текст."""
+        if not self.client:
+            yield "API Error"
+            return
+
+        system_prompt, user_prompt = self._build_recipe_prompts(dish_name, products, lang, is_premium, is_direct)
+        cache_type = "recipe"
+        route_name = self._recipe_route(is_premium)
+        models = self._route_models(self._route(route_name))
+        cache_key = self._cache_key(system_prompt, user_prompt, lang, route_name)
+        priority = get_priority(is_premium)
+
+        try:
+            cached = await self._get_cached(cache_key, lang, cache_type, models)
+        except Exception as e:
+            logger.error(f"Cache read error: {e}", exc_info=True)
+            cached = None
+        if cached:
+            metrics.track_event_later(user_id, "groq_cache_hit", {"key": cache_key})
+            yield cached
+            return
+
+        flight_key = f"{cache_type}:{cache_key}"
+        broadcast = self._streams.get(flight_key)
+        sent = False
+        try:
+            if broadcast is None and self._flight.is_inflight(flight_key):
+                # Тот же рецепт уже генерируется без стрима (generate_recipe / прогрев) - ждём текст
+                groq_scheduler.promote(flight_key, priority)
+                metrics.track_event_later(user_id, "groq_request_coalesced", {"key": cache_key, "stream": True})
+                yield await self._flight.join(flight_key)
+                return
+
+            if broadcast is None:
+                broadcast = self._streams[flight_key] = ChunkBroadcast()
+                task = asyncio.create_task(self._flight.do(
+                    flight_key,
+                    lambda: self._complete_stream(system_prompt, user_prompt, lang, user_id, cache_key,
+                                                  priority, route_name, broadcast)
+                ))
+                # Генерация не зависит от первого подписчика: если он ушёл, остальные дочитают, а рецепт ляжет в кэш
+                self._stream_tasks.add(task)
+                task.add_done_callback(self._stream_done)
+            else:
+                promoted = groq_scheduler.promote(flight_key, priority)
+                metrics.track_event_later(user_id, "groq_request_coalesced", {
+                    "key": cache_key, "stream": True, "promoted": promoted
+                })
+
+            async for delta in broadcast.subscribe():
+                sent = True
+                yield delta
+            if broadcast.error is not None:
+                raise broadcast.error
+        except Exception as e:
+            logger.error(f"Groq Stream Error: {e}", exc_info=not isinstance(e, CircuitOpenError))
+            if not sent:
+                degraded = await self._degraded_response(cache_key, lang, cache_type, models, None, user_id, type(e).__name__)
+                yield degraded or "Server Error"
+
+    def _stream_done(self, task: asyncio.Task) -> None:
+        self._stream_tasks.discard(task)
+        if not task.cancelled():
+            task.exception()  # Ошибку уже получили подписчики через broadcast
+
+    async def _complete_stream(self, system_prompt: str, user_prompt: str, lang: str, user_id: int, cache_key: str,
+                               priority: int, route_name: str, broadcast: ChunkBroadcast) -> str:
+        """Стрим рецепта из Groq в broadcast + запись в кэш (один раз на ключ).
+
+        Весь стрим, а не только его открытие, идёт внутри слота очереди и под предохранителем:
+        генерация токенов занимает слот и учитывается в задержке модели; токены сверяются по usage."""
+        cache_type = "recipe"
+        route = self._route(route_name)
+        max_tokens = token_budget.max_tokens(route_name, route)
+        est_tokens = self._estimate_tokens(lang, system_prompt, user_prompt, max_tokens)
+
+        async def read(model: str) -> Tuple[str, object, Optional[str]]:
+            stream = await self.client.chat.completions.create(
+                messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
+                model=model, temperature=0.7, max_tokens=max_tokens,
+                stream=True, timeout=route["timeout"]
+            )
+            parts: List[str] = []
+            usage, finish_reason = None, None
+            async for chunk in stream:
+                # Groq присылает usage в последнем чанке (x_groq.usage)
+                x_groq = getattr(chunk, "x_groq", None)
+                if x_groq is not None and getattr(x_groq, "usage", None):
+                    usage = x_groq.usage
+                if not chunk.choices:
+                    continue
+                finish_reason = self._finish_reason(chunk.choices[0]) or finish_reason
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    broadcast.publish(delta)
+            return "".join(parts), usage, finish_reason
+
+        error: Optional[BaseException] = None
+        try:
+            for model in self._route_models(route):
+                started = time.monotonic()
+                try:
+                    text, usage, finish_reason = await self._call_model(
+                        model, route, route_name, lambda: read(model), priority=priority, est_tokens=est_tokens,
+                        usage_of=lambda r: r[1].total_tokens if r[1] else None, key=f"{cache_type}:{cache_key}"
+                    )
+                except Exception as e:
+                    error = e
+                    # Пользователи уже видят часть текста - запасная модель начала бы рецепт заново
+                    if broadcast.chunks:
+                        raise
+                    logger.warning(f"Groq model {model} failed to stream ({route_name}): {e}")
+                    continue
+
+                error = None
+                truncated = finish_reason == "length"
+                token_budget.record(route_name, lang, len(system_prompt) + len(user_prompt), usage, max_tokens,
+                                    truncated=truncated)
+                if truncated:
+                    # Пользователь уже видит текст; в кэш обрезанный рецепт не кладём
+                    self._report_truncated(user_id, route_name, model, max_tokens, stream=True)
+                elif text:
+                    groq_cache.set_later(prompt=cache_key, response=text, lang=lang, model=model,
+                                         tokens_used=usage.total_tokens if usage else 0, cache_type=cache_type)
+                metrics.track_event_later(user_id, "groq_request", {
+                    "key": cache_key, "route": route_name, "model": model, "stream": True,
+                    "fallback": model != route["model"], "subscribers": broadcast.subscribers,
+                    "latency_ms": int((time.monotonic() - started) * 1000),
+                    "max_tokens": max_tokens, "truncated": truncated,
+                    "prompt_tokens": usage.prompt_tokens if usage else None,
+                    "completion_tokens": usage.completion_tokens if usage else None,
+                })
+                return text
+            raise error
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._streams.pop(f"{cache_type}:{cache_key}", None)
+            broadcast.close(error)
 
     # 3. СПИСОК БЛЮД
-    async def generate_dishes_list(self, products: str, category: str, lang: str = "en", user_id: int = 0) -> Optional[List[Dict]]:
+    async def generate_dishes_list(self, products: str, category: str, lang: str = "en", user_id: int = 0,
+                                   is_premium: bool = False, background: bool = False) -> Optional[List[Dict]]:
         sys = get_prompt(lang, "dish_generation")
         usr = get_prompt(lang, "dish_generation_user").format(products=products, category=category)
-        resp = await self._send_request(sys, usr, 0.5, "dish_list", lang, user_id)
+        key_source, similar = self._canonical_input("dish_generation", lang, products, category.lower().strip())
+        resp = await self._send_request(sys, usr, 0.5, "dish_list", lang, user_id, get_priority(is_premium, background), key_source, similar)
         try:
             if "{" not in resp and "[" not in resp: return None
             # Находим границы JSON
@@ -0,0 +1,103 @@
+import logging
+import re
+from typing import Dict, Optional, Set
+
+from config import PREFILTER_ENABLED, PREFILTER_MAX_CHARS
+from database.cache import groq_cache
+from locales.ingredients import INGREDIENTS
+from locales.prompts import PROMPTS_VERSION
+from services.canonical import _singular_word, canonicalize_products, normalize_item
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"[^\W\d_]+")
+_STEM_LEN = 5  # Префикс для составных слов и словоформ ("kartoffelpüree", "pomodorini")
+_MIN_WORD_LEN = 3  # Короче - предлоги и союзы ("и", "of", "de"), в долю знакомых не входят
+_NEGATIVE_MARK = "1"
+
+class InputFilter:
+    """Локальная проверка ввода перед LLM: явный мусор отсекается, знакомые продукты проходят
+    без чтения негативного кэша, остальное решает модель (и её отказ кэшируется ненадолго)."""
+
+    def __init__(self):
+        self._words: Dict[str, Set[str]] = {}
+        self._stems: Dict[str, Set[str]] = {}
+        for lang, items in INGREDIENTS.items():
+            words, stems = set(), set()
+            for item in items:
+                item = normalize_item(item, lang)
+                words.add(item)
+                last = item.split(" ")[-1]
+                words.add(last)
+                if len(last) > _STEM_LEN:
+                    stems.add(last[:_STEM_LEN])
+            self._words[lang], self._stems[lang] = words, stems
+        self.stats = {"checked": 0, "rejected": 0, "known": 0, "negative_hits": 0, "negative_stored": 0}
+
+    def _is_known(self, word: str, lang: str) -> bool:
+        # Английские названия продуктов часто пишут на любом языке интерфейса
+        for code in (lang, "en"):
+            words = self._words.get(code, ())
+            if word in words or _singular_word(word, code) in words:
+                return True
+            if len(word) >= _STEM_LEN and word[:_STEM_LEN] in self._stems.get(code, ()):
+                return True
+        return False
+
+    def is_garbage(self, text: str) -> bool:
+        """Явно не список продуктов: ни одного слова или вставленная "простыня" текста."""
+        if not PREFILTER_ENABLED:
+            return False
+        self.stats["checked"] += 1
+        if not _WORD_RE.search(text or "") or len(text or "") > PREFILTER_MAX_CHARS:
+            self.stats["rejected"] += 1
+            return True
+        return False
+
+    def is_definitely_food(self, text: str, lang: str) -> bool:
+        """Большинство слов - знакомые продукты. Словарь неполный (kimchi, gochujang, ввод на других
+        языках), поэтому незнакомый ввод не отклоняется, а уходит в LLM."""
+        words = [w.lower() for w in _WORD_RE.findall(text or "") if len(w) >= _MIN_WORD_LEN]
+        if not words:
+            return False
+        known = sum(1 for w in words if self._is_known(w, lang))
+        if known * 2 >= len(words):
+            self.stats["known"] += 1
+            return True
+        return False
+
+    @staticmethod
+    def _negative_key(text: str, lang: str) -> str:
+        return f"v{PROMPTS_VERSION}|{canonicalize_products(text, lang)}"
+
+    async def is_known_bad(self, text: str, lang: str) -> bool:
+        """Этот набор (в канонической форме) уже разбирали, и продуктов в нём модель не нашла."""
+        try:
+            hit = await groq_cache.get(prompt=self._negative_key(text, lang), lang=lang, model="negative", cache_type="negative")
+        except Exception as e:
+            logger.warning(f"Negative cache read error: {e}")
+            return False
+        if hit:
+            self.stats["negative_hits"] += 1
+        return bool(hit)
+
+    def remember_bad(self, text: str, lang: str) -> None:
+        """Модель явно ответила, что продуктов нет (пустой список категорий). TTL - CACHE_TTL_NEGATIVE."""
+        self.stats["negative_stored"] += 1
+        groq_cache.set_later(prompt=self._negative_key(text, lang), response=_NEGATIVE_MARK, lang=lang,
+                             model="negative", tokens_used=0, cache_type="negative")
+
+    async def rejection_reason(self, text: str, lang: str) -> Optional[str]:
+        """Причина не звать LLM ("prefilter" / "negative_cache") или None."""
+        if self.is_garbage(text):
+            return "prefilter"
+        if self.is_definitely_food(text, lang):
+            return None
+        if await self.is_known_bad(text, lang):
+            return "negative_cache"
+        return None
+
+    def saved_calls(self) -> int:
+        return self.stats["rejected"] + self.stats["negative_hits"]
+
+input_filter = InputFilter()
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from typing import Dict, List, Set, Tuple
+
+from config import PREFETCH_ENABLED, PREFETCH_TOP_N, PREFETCH_MAX_INFLIGHT, PREFETCH_FREE_MAX_LOAD
+from database.metrics import metrics
+from services.groq_service import groq_service
+
+logger = logging.getLogger(__name__)
+
+class DishPrefetcher:
+    """Фоново генерирует списки блюд для первых категорий, чтобы нажатие отвечало из кэша."""
+
+    def __init__(self):
+        self._tasks: Set[asyncio.Task] = set()
+        # user_id -> категории, прогретые для текущего набора продуктов и ещё не открытые
+        self._pending: Dict[int, Set[str]] = {}
+        self.stats = {"scheduled": 0, "skipped": 0, "used": 0, "wasted": 0}
+
+    def _release_pending(self, user_id: int) -> None:
+        """Закрывает прошлый флоу юзера: неиспользованные предзагрузки считаются потерянными."""
+        unused = self._pending.pop(user_id, None)
+        if unused:
+            self.stats["wasted"] += len(unused)
+            metrics.track_event_later(user_id, "prefetch_wasted", {"count": len(unused)})
+
+    def schedule(self, user_id: int, products: str, categories: List[str], lang: str, is_premium: bool) -> None:
+        """Запускает предзагрузку для PREFETCH_TOP_N категорий, если позволяет бюджет."""
+        self._release_pending(user_id)
+        if not PREFETCH_ENABLED or not products:
+            return
+
+        if not is_premium and groq_service.current_load() >= PREFETCH_FREE_MAX_LOAD:
+            self.stats["skipped"] += 1
+            return
+
+        pending = set()
+        for category in categories[:PREFETCH_TOP_N]:
+            if len(self._tasks) >= PREFETCH_MAX_INFLIGHT:
+                self.stats["skipped"] += 1
+                break
+            category = category.lower().strip()
+            task = asyncio.create_task(self._run(user_id, products, category, lang, is_premium))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            pending.add(category)
+            self.stats["scheduled"] += 1
+
+        if pending:
+            self._pending[user_id] = pending
+
+    async def _run(self, user_id: int, products: str, category: str, lang: str, is_premium: bool) -> None:
+        try:
+            # Результат ложится в groq_cache; параллельный "живой" запрос склеится через single-flight
+            await groq_service.generate_dishes_list(products, category, lang, user_id, is_premium, background=True)
+        except Exception as e:
+            logger.warning(f"Prefetch failed ({category}): {e}")
+
+    def mark_used(self, user_id: int, category: str) -> None:
+        """Отмечает нажатие на категорию; попадание в предзагрузку пишется в метрики."""
+        pending = self._pending.get(user_id)
+        if pending and category in pending:
+            pending.discard(category)
+            self.stats["used"] += 1
+            metrics.track_event_later(user_id, "prefetch_hit", {"category": category})
+
+    def hit_ratio(self) -> float:
+        done = self.stats["used"] + self.stats["wasted"]
+        return round(self.stats["used"] / done, 3) if done else 0.0
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+dish_prefetcher = DishPrefetcher()
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    """Модель временно отключена предохранителем."""
+
+class CircuitBreaker:
+    """Предохранитель: closed -> open (ошибки/медленные ответы) -> half_open (пробный запрос) -> closed."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_rate: float, min_calls: int, window: int,
+                 slow_call_sec: float, open_seconds: float):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.slow_call_sec = slow_call_sec
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self._results: Deque[bool] = deque(maxlen=window)  # True = неудача или медленный ответ
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        """Можно ли сейчас отправить запрос в эту модель."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self.state = self.HALF_OPEN
+            logger.info(f"Circuit {self.name}: half-open")
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self._results.clear()
+        logger.warning(f"⚡️ Circuit {self.name}: OPEN на {self.open_seconds:.0f} сек.")
+
+    def record(self, ok: bool, latency: float = 0.0) -> None:
+        bad = not ok or latency > self.slow_call_sec
+        if self.state == self.HALF_OPEN:
+            if bad:
+                self._open()
+            else:
+                self.state = self.CLOSED
+                self._probe_in_flight = False
+                logger.info(f"Circuit {self.name}: closed")
+            return
+
+        self._results.append(bad)
+        if len(self._results) >= self.min_calls and sum(self._results) / len(self._results) >= self.failure_rate:
+            self._open()
+
+    def release_probe(self) -> None:
+        """Пробный запрос не состоялся (например, отменён) - разрешаем следующий."""
+        self._probe_in_flight = False
+
+class LatencyWindow:
+    """Скользящее окно задержек для оценки p95."""
+
+    def __init__(self, size: int = 200):
+        self._values: Deque[float] = deque(maxlen=size)
+
+    def add(self, value: float) -> None:
+        self._values.append(value)
+
+    def percentile(self, p: float, default: float) -> float:
+        if len(self._values) < 20:
+            return default  # Мало данных - не доверяем оценке
+        values = sorted(self._values)
+        return values[min(len(values) - 1, int(len(values) * p))]
+
+async def hedged(fn: Callable[[], Awaitable[Any]], delay: float, on_hedge: Optional[Callable[[], None]] = None) -> Any:
+    """Запускает fn(); если ответа нет за delay сек, запускает вторую попытку и берёт первую успешную."""
+    tasks = [asyncio.ensure_future(fn())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return tasks[0].result()
+
+        if on_hedge:
+            on_hedge()
+        tasks.append(asyncio.ensure_future(fn()))
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        # Проигравшую (или осиротевшую при отмене) попытку отменяем
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+def breaker_stats(breakers: Dict[str, CircuitBreaker]) -> Dict[str, str]:
+    return {name: b.state for name, b in breakers.items()}
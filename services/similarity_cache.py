@@ -0,0 +1,121 @@
+import logging
+import random
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from config import SIMILARITY_THRESHOLD, SIMILARITY_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+_MAX_HASH = (1 << 61) - 1  # Простое число Мерсенна для универсального хэширования
+
+class MinHasher:
+    """MinHash-сигнатуры для множеств строк."""
+
+    def __init__(self, num_perm: int = 64, seed: int = 42):
+        rnd = random.Random(seed)
+        self.num_perm = num_perm
+        self._params = [(rnd.randrange(1, _MAX_HASH), rnd.randrange(0, _MAX_HASH)) for _ in range(num_perm)]
+
+    def signature(self, items: FrozenSet[str]) -> Tuple[int, ...]:
+        # hash() стабилен в пределах процесса - индекс живёт только в памяти
+        hashes = [hash(item) & _MAX_HASH for item in items]
+        return tuple(min((a * h + b) % _MAX_HASH for h in hashes) for a, b in self._params)
+
+class SimilarityCache:
+    """Приблизительный кэш: MinHash/LSH по каноническим наборам продуктов."""
+
+    def __init__(self, threshold: float, max_entries: int, num_perm: int = 64, bands: int = 16):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+
+        # entry_id -> (scope, items, response, expires_at, band_keys)
+        self._entries: "OrderedDict[int, Tuple[str, FrozenSet[str], str, float, List[tuple]]]" = OrderedDict()
+        self._buckets: Dict[tuple, Set[int]] = {}
+        self._by_key: Dict[Tuple[str, FrozenSet[str]], int] = {}
+        self._next_id = 0
+        self.stats_counters = {"lookups": 0, "hits": 0, "similarity_sum": 0.0}
+
+    def _band_keys(self, scope: str, items: FrozenSet[str]) -> List[tuple]:
+        sig = self.hasher.signature(items)
+        return [(scope, i, sig[i * self.rows:(i + 1) * self.rows]) for i in range(self.bands)]
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if not entry:
+            return
+        scope, items, _, _, band_keys = entry
+        self._by_key.pop((scope, items), None)
+        for key in band_keys:
+            bucket = self._buckets.get(key)
+            if bucket:
+                bucket.discard(entry_id)
+                if not bucket: del self._buckets[key]
+
+    def add(self, scope: str, items: List[str], response: str, ttl: int) -> None:
+        """Добавляет ответ для набора продуктов в индекс."""
+        frozen = frozenset(items)
+        if not frozen:
+            return
+        existing = self._by_key.get((scope, frozen))
+        if existing is not None:
+            self._remove(existing)
+
+        entry_id = self._next_id
+        self._next_id += 1
+        band_keys = self._band_keys(scope, frozen)
+        self._entries[entry_id] = (scope, frozen, response, time.monotonic() + ttl, band_keys)
+        self._by_key[(scope, frozen)] = entry_id
+        for key in band_keys:
+            self._buckets.setdefault(key, set()).add(entry_id)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def lookup(self, scope: str, items: List[str]) -> Optional[Tuple[str, float]]:
+        """Ищет ответ для похожего набора; возвращает (ответ, сходство Жаккара) или None."""
+        frozen = frozenset(items)
+        if not frozen:
+            return None
+        self.stats_counters["lookups"] += 1
+
+        candidates: Set[int] = set()
+        for key in self._band_keys(scope, frozen):
+            candidates |= self._buckets.get(key, set())
+
+        now = time.monotonic()
+        best: Optional[Tuple[str, float]] = None
+        for entry_id in candidates:
+            entry = self._entries.get(entry_id)
+            if not entry:
+                continue
+            _, other, response, expires_at, _ = entry
+            if expires_at <= now:
+                self._remove(entry_id)
+                continue
+            # Кандидатов мало, поэтому сходство считаем точно по множествам
+            similarity = len(frozen & other) / len(frozen | other)
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (response, similarity)
+
+        if best:
+            self.stats_counters["hits"] += 1
+            self.stats_counters["similarity_sum"] += best[1]
+        return best
+
+    def stats(self) -> Dict[str, float]:
+        hits = self.stats_counters["hits"]
+        lookups = self.stats_counters["lookups"]
+        return {
+            "entries": len(self._entries),
+            "lookups": lookups,
+            "hits": hits,
+            "hit_ratio": round(hits / lookups, 3) if lookups else 0.0,
+            "avg_similarity": round(self.stats_counters["similarity_sum"] / hits, 3) if hits else 0.0,
+        }
+
+similarity_cache = SimilarityCache(SIMILARITY_THRESHOLD, SIMILARITY_CACHE_MAX_ENTRIES)
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncIterable, Awaitable, Callable, Deque, Dict, Iterable, Optional, Tuple, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from config import TELEGRAM_SEND_RATE, TELEGRAM_SEND_CONCURRENCY, TELEGRAM_PER_CHAT_INTERVAL, TELEGRAM_SEND_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Результаты отправки
+SENT = "sent"
+BLOCKED = "blocked"  # Пользователь заблокировал бота / удалил аккаунт - повторять бессмысленно
+FAILED = "failed"
+
+Message = Tuple[int, str]  # (chat_id, text)
+ResultCallback = Callable[[int, str], Union[None, Awaitable[None]]]
+
+class TelegramSender:
+    """Массовая отправка сообщений в пределах общего лимита Telegram (~30 сообщений/сек на бота).
+
+    Сообщения разносятся по равным слотам времени (без пачек), на 429 вся отправка
+    встаёт на retry_after, в один чат - не чаще раза в per_chat_interval секунд."""
+
+    def __init__(self, rate: float, concurrency: int, per_chat_interval: float, max_retries: int):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self._next_slot = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        self._chat_next: Dict[int, float] = {}
+        self._sent_at: Deque[float] = deque(maxlen=1000)  # Для фактической скорости
+        self.stats = {"sent": 0, "blocked": 0, "failed": 0, "retry_after": 0}
+
+    async def _wait_slot(self, chat_id: int) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot, self._chat_next.get(chat_id, 0.0))
+            self._next_slot = slot + 1.0 / self.rate
+            self._chat_next[chat_id] = slot + self.per_chat_interval
+            if len(self._chat_next) > 10000:
+                self._chat_next = {c: t for c, t in self._chat_next.items() if t > now}
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def _pause(self, seconds: float) -> None:
+        """Telegram попросил подождать: сдвигаем все следующие слоты."""
+        self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+    async def send(self, bot: Bot, chat_id: int, text: str, **kwargs: Any) -> str:
+        """Отправляет одно сообщение с учётом лимитов. Возвращает SENT / BLOCKED / FAILED."""
+        for attempt in range(self.max_retries + 1):
+            await self._wait_slot(chat_id)
+            try:
+                await bot.send_message(chat_id, text, **kwargs)
+                self.stats["sent"] += 1
+                self._sent_at.append(time.monotonic())
+                return SENT
+            except TelegramRetryAfter as e:
+                self.stats["retry_after"] += 1
+                logger.warning(f"Telegram flood limit: пауза {e.retry_after} сек.")
+                self._pause(e.retry_after)
+            except TelegramForbiddenError:
+                self.stats["blocked"] += 1
+                return BLOCKED
+            except TelegramBadRequest as e:
+                # Чат не найден, неверная разметка и т.п. - повтор не поможет
+                self.stats["failed"] += 1
+                logger.warning(f"Сообщение в {chat_id} отклонено: {e}")
+                return FAILED
+            except Exception as e:
+                logger.warning(f"Ошибка отправки в {chat_id} (попытка {attempt + 1}): {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+        self.stats["failed"] += 1
+        return FAILED
+
+    async def send_many(self, bot: Bot, messages: Union[Iterable[Message], AsyncIterable[Message]],
+                        on_result: Optional[ResultCallback] = None, **kwargs: Any) -> Dict[str, int]:
+        """Рассылает (chat_id, text) параллельно на concurrency воркерах. Источник может быть асинхронным
+        (курсор БД) - он читается не дальше, чем успевает отправка. Возвращает счётчики результатов."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        counts = {SENT: 0, BLOCKED: 0, FAILED: 0}
+
+        async def worker() -> None:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                chat_id, text = item
+                result = await self.send(bot, chat_id, text, **kwargs)
+                counts[result] += 1
+                if on_result is not None:
+                    try:
+                        maybe = on_result(chat_id, result)
+                        if asyncio.iscoroutine(maybe):
+                            await maybe
+                    except Exception as e:
+                        logger.error(f"Ошибка обработки результата отправки: {e}", exc_info=True)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            if hasattr(messages, "__aiter__"):
+                async for item in messages:
+                    await queue.put(item)
+            else:
+                for item in messages:
+                    await queue.put(item)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for w in workers:
+                w.cancel()
+        return counts
+
+    def current_rate(self, window: float = 10.0) -> float:
+        """Фактическая скорость отправки (сообщений/сек) за последние window секунд."""
+        since = time.monotonic() - window
+        return round(sum(1 for t in self._sent_at if t >= since) / window, 1)
+
+telegram_sender = TelegramSender(
+    TELEGRAM_SEND_RATE, TELEGRAM_SEND_CONCURRENCY, TELEGRAM_PER_CHAT_INTERVAL, TELEGRAM_SEND_RETRIES
+)
@@ -0,0 +1,82 @@
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from config import (
+    TOKEN_BUDGET_ENABLED, TOKEN_BUDGET_PERCENTILE, TOKEN_BUDGET_HEADROOM,
+    TOKEN_BUDGET_MIN_SAMPLES, TOKEN_BUDGET_MIN_TOKENS, TOKEN_BUDGET_HISTORY_DAYS
+)
+from database.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Стартовая оценка символов на токен (токенизатор Llama); уточняется по usage.prompt_tokens
+CHARS_PER_TOKEN: Dict[str, float] = {"en": 4.0, "de": 3.3, "fr": 3.5, "it": 3.4, "es": 3.6}
+_DEFAULT_CHARS_PER_TOKEN = 3.5
+
+class TokenBudget:
+    """Оценка размера промпта и max_tokens по маршруту из перцентилей длины ответов."""
+
+    def __init__(self, window: int = 500):
+        self._window = window
+        self._chars_per_token: Dict[str, float] = dict(CHARS_PER_TOKEN)
+        self._samples: Dict[str, Deque[int]] = {}
+        self._history: Dict[str, tuple] = {}  # route -> (перцентиль, число ответов) из таблицы metrics
+        self.truncated: Dict[str, int] = {}
+
+    def estimate_prompt_tokens(self, lang: str, *texts: str) -> int:
+        chars = sum(len(t) for t in texts)
+        return int(chars / self._chars_per_token.get(lang, _DEFAULT_CHARS_PER_TOKEN)) + 1
+
+    def max_tokens(self, route_name: str, route: Dict[str, Any]) -> int:
+        """max_tokens для запроса: перцентиль ответов * запас, в пределах [минимум, потолок маршрута]."""
+        default = route["max_tokens"]
+        cap = route.get("max_tokens_cap", default)
+        if not TOKEN_BUDGET_ENABLED:
+            return default
+
+        observed = self._percentile(route_name)
+        if observed is None:
+            return default
+        return max(TOKEN_BUDGET_MIN_TOKENS, min(cap, int(observed * TOKEN_BUDGET_HEADROOM)))
+
+    def _percentile(self, route_name: str) -> Optional[int]:
+        samples = self._samples.get(route_name)
+        if samples and len(samples) >= TOKEN_BUDGET_MIN_SAMPLES:
+            values = sorted(samples)
+            return values[min(len(values) - 1, int(len(values) * TOKEN_BUDGET_PERCENTILE))]
+        tokens, count = self._history.get(route_name, (None, 0))
+        return tokens if count >= TOKEN_BUDGET_MIN_SAMPLES else None
+
+    def record(self, route_name: str, lang: str, prompt_chars: int, usage: Any,
+               limit: int, truncated: bool = False) -> None:
+        """Учитывает фактический расход токенов ответа (и уточняет символы/токен для языка)."""
+        if truncated:
+            self.truncated[route_name] = self.truncated.get(route_name, 0) + 1
+            # Реальная длина неизвестна и больше лимита - считаем с запасом, чтобы перцентиль рос
+            completion = limit * 2
+        elif usage is not None and usage.completion_tokens:
+            completion = usage.completion_tokens
+        else:
+            return
+        self._samples.setdefault(route_name, deque(maxlen=self._window)).append(completion)
+
+        if usage is not None and usage.prompt_tokens and prompt_chars:
+            ratio = prompt_chars / usage.prompt_tokens
+            current = self._chars_per_token.get(lang, _DEFAULT_CHARS_PER_TOKEN)
+            self._chars_per_token[lang] = current * 0.9 + ratio * 0.1
+
+    async def load(self) -> None:
+        """Подтягивает перцентили из метрик groq_request (при старте и раз в сутки)."""
+        history = await metrics.get_completion_percentiles(TOKEN_BUDGET_PERCENTILE, TOKEN_BUDGET_HISTORY_DAYS)
+        if history:
+            self._history = history
+            logger.info(f"🎯 Бюджет токенов: {', '.join(f'{r}={t}' for r, (t, _) in history.items())}")
+
+    def stats(self, routes: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {"max_tokens": self.max_tokens(name, route), "truncated": self.truncated.get(name, 0)}
+            for name, route in routes.items() if name != "default"
+        }
+
+token_budget = TokenBudget()
@@ -36,6 +36,15 @@ class StateManager:
     def get_generated_dishes(self, user_id: int) -> Optional[List[Dict]]:
         return self.user_states.get(user_id, {}).get('generated_dishes')
 
+    # --- БЛЮДА ПО КАТЕГОРИЯМ (объединённый анализ) ---
+    def set_category_dishes(self, user_id: int, dishes_by_category: Dict[str, List[Dict]]):
+        """Сохраняет заранее полученные списки блюд для каждой категории"""
+        if user_id in self.user_states:
+            self.user_states[user_id]['category_dishes'] = dishes_by_category
+
+    def get_category_dishes(self, user_id: int, category: str) -> Optional[List[Dict]]:
+        return self.user_states.get(user_id, {}).get('category_dishes', {}).get(category)
+
     def set_current_dish(self, user_id: int, dish: Dict):
         if user_id in self.user_states:
              self.user_states[user_id]['current_dish'] = dish
@@ -0,0 +1,68 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from database import db
+
+# Минимальная схема таблиц, которые бот не создаёт сам (в проде их завёл Supabase)
+SCHEMA = """
+DROP SCHEMA public CASCADE;
+CREATE SCHEMA public;
+CREATE TABLE users (
+    user_id BIGINT PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    language_code TEXT DEFAULT 'en',
+    is_premium BOOLEAN NOT NULL DEFAULT FALSE,
+    premium_until TIMESTAMPTZ,
+    trial_status TEXT,
+    requests_today INTEGER NOT NULL DEFAULT 0,
+    voice_requests_today INTEGER NOT NULL DEFAULT 0,
+    total_requests INTEGER NOT NULL DEFAULT 0,
+    last_reset_date DATE,
+    last_active_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE TABLE groq_cache (
+    id BIGSERIAL PRIMARY KEY,
+    prompt_hash TEXT NOT NULL,
+    response TEXT NOT NULL,
+    language TEXT,
+    model TEXT,
+    tokens_used INTEGER,
+    cache_type TEXT NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    UNIQUE (prompt_hash, cache_type)
+);
+"""
+
+_server = None
+
+def _database_url() -> str:
+    """TEST_DATABASE_URL или встроенный Postgres (pgserver); без них тесты БД пропускаются."""
+    global _server
+    url = os.getenv("TEST_DATABASE_URL")
+    if url:
+        return url
+    pgserver = pytest.importorskip("pgserver", reason="нужен TEST_DATABASE_URL или pgserver")
+    if _server is None:
+        _server = pgserver.get_server(os.path.join(os.path.dirname(__file__), ".pgdata"), cleanup_mode="stop")
+    return _server.get_uri()
+
+@pytest.fixture
+async def pg(monkeypatch):
+    """Пул database.db на чистой тестовой базе."""
+    monkeypatch.setattr(database, "DATABASE_URL", _database_url())
+    monkeypatch.setattr(database, "DB_PGBOUNCER", "false")
+    monkeypatch.setattr(database, "DB_SSL", False)
+    db._pool, db._lock = None, None
+    await db.connect()
+    async with db.connection() as conn:
+        await conn.execute(SCHEMA)
+    yield db
+    await db.close()
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from database import db
+from database.cache import CacheRepository
+from database.write_behind import write_behind
+
+@pytest.fixture
+async def cache(pg):
+    repo = CacheRepository()
+    await repo.ensure_schema()
+    await repo.set("borscht", "recipe text", "ru", "m", 10, "recipe")
+    repo.memory.clear()
+    return repo
+
+async def read_hits(repo):
+    async with db.connection() as conn:
+        return await conn.fetchval("SELECT hits FROM groq_cache WHERE prompt_hash = $1",
+                                   repo._generate_hash("borscht", "ru", "m"))
+
+async def test_l2_hit_is_a_read(cache):
+    for _ in range(3):
+        assert await cache.get("borscht", "ru", "m", "recipe") == "recipe text"
+        cache.memory.clear()
+
+    # Попадания копятся в памяти, таблица не обновлялась
+    assert await read_hits(cache) == 0
+    assert sum(n for n, _ in cache._hits.values()) == 3
+
+    assert await cache.flush_hits() == 1
+    assert await read_hits(cache) == 3
+    assert cache._hits == {}
+
+async def test_hits_flush_through_write_behind(cache, monkeypatch):
+    monkeypatch.setattr("database.cache.CACHE_HIT_FLUSH_BATCH", 1)
+    write_behind.start()
+    try:
+        await cache.get("borscht", "ru", "m", "recipe")
+        await asyncio.wait_for(write_behind._get_queue().join(), 5)
+    finally:
+        await write_behind.close()
+        write_behind._queue = None
+    assert await read_hits(cache) == 1
+
+async def test_failed_flush_keeps_hits(cache, monkeypatch):
+    await cache.get("borscht", "ru", "m", "recipe")
+    async with db.connection() as conn:
+        await conn.execute("ALTER TABLE groq_cache RENAME TO groq_cache_off")
+    with pytest.raises(Exception):
+        await cache.flush_hits()
+    async with db.connection() as conn:
+        await conn.execute("ALTER TABLE groq_cache_off RENAME TO groq_cache")
+    assert await cache.flush_hits() == 1
+    assert await read_hits(cache) == 1
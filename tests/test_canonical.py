@@ -0,0 +1,34 @@
+import pytest
+
+from locales.ingredients import INGREDIENTS
+from services.canonical import SYNONYMS, canonical_items, canonicalize_products, normalize_item
+
+@pytest.mark.parametrize("word, lang", [
+    ("radis", "fr"), ("ananas", "fr"), ("noix", "fr"), ("pâtes", "fr"), ("molasses", "en"),
+    ("hummus", "en"), ("asparagus", "en"), ("hähnchen", "de"), ("kürbis", "de"), ("res", "es"),
+])
+def test_singular_words_are_kept(word, lang):
+    assert normalize_item(word, lang) == word
+
+@pytest.mark.parametrize("word, lang, singular", [
+    ("tomatoes", "en", "tomato"), ("berries", "en", "berry"), ("peaches", "en", "peach"),
+    ("green beans", "en", "green bean"), ("mangoes", "en", "mango"), ("carottes", "fr", "carotte"),
+    ("zwiebeln", "de", "zwiebel"), ("cebollas", "es", "cebolla"), ("prawns", "en", "shrimp"),
+])
+def test_known_plurals_are_merged(word, lang, singular):
+    assert normalize_item(word, lang) == singular
+
+def test_unknown_words_are_not_cut():
+    # Незнакомое слово оставляем как есть, а не гадаем по окончанию
+    assert normalize_item("gochujangs", "en") == "gochujangs"
+
+@pytest.mark.parametrize("lang", sorted(INGREDIENTS))
+def test_lexicon_words_do_not_collide(lang):
+    # Каждое слово словаря - своя каноническая форма (кроме синонимов), ключи разных продуктов не совпадают
+    for item in INGREDIENTS[lang]:
+        if item not in SYNONYMS[lang]:
+            assert normalize_item(item, lang) == item
+
+def test_canonical_key_is_order_and_plural_insensitive():
+    assert canonicalize_products("Eggs, tomatoes", "en") == canonicalize_products("tomato and  egg", "en")
+    assert canonical_items("radis, radi", "fr") == ["radi", "radis"]
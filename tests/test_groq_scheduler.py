@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+from services.groq_scheduler import GroqScheduler, TokenBucket, PRIORITY_PREMIUM, PRIORITY_BACKGROUND_FREE
+
+LIMITS = {"big": {"rpm": 100, "tpm": 1000}, "small": {"rpm": 100, "tpm": 1000}}
+
+def make_scheduler(concurrency: int = 8) -> GroqScheduler:
+    return GroqScheduler(LIMITS, 30, 6000, concurrency, 0)
+
+async def test_models_have_separate_token_buckets():
+    scheduler = make_scheduler()
+    try:
+        async def call():
+            return "ok"
+        # Ведро big исчерпано ...
+        await scheduler.run(call, est_tokens=1000, model="big")
+        blocked = asyncio.create_task(scheduler.run(call, est_tokens=900, model="big"))
+        await asyncio.sleep(0.05)
+        assert not blocked.done()
+
+        # ... а запросы к small идут без ожидания
+        started = time.monotonic()
+        assert await asyncio.wait_for(scheduler.run(call, est_tokens=900, model="small"), 1) == "ok"
+        assert time.monotonic() - started < 0.5
+        blocked.cancel()
+    finally:
+        await scheduler.close()
+
+async def test_bucket_debt_is_bounded():
+    bucket = TokenBucket(1000)
+    bucket.consume(800)
+    bucket.consume(5000)  # Доплата за фактический расход сверх резерва
+    assert bucket.tokens == -bucket.capacity
+    bucket.consume(-10 ** 6)  # Возврат не переполняет ведро
+    assert bucket.tokens == bucket.capacity
+
+async def test_usage_over_estimate_is_carried_as_debt():
+    scheduler = make_scheduler()
+    try:
+        async def call():
+            return 1500
+        await scheduler.run(call, est_tokens=100, usage_of=lambda used: used, model="big")
+        # Израсходовано 1500 при ведре 1000: следующий запрос ждёт, пока долг не отработается
+        limits = scheduler.model_limits("big")
+        assert limits.tokens.tokens < -400
+        assert limits.wait_time(100) > 30  # (500 долга + 100) / (1000 в минуту)
+        assert scheduler.stats()["models"]["big"]["tpm_left"] < 0
+    finally:
+        await scheduler.close()
+
+async def test_priority_within_model():
+    scheduler = make_scheduler(concurrency=1)
+    order = []
+    gate = asyncio.Event()
+    try:
+        async def first():
+            await gate.wait()
+        async def tagged(tag):
+            order.append(tag)
+        running = asyncio.create_task(scheduler.run(first, model="big"))
+        await asyncio.sleep(0.01)
+        low = asyncio.create_task(scheduler.run(lambda: tagged("background"), PRIORITY_BACKGROUND_FREE, 10, model="big"))
+        high = asyncio.create_task(scheduler.run(lambda: tagged("premium"), PRIORITY_PREMIUM, 10, model="big"))
+        await asyncio.sleep(0.01)
+        gate.set()
+        await asyncio.gather(running, low, high)
+        assert order == ["premium", "background"]
+    finally:
+        await scheduler.close()
+
+async def test_unknown_model_uses_defaults():
+    scheduler = make_scheduler()
+    limits = scheduler.model_limits("other")
+    assert limits.tokens.capacity == 6000 and limits.requests.capacity == 30
+
+async def test_promote_queued_job():
+    scheduler = make_scheduler(concurrency=1)
+    order = []
+    gate = asyncio.Event()
+    try:
+        async def first():
+            await gate.wait()
+        async def tagged(tag):
+            order.append(tag)
+        running = asyncio.create_task(scheduler.run(first, model="big"))
+        await asyncio.sleep(0.01)
+        other = asyncio.create_task(scheduler.run(lambda: tagged("other"), PRIORITY_BACKGROUND_FREE, 10, model="big"))
+        prefetch = asyncio.create_task(
+            scheduler.run(lambda: tagged("prefetch"), PRIORITY_BACKGROUND_FREE, 10, model="big", key="dish_list:k"))
+        await asyncio.sleep(0.01)
+        assert not scheduler.promote("unknown", PRIORITY_PREMIUM)
+        assert scheduler.promote("dish_list:k", PRIORITY_PREMIUM)
+        assert not scheduler.promote("dish_list:k", PRIORITY_PREMIUM)  # Уже с этим приоритетом
+        gate.set()
+        await asyncio.gather(running, other, prefetch)
+        assert order == ["prefetch", "other"]
+        assert scheduler._promoted == {}
+    finally:
+        await scheduler.close()
@@ -0,0 +1,205 @@
+import asyncio
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from config import GROQ_MODEL_FAST
+from database.cache import groq_cache
+from services.groq_scheduler import groq_scheduler, PRIORITY_BACKGROUND_FREE
+from services.groq_service import GroqService
+
+def completion(text: str):
+    usage = SimpleNamespace(prompt_tokens=50, completion_tokens=20, total_tokens=70)
+    choice = SimpleNamespace(message=SimpleNamespace(content=text), finish_reason="stop")
+    return SimpleNamespace(choices=[choice], usage=usage)
+
+def stream_chunk(text=None, finish_reason=None, usage=None):
+    choice = SimpleNamespace(delta=SimpleNamespace(content=text), finish_reason=finish_reason)
+    return SimpleNamespace(choices=[choice], x_groq=SimpleNamespace(usage=usage) if usage else None)
+
+class FakeGroq:
+    """Клиент Groq: пишет журнал запросов; стрим отдаёт куски по одному после каждого release()."""
+
+    def __init__(self, text: str = '{"dishes": [{"name": "Soup"}]}', chunks=("Step 1. ", "Step 2. ", "Done.")):
+        self.text = text
+        self.chunks = list(chunks)
+        self.calls = []
+        self._released = asyncio.Semaphore(0)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def release(self, n: int = 1) -> None:
+        for _ in range(n):
+            self._released.release()
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        if kwargs.get("stream"):
+            return self._stream()
+        return completion(self.text)
+
+    async def _stream(self):
+        for piece in self.chunks:
+            await self._released.acquire()
+            yield stream_chunk(piece)
+        usage = SimpleNamespace(prompt_tokens=50, completion_tokens=30, total_tokens=80)
+        yield stream_chunk(None, "stop", usage)
+
+async def collect(generator, into):
+    async for piece in generator:
+        into.append(piece)
+    return "".join(into)
+
+@pytest.fixture
+async def service(pg, monkeypatch):
+    await groq_cache.ensure_schema()
+    monkeypatch.setattr(groq_scheduler, "max_concurrency", 1)
+    svc = GroqService()
+    svc.client = FakeGroq()
+    yield svc
+    await groq_scheduler.close()
+
+async def test_interactive_tap_promotes_prefetch(service):
+    order = []
+    gate = asyncio.Event()
+
+    async def blocker():
+        await gate.wait()
+
+    async def other_background():
+        order.append("other")
+
+    # Единственный слот занят, в очереди уже стоит чужой фоновый запрос
+    busy = asyncio.create_task(groq_scheduler.run(blocker, model=GROQ_MODEL_FAST))
+    await asyncio.sleep(0.01)
+    other = asyncio.create_task(groq_scheduler.run(other_background, PRIORITY_BACKGROUND_FREE, 10, model=GROQ_MODEL_FAST))
+    await asyncio.sleep(0.01)
+
+    original = service.client.create
+    async def tracked(**kwargs):
+        order.append("dish_list")
+        return await original(**kwargs)
+    service.client.chat.completions.create = tracked
+
+    prefetch = asyncio.create_task(
+        service.generate_dishes_list("carrot, potato, beet", "soup", "en", 7, background=True))
+    await asyncio.sleep(0.01)
+    tap = asyncio.create_task(service.generate_dishes_list("carrot, potato, beet", "soup", "en", 7))
+    await asyncio.sleep(0.01)
+    assert groq_scheduler.stats()["promoted"] == 1
+
+    gate.set()
+    prefetched, served = await asyncio.gather(prefetch, tap)
+    await asyncio.gather(busy, other)
+    # Список блюд ушёл в Groq один раз и раньше чужого фонового запроса
+    assert order == ["dish_list", "other"]
+    assert served == prefetched == [{"name": "Soup"}]
+
+async def test_identical_streams_share_one_groq_stream(service):
+    first, second = [], []
+    leader = asyncio.create_task(collect(service.stream_recipe("Borscht A", "", "en", 1), first))
+    await asyncio.sleep(0.01)
+    service.client.release()
+    await asyncio.sleep(0.01)
+    assert first == ["Step 1. "]
+
+    # Подключившийся позже получает и уже отданные куски
+    follower = asyncio.create_task(collect(service.stream_recipe("Borscht A", "", "en", 2), second))
+    await asyncio.sleep(0.01)
+    assert second == ["Step 1. "]
+
+    # Весь стрим занимает слот очереди, а не только его открытие
+    assert groq_scheduler.stats()["in_flight"] == 1
+    service.client.release(2)
+    assert await leader == await follower == "Step 1. Step 2. Done."
+    assert len(service.client.calls) == 1
+    assert groq_scheduler.stats()["in_flight"] == 0
+
+async def test_recipe_request_waits_for_running_stream(service):
+    pieces = []
+    stream = asyncio.create_task(collect(service.stream_recipe("Borscht B", "", "en", 1, is_direct=True), pieces))
+    await asyncio.sleep(0.01)
+    plain = asyncio.create_task(service.generate_recipe("Borscht B", "", "en", 2, is_direct=True))
+    await asyncio.sleep(0.01)
+    service.client.release(3)
+    assert await plain == await stream == "Step 1. Step 2. Done."
+    assert len(service.client.calls) == 1
+
+async def test_stream_continues_when_leader_leaves(service):
+    leader = service.stream_recipe("Borscht C", "", "en", 1)
+    service.client.release()
+    assert await leader.__anext__() == "Step 1. "
+    follower_parts = []
+    follower = asyncio.create_task(collect(service.stream_recipe("Borscht C", "", "en", 2), follower_parts))
+    await asyncio.sleep(0.01)
+    await leader.aclose()  # Первый пользователь ушёл
+    service.client.release(2)
+    assert await follower == "Step 1. Step 2. Done."
+    assert len(service.client.calls) == 1
+
+async def test_stream_falls_back_before_first_chunk(service):
+    original = service.client.create
+    async def failing_main_model(**kwargs):
+        if kwargs["model"] != GROQ_MODEL_FAST:
+            raise RuntimeError("model unavailable")
+        return await original(**kwargs)
+    service.client.chat.completions.create = failing_main_model
+    service.client.release(3)
+    parts = []
+    assert await collect(service.stream_recipe("Borscht D", "", "en", 1), parts) == "Step 1. Step 2. Done."
+    assert [c["model"] for c in service.client.calls] == [GROQ_MODEL_FAST]
+
+def test_fused_pipeline_needs_explicit_rollout(monkeypatch):
+    groq_service_module = sys.modules[GroqService.__module__]
+    svc = GroqService()
+    assert not svc.is_fused_enabled("en")  # По умолчанию - двухшаговый режим с предзагрузкой
+    monkeypatch.setattr(groq_service_module, "FUSED_PIPELINE_ENABLED", True)
+    assert not svc.is_fused_enabled("en")
+    monkeypatch.setattr(groq_service_module, "FUSED_PIPELINE_LANGS", ["de"])
+    assert svc.is_fused_enabled("de")
+    assert not svc.is_fused_enabled("en")
+
+@pytest.mark.parametrize("text, remembered", [
+    ('{"categories": [], "suggestion": null}', True),
+    ('{"suggestion": "no products"}', False),  # Нет явного пустого списка - не кэшируем
+    ("Server Error", False),
+])
+async def test_only_explicit_empty_analysis_is_negative_cached(service, monkeypatch, text, remembered):
+    stored = []
+    input_filter = sys.modules[GroqService.__module__].input_filter
+    monkeypatch.setattr(input_filter, "remember_bad", lambda products, lang: stored.append(products))
+    service.client = FakeGroq(text)
+    assert await service.analyze_products(f"stock options {len(text)}", "en") is None
+    assert bool(stored) == remembered
+
+class RateLimited(Exception):
+    status_code = 429
+    response = SimpleNamespace(headers={"retry-after": "0.01"})
+
+async def test_breaker_times_only_the_http_call(service):
+    route = {"timeout": 15.0}
+    breaker = service._breaker(GROQ_MODEL_FAST)
+    breaker.slow_call_sec = 0.2
+    gate = asyncio.Event()
+    busy = asyncio.create_task(groq_scheduler.run(gate.wait, model=GROQ_MODEL_FAST))
+    await asyncio.sleep(0.01)
+    call = asyncio.create_task(service._call_model(GROQ_MODEL_FAST, route, "analysis", lambda: asyncio.sleep(0, "ok"), 1, 10))
+    await asyncio.sleep(0.3)  # Запрос стоит в очереди дольше slow_call_sec
+    gate.set()
+    await busy
+    assert await call == "ok"
+    assert list(breaker._results) == [False]
+    assert service._latency[f"analysis:{GROQ_MODEL_FAST}"]._values[0] < 0.2
+
+async def test_rate_limited_call_is_counted_separately(service):
+    attempts = []
+    async def request():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RateLimited()
+        return "ok"
+    assert await service._call_model(GROQ_MODEL_FAST, {"timeout": 15.0}, "dish_list", request, 1, 10) == "ok"
+    assert len(attempts) == 2
+    assert service.retried_calls == 1
+    assert not service._latency[f"dish_list:{GROQ_MODEL_FAST}"]._values
+    assert list(service._breaker(GROQ_MODEL_FAST)._results) == [False]
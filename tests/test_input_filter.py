@@ -0,0 +1,34 @@
+import pytest
+
+from config import PREFILTER_MAX_CHARS
+from database.cache import groq_cache
+from services.input_filter import InputFilter
+
+@pytest.fixture
+async def input_filter(pg):
+    await groq_cache.ensure_schema()
+    return InputFilter()
+
+@pytest.mark.parametrize("text, lang", [
+    ("kimchi, gochujang", "en"),  # Нет в словаре - решает модель
+    ("курица, рис", "en"),
+    ("tomatoes, onions and garlic", "en"),
+    ("buy some stock options", "en"),
+])
+async def test_words_are_never_rejected_locally(input_filter, text, lang):
+    assert await input_filter.rejection_reason(text, lang) is None
+
+@pytest.mark.parametrize("text", ["", "12345 !!!", "a" * (PREFILTER_MAX_CHARS + 1)])
+async def test_garbage_is_rejected(input_filter, text):
+    assert await input_filter.rejection_reason(text, "en") == "prefilter"
+
+def test_lexicon_is_only_a_fast_path():
+    f = InputFilter()
+    assert f.is_definitely_food("tomatoes, onions and garlic", "en")
+    assert not f.is_definitely_food("buy some stock options", "en")
+    assert not f.is_definitely_food("kimchi, gochujang", "en")
+
+async def test_confirmed_rejection_is_cached(input_filter):
+    input_filter.remember_bad("buy some bonds today", "en")
+    assert await input_filter.rejection_reason("buy some bonds today", "en") == "negative_cache"
+    assert await input_filter.rejection_reason("kimchi, gochujang, nori", "en") is None
@@ -0,0 +1,21 @@
+from database import db
+from database.metrics import MetricsRepository
+
+async def test_analysis_latency_by_mode(pg):
+    repo = MetricsRepository()
+    await repo.ensure_schema()
+    async with db.connection() as conn:
+        await conn.execute("""
+        INSERT INTO metrics (user_id, event_name, data)
+        SELECT g, 'analysis_completed',
+               jsonb_build_object('mode', CASE WHEN g % 2 = 0 THEN 'fused' ELSE 'two_step' END,
+                                  'latency_ms', g * 10, 'ok', g <> 1)
+        FROM generate_series(1, 100) g
+        """)
+    latency = await repo.get_analysis_latency(7)
+    assert set(latency) == {"fused", "two_step"}
+    assert latency["fused"]["samples"] == latency["two_step"]["samples"] == 50
+    assert latency["fused"]["p50_ms"] == 510
+    assert latency["two_step"]["p95_ms"] > latency["two_step"]["p50_ms"]
+    assert latency["two_step"]["ok"] == 0.98
+    assert latency["fused"]["ok"] == 1.0
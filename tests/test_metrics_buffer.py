@@ -0,0 +1,32 @@
+import asyncpg
+
+from database import db
+from database.metrics import metrics
+from database.metrics_buffer import MetricsBuffer
+
+async def test_flush_uses_copy(pg, monkeypatch):
+    await metrics.ensure_schema()
+    buffer = MetricsBuffer(batch_size=100, flush_ms=1000, max_size=1000, overflow="drop_oldest")
+    for i in range(250):
+        buffer.add(i, "recipe_generated", {"n": i, "lang": "ru", "dish": "борщ"})
+
+    # Запасной путь (executemany) не должен понадобиться
+    async def no_insert(self, *args, **kwargs):
+        raise AssertionError("executemany fallback used")
+    monkeypatch.setattr(asyncpg.connection.Connection, "executemany", no_insert)
+
+    assert await buffer.flush() == 250
+    assert buffer._use_copy
+    assert buffer.stats["batches"] == 3 and buffer.stats["failed"] == 0
+
+    async with db.connection() as conn:
+        rows = await conn.fetch("SELECT user_id, data FROM metrics ORDER BY user_id")
+    assert len(rows) == 250
+    assert rows[7]["data"] == {"n": 7, "lang": "ru", "dish": "борщ"}
+
+async def test_jsonb_roundtrip(pg):
+    async with db.connection() as conn:
+        value = await conn.fetchval("SELECT $1::jsonb", {"a": [1, 2], "b": "é"})
+        text = await conn.fetchval("SELECT $1::jsonb", '{"ready": true}')
+    assert value == {"a": [1, 2], "b": "é"}
+    assert text == {"ready": True}
@@ -0,0 +1,167 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import database
+from database import db
+from database import metrics as metrics_module
+from database.metrics import MetricsRepository, partition_start
+
+async def create_plain_metrics(rows: int):
+    async with db.connection() as conn:
+        await conn.execute("""
+        CREATE TABLE metrics (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            event_name TEXT NOT NULL,
+            data JSONB,
+            created_at TIMESTAMPTZ DEFAULT NOW()
+        )
+        """)
+        await conn.execute("""
+        INSERT INTO metrics (user_id, event_name, data, created_at)
+        SELECT g, 'old', '{}'::jsonb, NOW() - make_interval(days => g % 60) FROM generate_series(1, $1) g
+        """, rows)
+        await conn.execute("INSERT INTO metrics (user_id, event_name, created_at) VALUES (0, 'no_time', NULL)")
+
+async def partitions(conn):
+    return await conn.fetch("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'metrics'::regclass ORDER BY 1
+    """)
+
+async def test_convert_existing_table(pg):
+    await create_plain_metrics(500)
+    repo = MetricsRepository()
+    await repo.ensure_schema()
+    assert repo.partitioned
+
+    async with db.connection() as conn:
+        assert await conn.fetchval("SELECT relkind::text FROM pg_class WHERE relname = 'metrics'") == "p"
+        names = [r["relname"] for r in await partitions(conn)]
+        assert "metrics_legacy" in names and "metrics_default" in names
+        assert await conn.fetchval("SELECT COUNT(*) FROM metrics") == 501
+        assert await conn.fetchval("SELECT COUNT(*) FROM metrics WHERE created_at = 'epoch'") == 1
+        # Индекс родителя валиден: индексы всех секций, включая metrics_legacy, подцеплены
+        assert await conn.fetchval(
+            "SELECT indisvalid FROM pg_index WHERE indexrelid = 'idx_metrics_event_created'::regclass"
+        )
+        # Новые строки получают id после старых
+        new_id = await conn.fetchval("INSERT INTO metrics (event_name) VALUES ('new') RETURNING id")
+        assert new_id > 500
+
+    # Повторный запуск ничего не меняет
+    await repo.ensure_schema()
+    assert repo.partitioned
+
+async def test_fresh_table_and_default_partition(pg):
+    repo = MetricsRepository()
+    await repo.ensure_schema()
+    far = datetime.now(timezone.utc) + timedelta(days=365)
+    async with db.connection() as conn:
+        await conn.execute("INSERT INTO metrics (event_name, created_at) VALUES ('late', $1)", far)
+        assert await conn.fetchval("SELECT COUNT(*) FROM metrics_default") == 1
+        assert await conn.fetchval(
+            "SELECT indisvalid FROM pg_index WHERE indexrelid = 'idx_metrics_event_created'::regclass"
+        )
+
+async def test_late_partition_takes_rows_from_default(pg, monkeypatch):
+    repo = MetricsRepository()
+    await repo.ensure_schema()
+    async with db.connection() as conn:
+        upper = max((await repo._partition_bounds(conn)).values())
+        await conn.execute("INSERT INTO metrics (event_name, created_at) VALUES ('late', $1::date + 1)", upper)
+    monkeypatch.setattr(metrics_module, "METRICS_PARTITIONS_AHEAD", 3)
+    assert await repo.ensure_partitions() == 1
+    async with db.connection() as conn:
+        assert await conn.fetchval("SELECT COUNT(*) FROM metrics_default") == 0
+        assert await conn.fetchval("SELECT COUNT(*) FROM metrics WHERE event_name = 'late'") == 1
+
+@pytest.mark.parametrize("new_period", [1, 30])
+async def test_period_change_does_not_overlap(pg, monkeypatch, new_period):
+    repo = MetricsRepository()
+    await repo.ensure_schema()
+    monkeypatch.setattr(metrics_module, "METRICS_PARTITION_DAYS", new_period)
+    monkeypatch.setattr(metrics_module, "METRICS_PARTITIONS_AHEAD", 4)
+    await repo.ensure_partitions()
+    assert repo.partitioned
+
+    async with db.connection() as conn:
+        ranges = await conn.fetch("""
+            SELECT (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'FROM \\(''([0-9-]+)'))[1]::date AS lo,
+                   (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''([0-9-]+)'))[1]::date AS hi
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'metrics'::regclass AND c.relname <> 'metrics_default' ORDER BY 1
+        """)
+    assert ranges
+    # Секции идут встык и покрывают период вперёд
+    for prev, cur in zip(ranges, ranges[1:]):
+        assert prev["hi"] == cur["lo"]
+    today = datetime.now(timezone.utc).date()
+    assert ranges[-1]["hi"] >= partition_start(today, new_period) + timedelta(days=new_period * 5)
+
+async def test_retention_drops_partitions(pg):
+    repo = MetricsRepository()
+    await repo.ensure_schema()
+    async with db.connection() as conn:
+        await conn.execute("CREATE TABLE metrics_p20000103 PARTITION OF metrics FOR VALUES FROM ('2000-01-03') TO ('2000-01-10')")
+        await conn.execute("INSERT INTO metrics (event_name, created_at) VALUES ('x', '2000-01-04'), ('y', '1999-01-01')")
+    assert await repo.cleanup_old_metrics() == 1
+    async with db.connection() as conn:
+        assert await conn.fetchval("SELECT COUNT(*) FROM metrics") == 0
+
+async def test_long_steps_outlive_pool_command_timeout(pg, monkeypatch):
+    await create_plain_metrics(100)
+    async with db.connection() as conn:
+        # VALIDATE и CREATE INDEX CONCURRENTLY идут дольше клиентского таймаута пула
+        await conn.execute("""
+        CREATE FUNCTION slow_ddl() RETURNS event_trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF current_query() ILIKE '%VALIDATE CONSTRAINT%' OR current_query() ILIKE '%INDEX CONCURRENTLY%' THEN
+                PERFORM pg_sleep(1.5);
+            END IF;
+        END $$;
+        CREATE EVENT TRIGGER slow_ddl ON ddl_command_start EXECUTE FUNCTION slow_ddl();
+        """)
+    await db.close()
+    monkeypatch.setattr(database, "DB_COMMAND_TIMEOUT", 0.5)
+    repo = MetricsRepository()
+    await repo.ensure_schema()
+    assert repo.partitioned
+    async with db.connection() as conn:
+        await conn.execute("DROP EVENT TRIGGER slow_ddl")
+        assert await conn.fetchval(
+            "SELECT indisvalid FROM pg_index WHERE indexrelid = 'idx_metrics_event_created'::regclass"
+        )
+        assert not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM pg_index WHERE NOT indisvalid)")
+
+async def test_cleanup_reads_mode_from_catalog(pg):
+    await MetricsRepository().ensure_schema()
+    async with db.connection() as conn:
+        await conn.execute("CREATE TABLE metrics_p20000103 PARTITION OF metrics FOR VALUES FROM ('2000-01-03') TO ('2000-01-10')")
+    # Новый экземпляр (как при старте, пока ensure_schema в фоне) всё равно удаляет секцию целиком
+    repo = MetricsRepository()
+    assert not repo.partitioned
+    assert await repo.cleanup_old_metrics() == 1
+
+async def test_cleanup_skipped_during_migration(pg):
+    await create_plain_metrics(10)
+    repo = MetricsRepository()
+    async with repo._migration_lock():
+        assert await repo.cleanup_old_metrics() == 0
+    async with db.connection() as conn:
+        assert await conn.fetchval("SELECT COUNT(*) FROM metrics") == 11
+
+async def test_detach_does_not_queue_behind_reader(pg, monkeypatch):
+    repo = MetricsRepository()
+    await repo.ensure_schema()
+    async with db.connection() as conn:
+        await conn.execute("CREATE TABLE metrics_p20000103 PARTITION OF metrics FOR VALUES FROM ('2000-01-03') TO ('2000-01-10')")
+    monkeypatch.setattr(metrics_module, "METRICS_MIGRATION_LOCK_TIMEOUT_MS", 100)
+    monkeypatch.setattr(metrics_module, "METRICS_DETACH_RETRIES", 2)
+    async with db.connection() as reader:
+        async with reader.transaction():
+            await reader.fetchval("SELECT COUNT(*) FROM metrics")  # Долгий читатель держит ACCESS SHARE
+            assert await repo.cleanup_old_metrics() == 0
+    assert await repo.cleanup_old_metrics() == 1
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from services.single_flight import SingleFlight
+
+async def test_followers_survive_leader_cancellation():
+    flight = SingleFlight()
+    gate = asyncio.Event()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await gate.wait()
+        return "recipe"
+
+    leader = asyncio.create_task(flight.do("k", fn))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(flight.do("k", fn))
+    await asyncio.sleep(0)
+    leader.cancel()  # Первый пользователь нажал ещё раз / таймаут хендлера
+    await asyncio.sleep(0)
+    gate.set()
+    assert await follower == "recipe"
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    assert calls == [1]
+    assert not flight.is_inflight("k")
+
+async def test_call_cancelled_when_nobody_waits():
+    flight = SingleFlight()
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def fn():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    first = asyncio.create_task(flight.do("k", fn))
+    second = asyncio.create_task(flight.do("k", fn))
+    await started.wait()
+    first.cancel()
+    await asyncio.sleep(0)
+    assert not cancelled.is_set()
+    second.cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
+    await asyncio.sleep(0)
+    assert len(flight) == 0
+
+async def test_error_reaches_every_caller():
+    flight = SingleFlight()
+    gate = asyncio.Event()
+
+    async def fn():
+        await gate.wait()
+        raise RuntimeError("groq down")
+
+    callers = [asyncio.create_task(flight.do("k", fn)) for _ in range(3)]
+    await asyncio.sleep(0)
+    gate.set()
+    results = await asyncio.gather(*callers, return_exceptions=True)
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert flight.coalesced == 2
@@ -0,0 +1,48 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+from database import db
+from database.users import users_repo
+from config import FREE_USER_LIMITS, PREMIUM_USER_LIMITS
+
+LIMIT = 5
+CALLS = 40
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setitem(FREE_USER_LIMITS, "daily_requests", LIMIT)
+    monkeypatch.setitem(PREMIUM_USER_LIMITS, "daily_requests", LIMIT * 4)
+
+async def add_user(user_id: int, **fields):
+    columns = ["user_id", *fields]
+    values = ", ".join(f"${i + 1}" for i in range(len(columns)))
+    async with db.connection() as conn:
+        await conn.execute(f"INSERT INTO users ({', '.join(columns)}) VALUES ({values})", user_id, *fields.values())
+
+async def test_parallel_requests_respect_limit(pg, limits):
+    await add_user(1)
+    results = await asyncio.gather(*(users_repo.check_and_increment_request(1) for _ in range(CALLS)))
+
+    allowed = [r for r in results if r[0]]
+    assert len(allowed) == LIMIT
+    assert sorted(used for _, used, _ in allowed) == list(range(1, LIMIT + 1))
+    assert all(lim == LIMIT for _, _, lim in results)
+    async with db.connection() as conn:
+        row = await conn.fetchrow("SELECT requests_today, total_requests FROM users WHERE user_id = 1")
+    assert row["requests_today"] == LIMIT and row["total_requests"] == LIMIT
+
+async def test_premium_limit_and_day_reset(pg, limits):
+    await add_user(2, is_premium=True, requests_today=LIMIT * 4, voice_requests_today=3,
+                   last_reset_date=date(2000, 1, 1))
+    results = await asyncio.gather(*(users_repo.check_and_increment_request(2) for _ in range(CALLS)))
+
+    # Вчерашние счётчики сброшены, действует премиум-лимит
+    assert sum(1 for r in results if r[0]) == LIMIT * 4
+    stats = await users_repo.get_usage_stats(2)
+    assert stats["voice_requests_used"] == 0
+    assert stats["text_requests_used"] == LIMIT * 4
+
+async def test_unknown_user(pg, limits):
+    assert await users_repo.check_and_increment_request(404) == (False, 0, 0)